@@ -2,16 +2,47 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import datetime
+import hashlib
+import heapq
+import io
 import math
+import multiprocessing
 import os
+import pickle
+import posixpath
+import re
+import shutil
 import sys
 import time
 import traceback
 import yaml
+import zipfile
+from array import array
+from decimal import Decimal, ROUND_HALF_EVEN
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import quoteattr
 from openpyxl import load_workbook
-from openpyxl.cell import Cell
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.packaging.manifest import Override
+from openpyxl.styles.stylesheet import write_stylesheet
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, WINDOWS_EPOCH, from_excel, from_ISO8601
 from openpyxl.utils.exceptions import InvalidFileException
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.xml.functions import tostring
 from copy import copy
+from itertools import groupby, islice
+from operator import itemgetter
+
+try:
+    import numpy
+except ImportError:  # optional: only used by split_engine / computed_engine: numpy
+    numpy = None
 
 def load_config(config_path):
     """Load configuration from YAML file."""
@@ -26,6 +57,70 @@ def copy_cell_style(source_cell, target_cell):
     if source_cell.has_style and source_cell._style is not None:
         target_cell._style = source_cell._style
 
+def copy_sheet_dimensions(source_ws, target_ws):
+    """Copy column widths and row heights from source to target worksheet."""
+    for col in source_ws.column_dimensions:
+        target_ws.column_dimensions[col].width = source_ws.column_dimensions[col].width
+    for row in source_ws.row_dimensions:
+        target_ws.row_dimensions[row].height = source_ws.row_dimensions[row].height
+
+def make_style_translator(source_ws, target_ws):
+    """Return a function mapping source StyleArrays to equivalent ones in target_ws's workbook.
+
+    Needed when cells move into a workbook with its own style tables (e.g. a
+    write-only workbook). Each distinct source style is registered only once.
+    """
+    probe_src = Cell(source_ws)
+    cache = {}
+
+    def translate(style):
+        key = tuple(style)
+        translated = cache.get(key)
+        if translated is None:
+            probe_src._style = copy(style)
+            probe = WriteOnlyCell(target_ws)
+            probe.font = copy(probe_src.font)
+            probe.fill = copy(probe_src.fill)
+            probe.border = copy(probe_src.border)
+            probe.number_format = probe_src.number_format
+            probe.protection = copy(probe_src.protection)
+            probe.alignment = copy(probe_src.alignment)
+            probe._style.quotePrefix = style.quotePrefix
+            probe._style.pivotButton = style.pivotButton
+            translated = cache[key] = probe._style
+        return copy(translated)
+
+    return translate
+
+def to_write_only_row(ws, cells, translate_style=None):
+    """Convert a list of cells into a row for a write-only worksheet."""
+    return to_write_only_values(ws, [cell.value for cell in cells], cells, translate_style)
+
+def to_write_only_values(ws, values, style_cells, translate_style=None):
+    """Convert a list of values, styled like the matching style_cells, into a row for a write-only worksheet."""
+    row = []
+    for value, style_cell in zip(values, style_cells):
+        styled = translate_style is not None and style_cell.has_style
+        if value is None and not styled:
+            row.append(None)
+            continue
+        new_cell = WriteOnlyCell(ws, value=value)
+        if styled:
+            new_cell._style = translate_style(style_cell._style)
+        row.append(new_cell)
+    return row
+
+def result_style_cells(source_row, width):
+    """Cells supplying the per-column styles of the result rows split from source_row.
+
+    Result rows are plain value lists; their styles are resolved from these
+    cells only when written. Columns past the end of the source row (appended
+    payment output columns) take the style of its first cell.
+    """
+    style_cells = list(source_row)
+    style_cells.extend(source_row[:1] * (width - len(style_cells)))
+    return style_cells
+
 def get_column_index(headers, column_name):
     """Get column index (1-based) for a given column name."""
     try:
@@ -34,6 +129,35 @@ def get_column_index(headers, column_name):
         return None
 
 
+def get_header_values(ws):
+    """Return the header row (row 1) of a worksheet as a list of values."""
+    return list(next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ()))
+
+
+def iter_row_values(ws, width, min_row=2, max_row=None):
+    """Yield row value tuples starting at min_row, padded to at least width.
+
+    Works for normal and read-only worksheets alike; read-only rows can be
+    shorter than the header when the sheet carries no dimension record.
+    """
+    for row in ws.iter_rows(min_row=min_row, max_row=max_row, values_only=True):
+        if len(row) < width:
+            row = row + (None,) * (width - len(row))
+        yield row
+
+
+def used_max_row(ws):
+    """Last row holding a value in a normal worksheet, or None for read-only sheets.
+
+    Formatted but empty rows below the data count towards ws.max_row; they
+    are not part of the used range.
+    """
+    cells = getattr(ws, '_cells', None)
+    if cells is None:
+        return None
+    return max((row for (row, _col), cell in cells.items() if cell.value is not None), default=1)
+
+
 def is_empty_value(value):
     """Return True if value is None, '', or a whitespace-only string."""
     if value is None:
@@ -42,7 +166,888 @@ def is_empty_value(value):
         return value.strip() == ''
     return False
 
-import re
+class SheetTable:
+    """Decoded, column-oriented contents of one worksheet's data rows.
+
+    The sheet is read once into per-column value lists. Derived columns
+    (empty-value masks, stripped string keys, float conversions) are decoded
+    on first use and cached, so validation, splitting and verification all
+    share a single decoding pass. Column arguments are 1-based indices, as
+    returned by get_column_index.
+
+    When keep (a set of header names) is given, only those columns are
+    stored; the other columns are pruned and read as None in row().
+
+    Only the sheet's used range is kept: formatting-only rows after the last
+    row holding a value are dropped, so every phase stops at the real data.
+    """
+
+    def __init__(self, name, headers, rows, keep=None):
+        self.name = name
+        self.headers = list(headers)
+        width = len(self.headers)
+        self._derived = {}
+        if keep is None:
+            self.columns = [list(col) for col in zip(*(row[:width] for row in rows))]
+            if not self.columns:
+                self.columns = [[] for _ in range(width)]
+            self.nrows = len(self.columns[0]) if self.columns else 0
+            self._trim_blank_tail()
+            return
+
+        # Projected load: pick the kept cells of each row, and record blank rows
+        # while the full row is at hand
+        kept = [i for i, header in enumerate(self.headers) if header in keep]
+        if len(kept) == 1:
+            only = kept[0]
+            pick = lambda row: (row[only],)
+        elif kept:
+            pick = itemgetter(*kept)
+        else:
+            pick = lambda row: ()
+        picked = []
+        blank = bytearray()
+        for row in rows:
+            picked.append(pick(row))
+            blank.append(row[:width].count(None) == width)
+        self.columns = [None] * width
+        kept_columns = zip(*picked) if picked else [[] for _ in kept]
+        for i, values in zip(kept, kept_columns):
+            self.columns[i] = list(values)
+        self.nrows = len(picked)
+        self._derived['blank_rows'] = blank
+        self._trim_blank_tail()
+
+    @classmethod
+    def from_worksheet(cls, ws, keep=None):
+        """Decode a (normal or read-only) worksheet; row 1 is the header."""
+        headers = get_header_values(ws)
+        return cls(ws.title, headers, iter_row_values(ws, len(headers), max_row=used_max_row(ws)), keep)
+
+    @classmethod
+    def from_columns(cls, name, headers, columns):
+        """Rebuild a table from already decoded column lists (e.g. from the sheet cache)."""
+        table = cls(name, headers, ())
+        if columns:
+            table.columns = [list(col) for col in columns]
+            table.nrows = len(table.columns[0])
+            table._trim_blank_tail()
+        return table
+
+    def _trim_blank_tail(self):
+        """Drop the all-None rows after the last row holding a value."""
+        blank = self._derived.get('blank_rows')
+        last = self.nrows
+        if blank is not None:
+            while last and blank[last - 1]:
+                last -= 1
+        else:
+            while last and all(column[last - 1] is None for column in self.columns):
+                last -= 1
+        if last == self.nrows:
+            return
+        for column in self.columns:
+            if column is not None:
+                del column[last:]
+        if blank is not None:
+            del blank[last:]
+        self.nrows = last
+
+    def values(self, col):
+        """Raw cell values of a column."""
+        values = self.columns[col - 1]
+        if values is None:
+            raise KeyError(f"Column '{self.headers[col - 1]}' of sheet '{self.name}' was not loaded")
+        return values
+
+    def row(self, idx):
+        """Values of one data row (0-based index) as a tuple."""
+        return tuple(column[idx] if column is not None else None for column in self.columns)
+
+    def _derive(self, kind, col, decode):
+        key = (kind, col)
+        derived = self._derived.get(key)
+        if derived is None:
+            derived = self._derived[key] = decode(self.values(col))
+        return derived
+
+    def nulls(self, col):
+        """Null mask of a column: 1 where is_empty_value() holds."""
+        return self._derive('nulls', col,
+                            lambda values: bytearray(is_empty_value(v) for v in values))
+
+    def keys(self, col):
+        """Normalized key column: str(value).strip(), '' for None."""
+        return self._derive('keys', col,
+                            lambda values: [str(v).strip() if v is not None else '' for v in values])
+
+    def floats(self, col):
+        """Float column: float(value), or None where the value is None or non-numeric."""
+        return self._derive('floats', col, lambda values: [_to_float(v) for v in values])
+
+    def blank_rows(self):
+        """Row mask: 1 where every cell of the row is None (formatting-only rows)."""
+        blank = self._derived.get('blank_rows')
+        if blank is None:
+            blank = bytearray(self.nrows)
+            if self.columns:
+                blank = bytearray(all(v is None for v in row) for row in zip(*self.columns))
+            self._derived['blank_rows'] = blank
+        return blank
+
+
+def _to_float(value):
+    """float(value), or None when value is None or not convertible."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def projected_columns(config, sheet_key):
+    """Header names of an input sheet that validation, splitting and verification read."""
+    sheet_cfg = config['input']['sheet'][sheet_key]
+    names = set(sheet_cfg.get('columns', {}).values())
+    names.update(sheet_cfg.get('null_check_columns') or [])
+    if sheet_key == 'source':
+        names.update(config['input']['splitting_columns'])
+        names.update(config['input'].get('computed_columns') or {})
+    elif sheet_key == 'payment':
+        names.update(sheet_cfg.get('output_columns') or [])
+    return names
+
+
+def load_sheet_tables(config, wb, prune=True, keep_source=False):
+    """Decode the configured source, reference and payment sheets of wb into SheetTables.
+
+    With prune, only the columns named in the configuration (see
+    projected_columns) are decoded; keep_source still decodes the whole
+    source sheet (when the result rows take their values from the table).
+    Missing sheets are reported and abort processing.
+    """
+    tables = {}
+    for sheet_key, label in (('source', 'Source'), ('reference', 'Reference'), ('payment', 'Payment')):
+        sheet_name = config['input']['sheet'][sheet_key]['name']
+        if sheet_name not in wb.sheetnames:
+            fatal(f"Error: {label} sheet '{sheet_name}' does not exist")
+        keep = None
+        if prune and not (keep_source and sheet_key == 'source'):
+            keep = projected_columns(config, sheet_key)
+        if isinstance(wb, XlsxValueReader):
+            tables[sheet_key] = wb.read_table(sheet_name, keep)
+        else:
+            tables[sheet_key] = SheetTable.from_worksheet(wb[sheet_name], keep)
+    return tables
+
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_DOC_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def _cast_number(text):
+    """Numeric cell text -> int or float, as openpyxl does."""
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+
+def _coordinate_to_tuple(coord):
+    """'AB12' -> (12, 28)."""
+    col = 0
+    for i, ch in enumerate(coord):
+        if ch.isdigit():
+            return int(coord[i:]), col
+        col = col * 26 + ord(ch.upper()) - 64
+    raise ValueError(f"Invalid cell coordinate '{coord}'")
+
+
+def _string_item_text(node):
+    """Plain text of a shared/inline string item (<t> and rich text runs, phonetic runs excluded)."""
+    parts = []
+    for child in node:
+        if child.tag == _MAIN_NS + 't':
+            parts.append(child.text or '')
+        elif child.tag == _MAIN_NS + 'r':
+            parts.append(child.findtext(_MAIN_NS + 't') or '')
+    return ''.join(parts)
+
+
+def _rels_path(part):
+    """Archive path of a part's relationships file ('' is the package root)."""
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', name + '.rels')
+
+
+def read_part_rels(archive, part):
+    """Relationships of a package part: id -> (type, target, external).
+
+    Internal targets are resolved to archive paths.
+    """
+    rels = {}
+    rels_path = _rels_path(part)
+    if rels_path not in archive.NameToInfo:
+        return rels
+    base = posixpath.dirname(part)
+    for _event, node in iterparse(archive.open(rels_path)):
+        if node.tag == _PKG_REL_NS + 'Relationship':
+            target = node.get('Target')
+            external = node.get('TargetMode') == 'External'
+            if not external:
+                if target.startswith('/'):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join(base, target))
+            rels[node.get('Id')] = (node.get('Type'), target, external)
+    return rels
+
+
+def read_workbook_sheets(archive):
+    """Locate the workbook part of an xlsx archive.
+
+    Returns (workbook_part, workbook_rels, {worksheet name: part}, date1904).
+    """
+    workbook_part = next(target for rel_type, target, _external in read_part_rels(archive, '').values()
+                         if rel_type.endswith('/officeDocument'))
+    rels = read_part_rels(archive, workbook_part)
+    sheet_parts = {}
+    date1904 = False
+    for _event, node in iterparse(archive.open(workbook_part)):
+        if node.tag == _MAIN_NS + 'workbookPr':
+            date1904 = node.get('date1904') in ('1', 'true')
+        elif node.tag == _MAIN_NS + 'sheet':
+            rel = rels.get(node.get(_DOC_REL_NS + 'id'))
+            if rel is not None and rel[0].endswith('/worksheet'):
+                sheet_parts[node.get('name')] = rel[1]
+    return workbook_part, rels, sheet_parts, date1904
+
+
+# Stand-in for the value of a cell in a pruned column: present, but never decoded
+_UNDECODED = object()
+
+
+def _cell_has_value(node):
+    """Whether a <c> element carries a value, without decoding it."""
+    if node.get('t') == 'inlineStr':
+        return node.find(_MAIN_NS + 'is') is not None
+    return bool(node.findtext(_MAIN_NS + 'v'))
+
+
+class XlsxValueReader:
+    """Value-only reader that parses worksheet XML straight out of the xlsx zip.
+
+    No openpyxl workbook or Cell objects are built: the worksheet part and
+    sharedStrings.xml are read with an incremental XML parser and each sheet
+    is returned as a SheetTable. Cell values match a data_only openpyxl
+    workbook, including date/time conversion by number format, the 1904 date
+    system and merged ranges (whose covered cells read as None).
+    """
+
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path)
+        _workbook_part, rels, self._sheet_parts, date1904 = read_workbook_sheets(self.archive)
+        self.epoch = CALENDAR_MAC_1904 if date1904 else WINDOWS_EPOCH
+
+        self._shared_strings_part = None
+        self._date_styles, self._timedelta_styles = set(), set()
+        for rel_type, target, _external in rels.values():
+            if rel_type.endswith('/sharedStrings'):
+                self._shared_strings_part = target
+            elif rel_type.endswith('/styles'):
+                self._read_date_styles(target)
+        self._shared_strings = None
+
+    @property
+    def sheetnames(self):
+        return list(self._sheet_parts)
+
+    def close(self):
+        self.archive.close()
+
+    def _read_date_styles(self, styles_part):
+        """Collect the cell style indices whose number format is a date or a duration."""
+        custom_formats = {}
+        style_formats = []
+        in_cell_xfs = False
+        for event, node in iterparse(self.archive.open(styles_part), events=('start', 'end')):
+            if node.tag == _MAIN_NS + 'cellXfs':
+                in_cell_xfs = event == 'start'
+            elif event == 'end' and node.tag == _MAIN_NS + 'numFmt':
+                custom_formats[int(node.get('numFmtId'))] = node.get('formatCode')
+            elif event == 'end' and node.tag == _MAIN_NS + 'xf' and in_cell_xfs:
+                style_formats.append(int(node.get('numFmtId', 0)))
+        for style_id, fmt_id in enumerate(style_formats):
+            fmt = custom_formats.get(fmt_id) or builtin_format_code(fmt_id)
+            if fmt is None:
+                continue
+            if is_date_format(fmt):
+                self._date_styles.add(style_id)
+            if is_timedelta_format(fmt):
+                self._timedelta_styles.add(style_id)
+
+    def _strings(self):
+        if self._shared_strings is None:
+            self._shared_strings = []
+            if self._shared_strings_part is not None:
+                for _event, node in iterparse(self.archive.open(self._shared_strings_part)):
+                    if node.tag == _MAIN_NS + 'si':
+                        self._shared_strings.append(_string_item_text(node).replace('x005F_', ''))
+                        node.clear()
+        return self._shared_strings
+
+    def _cell_value(self, node):
+        data_type = node.get('t', 'n')
+        if data_type == 'inlineStr':
+            child = node.find(_MAIN_NS + 'is')
+            return _string_item_text(child) if child is not None else None
+        value = node.findtext(_MAIN_NS + 'v') or None
+        if value is None:
+            return None
+        if data_type == 'n':
+            value = _cast_number(value)
+            style_id = int(node.get('s') or 0)
+            if style_id in self._date_styles:
+                try:
+                    return from_excel(value, self.epoch, timedelta=style_id in self._timedelta_styles)
+                except (OverflowError, ValueError):
+                    return '#VALUE!'
+            return value
+        if data_type == 's':
+            return self._strings()[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        if data_type == 'd':
+            return from_ISO8601(value)
+        return value  # 'str' (formula result) and 'e' (error) keep their text
+
+    def read_table(self, sheet_name, keep=None):
+        """Decode one worksheet into a SheetTable; row 1 is the header.
+
+        With keep (a set of header names), cells of other columns are never
+        decoded; they are only checked for presence so blank rows are still
+        detected.
+        """
+        rows = {}  # row number -> {column: value}
+        max_row = max_col = 0
+        merged = []
+        row_counter = 0
+        keep_cols = None  # column numbers to decode, known once the header row is read
+        for _event, node in iterparse(self.archive.open(self._sheet_parts[sheet_name])):
+            if node.tag == _MAIN_NS + 'row':
+                row_counter = int(float(node.get('r'))) if node.get('r') else row_counter + 1
+                if keep is not None and keep_cols is None and row_counter > 1:
+                    header = rows.get(1, {})
+                    keep_cols = {c for c, name in header.items() if name in keep}
+                col_counter = 0
+                cells = {}
+                for cell in node.iter(_MAIN_NS + 'c'):
+                    coord = cell.get('r')
+                    if coord:
+                        _row, col_counter = _coordinate_to_tuple(coord)
+                    else:
+                        col_counter += 1
+                    if keep_cols is None or col_counter in keep_cols:
+                        value = self._cell_value(cell)
+                    else:
+                        value = _UNDECODED if _cell_has_value(cell) else None
+                    if value is not None:
+                        cells[col_counter] = value
+                    max_col = max(max_col, col_counter)
+                if len(node):
+                    max_row = max(max_row, row_counter)
+                if cells:
+                    rows[row_counter] = cells
+                node.clear()
+            elif node.tag == _MAIN_NS + 'mergeCell':
+                merged.append(node.get('ref'))
+
+        # Cells covered by a merged range (all but its top-left cell) read as empty
+        for ref in merged:
+            first, _sep, last = ref.partition(':')
+            min_r, min_c = _coordinate_to_tuple(first)
+            max_r, max_c = _coordinate_to_tuple(last or first)
+            max_row, max_col = max(max_row, max_r), max(max_col, max_c)
+            for r in range(min_r, max_r + 1):
+                cells = rows.get(r)
+                if cells:
+                    for c in range(min_c, max_c + 1):
+                        if (r, c) != (min_r, min_c):
+                            cells.pop(c, None)
+
+        max_row, max_col = max(max_row, 1), max(max_col, 1)
+        header = rows.get(1, {})
+        headers = [header.get(c) for c in range(1, max_col + 1)]
+        empty = {}
+        # Rows below the last one holding a value are formatting only
+        data_rows = (tuple(map(rows.get(r, empty).get, range(1, max_col + 1)))
+                     for r in range(2, max(rows, default=1) + 1))
+        return SheetTable(sheet_name, headers, data_rows, keep)
+
+
+# Relationship types a worksheet may carry and still be passed through raw:
+# their parts are self-contained and need no workbook-wide registration or ids
+_PASSTHROUGH_REL_TYPES = ('/drawing', '/image', '/chart', '/chartUserShapes', '/printerSettings',
+                          '/hyperlink', '/chartStyle', '/chartColorStyle', '/themeOverride', '/package')
+
+_PLACEHOLDER_SHEET_XML = (b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                          b'<sheetData/></worksheet>')
+
+
+class SelectiveWorkbook:
+    """Open an xlsx with openpyxl parsing only some of its worksheets.
+
+    Every other worksheet is replaced by an empty placeholder when loading, so
+    openpyxl never parses it, yet sheet order, names, visibility and defined
+    names stay intact. save() writes the workbook and puts the original sheet
+    XML back in place of each placeholder, together with its drawings, charts
+    and images (relocated under xl/passthrough/) and the original shared
+    strings. Sheets with parts that need workbook-wide registration (tables,
+    pivot tables, comments, ...) are always parsed. Sheets named in discard
+    are loaded as placeholders and not restored (e.g. a result sheet that is
+    about to be replaced).
+    """
+
+    def __init__(self, path, sheet_names, discard=()):
+        self.path = path
+        with zipfile.ZipFile(path) as archive:
+            _workbook_part, rels, sheet_parts, _date1904 = read_workbook_sheets(archive)
+            self._sst_part = next((target for rel_type, target, _external in rels.values()
+                                   if rel_type.endswith('/sharedStrings')), None)
+            self._content_types = self._read_content_types(archive)
+
+            self.raw_sheets = {}  # sheet name -> (sheet part, dependency parts)
+            self._discarded = set()
+            for name, part in sheet_parts.items():
+                if name in sheet_names:
+                    continue
+                if name in discard:
+                    self._discarded.add(part)
+                    continue
+                deps = self._dependencies(archive, part)
+                if deps is not None:
+                    self.raw_sheets[name] = (part, deps)
+
+    @staticmethod
+    def _read_content_types(archive):
+        defaults, overrides = {}, {}
+        for _event, node in iterparse(archive.open('[Content_Types].xml')):
+            if node.tag.endswith('}Default'):
+                defaults[node.get('Extension').lower()] = node.get('ContentType')
+            elif node.tag.endswith('}Override'):
+                overrides[node.get('PartName').lstrip('/')] = node.get('ContentType')
+        return defaults, overrides
+
+    def _content_type(self, part):
+        defaults, overrides = self._content_types
+        if part in overrides:
+            return overrides[part]
+        return defaults.get(posixpath.splitext(part)[1][1:].lower(), 'application/octet-stream')
+
+    @staticmethod
+    def _dependencies(archive, part):
+        """Parts reachable from a worksheet's relationships, or None if one is not passthrough-safe."""
+        deps = []
+        pending = [part]
+        while pending:
+            for rel_type, target, external in read_part_rels(archive, pending.pop()).values():
+                if not rel_type.endswith(_PASSTHROUGH_REL_TYPES):
+                    return None
+                if external or target in deps or target == part:
+                    continue
+                deps.append(target)
+                pending.append(target)
+        return deps
+
+    def load(self, data_only=False):
+        """load_workbook() on a copy of the package whose passthrough sheets are empty placeholders."""
+        placeholders = set(self._discarded)
+        placeholders.update(part for part, _deps in self.raw_sheets.values())
+        skipped = {_rels_path(part) for part in placeholders}
+        buf = io.BytesIO()
+        with zipfile.ZipFile(self.path) as src, zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as dst:
+            for info in src.infolist():
+                if info.filename in skipped:
+                    continue
+                if info.filename in placeholders:
+                    dst.writestr(info.filename, _PLACEHOLDER_SHEET_XML)
+                else:
+                    dst.writestr(info.filename, src.read(info))
+        buf.seek(0)
+        return load_workbook(buf, data_only=data_only)
+
+    def save(self, wb, output_path):
+        """Save wb (loaded via load()) with the passthrough sheets restored."""
+        relocated = {}  # original dependency part -> its path in the output
+        for _part, deps in self.raw_sheets.values():
+            for dep in deps:
+                relocated.setdefault(dep, 'xl/passthrough/' + (dep[3:] if dep.startswith('xl/') else dep))
+
+        positions = {ws.title: idx for idx, ws in enumerate(wb.worksheets, 1)}
+        replaced = {}  # placeholder part written by openpyxl -> original sheet part
+        # (output path, original part, owner part in output, owner part in input);
+        # owners are set for relationships files, whose targets get relocated
+        extra_parts = []
+        for name, (part, _deps) in self.raw_sheets.items():
+            out_part = f"xl/worksheets/sheet{positions[name]}.xml"
+            replaced[out_part] = part
+            extra_parts.append((_rels_path(out_part), _rels_path(part), out_part, part))
+        for dep, out_dep in relocated.items():
+            extra_parts.append((out_dep, dep, None, None))
+            extra_parts.append((_rels_path(out_dep), _rels_path(dep), out_dep, dep))
+
+        with zipfile.ZipFile(self.path) as src:
+            archive = zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+            try:
+                patches = {}
+                if self._sst_part is not None and self.raw_sheets:
+                    patches['xl/_rels/workbook.xml.rels'] = _add_shared_strings_rel
+                writer = ExcelWriter(wb, _PatchingArchive(archive, src, replaced, patches))
+                for out_part, part, owner, _owner_src in extra_parts:
+                    if owner is None:
+                        writer.manifest.Override.append(
+                            Override(PartName='/' + out_part, ContentType=self._content_type(part)))
+                if 'xl/_rels/workbook.xml.rels' in patches:
+                    writer.manifest.Override.append(
+                        Override(PartName='/xl/sharedStrings.xml', ContentType=self._content_type(self._sst_part)))
+                wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+                writer.write_data()
+
+                # Parts written after the manifest, so openpyxl never inspects their extensions
+                if 'xl/_rels/workbook.xml.rels' in patches:
+                    archive.writestr('xl/sharedStrings.xml', src.read(self._sst_part))
+                for out_part, part, owner, owner_src in extra_parts:
+                    if part not in src.NameToInfo:
+                        continue
+                    data = src.read(part)
+                    if owner is not None:
+                        data = _relocate_rels(data, owner_src, owner, relocated)
+                    archive.writestr(out_part, data)
+            finally:
+                archive.close()
+
+
+_WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+_WORKSHEET_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+
+
+def _write_sheet_xml(ws):
+    """Serialize a worksheet (normal or write-only) to a temporary file; returns its writer."""
+    if isinstance(ws, WriteOnlyWorksheet):
+        if not ws.closed:
+            ws.close()
+        return ws._writer
+    writer = WorksheetWriter(ws)
+    writer.write()
+    return writer
+
+
+def _count_cell_styles(archive, styles_part):
+    """Number of cell formats (cellXfs entries) in a styles part."""
+    count = 0
+    in_cell_xfs = False
+    for event, node in iterparse(archive.open(styles_part), events=('start', 'end')):
+        if node.tag == _MAIN_NS + 'cellXfs':
+            in_cell_xfs = event == 'start'
+        elif event == 'end' and in_cell_xfs and node.tag == _MAIN_NS + 'xf':
+            count += 1
+    return count
+
+
+def save_passthrough(input_path, output_path, result_ws):
+    """Write the output as the input package plus the result sheet.
+
+    Every part of the input archive is copied unchanged except the workbook
+    part, its relationships and the content types, which only gain an entry
+    for the result sheet. If the input already has a sheet with the result
+    sheet's title, its part is replaced in place. result_ws belongs to the
+    workbook loaded from input_path, so its style indices are those of the
+    input's styles part; the styles part is only rewritten when the result
+    sheet needed a cell format the input did not have.
+    """
+    wb = result_ws.parent
+    title = result_ws.title
+    sheet_writer = _write_sheet_xml(result_ws)
+    try:
+        _save_passthrough(input_path, output_path, wb, title, sheet_writer.out)
+    finally:
+        sheet_writer.cleanup()
+
+
+def _save_passthrough(input_path, output_path, wb, title, sheet_file):
+    with zipfile.ZipFile(input_path) as src:
+        workbook_part, rels, sheet_parts, _date1904 = read_workbook_sheets(src)
+        base = posixpath.dirname(workbook_part)
+        workbook_rels_part = _rels_path(workbook_part)
+        styles_part = next((target for rel_type, target, _external in rels.values()
+                            if rel_type.endswith('/styles')), None)
+        styles_xml = None
+        if styles_part is None or len(wb._cell_styles) > _count_cell_styles(src, styles_part):
+            styles_part = styles_part or posixpath.join(base, 'styles.xml')
+            styles_xml = tostring(write_stylesheet(wb))
+
+        patched = {}
+        if title in sheet_parts:
+            sheet_part = sheet_parts[title]
+            dropped = {_rels_path(sheet_part)}
+        else:
+            dropped = set()
+            names = set(src.NameToInfo)
+            index = len(sheet_parts) + 1
+            while posixpath.join(base, 'worksheets', f'sheet{index}.xml') in names:
+                index += 1
+            sheet_part = posixpath.join(base, 'worksheets', f'sheet{index}.xml')
+            rel_index = len(rels) + 1
+            while f'rId{rel_index}' in rels:
+                rel_index += 1
+            rel_id = f'rId{rel_index}'
+
+            workbook_xml = src.read(workbook_part)
+            sheet_ids = [int(v) for v in re.findall(rb'\ssheetId="(\d+)"', workbook_xml)]
+            prefix = re.search(rb'</(\w+:)?sheets>', workbook_xml)
+            r_ns = re.search(rb'xmlns:(\w+)="http://schemas.openxmlformats.org/officeDocument/2006/relationships"',
+                             workbook_xml)
+            r_attr = (r_ns.group(1) + b':id') if r_ns else \
+                b'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" r:id'
+            sheet_element = b'<%ssheet name=%s sheetId="%d" %s="%s"/>' % (
+                prefix.group(1) or b'', quoteattr(title).encode('utf-8'), max(sheet_ids, default=0) + 1,
+                r_attr, rel_id.encode('ascii'))
+            patched[workbook_part] = workbook_xml[:prefix.start()] + sheet_element + workbook_xml[prefix.start():]
+
+            rels_xml = src.read(workbook_rels_part)
+            target = posixpath.relpath(sheet_part, base).encode('utf-8')
+            end = rels_xml.rindex(b'</')
+            patched[workbook_rels_part] = (rels_xml[:end] + b'<Relationship Id="%s" Type="%s" Target="%s"/>' % (
+                rel_id.encode('ascii'), _WORKSHEET_REL_TYPE.encode('ascii'), target) + rels_xml[end:])
+
+            types_xml = src.read('[Content_Types].xml')
+            end = types_xml.rindex(b'</')
+            patched['[Content_Types].xml'] = (types_xml[:end] + b'<Override PartName="/%s" ContentType="%s"/>' % (
+                sheet_part.encode('utf-8'), _WORKSHEET_CONTENT_TYPE.encode('ascii')) + types_xml[end:])
+
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as dst:
+            for info in src.infolist():
+                name = info.filename
+                if name in dropped or name == sheet_part:
+                    continue
+                if name in patched:
+                    dst.writestr(name, patched[name])
+                elif name == styles_part and styles_xml is not None:
+                    dst.writestr(name, styles_xml)
+                else:
+                    with src.open(info) as part_src, dst.open(info.filename, 'w') as part_dst:
+                        shutil.copyfileobj(part_src, part_dst, 1 << 20)
+            dst.write(sheet_file, sheet_part)
+            if styles_xml is not None and styles_part not in src.NameToInfo:
+                dst.writestr(styles_part, styles_xml)
+
+
+def load_input_workbook(path, selective=None, data_only=False):
+    """load_workbook(), through the SelectiveWorkbook when selective loading is on."""
+    if selective is not None:
+        return selective.load(data_only=data_only)
+    return load_workbook(path, data_only=data_only)
+
+
+class _PatchingArchive:
+    """ZipFile wrapper used while openpyxl writes a SelectiveWorkbook.
+
+    Placeholder sheet parts are swapped for the original sheet XML and
+    selected parts are patched.
+    """
+
+    def __init__(self, archive, src, replaced, patches):
+        self._archive = archive
+        self._src = src
+        self._replaced = replaced
+        self._patches = patches
+
+    def write(self, filename, arcname=None, *args, **kwargs):
+        if arcname in self._replaced:
+            self._archive.writestr(arcname, self._src.read(self._replaced[arcname]))
+        else:
+            self._archive.write(filename, arcname, *args, **kwargs)
+
+    def writestr(self, name, data, *args, **kwargs):
+        if name in self._patches:
+            data = self._patches[name](data)
+        self._archive.writestr(name, data, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._archive, name)
+
+
+def _add_shared_strings_rel(data):
+    """Register xl/sharedStrings.xml in openpyxl's workbook relationships."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    rel = (b'<Relationship Id="rIdPassthroughSST" Target="sharedStrings.xml" '
+           b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>')
+    end = data.rindex(b'</')
+    return data[:end] + rel + data[end:]
+
+
+def _relocate_rels(data, src_part, out_part, relocated):
+    """Point the internal targets of a copied relationships file at the relocated parts."""
+    src_base = posixpath.dirname(src_part)
+    out_base = posixpath.dirname(out_part)
+
+    def fix(match):
+        element = match.group(0)
+        if b'TargetMode="External"' in element:
+            return element
+        target_match = re.search(rb'Target="([^"]*)"', element)
+        target = target_match.group(1).decode('utf-8')
+        resolved = target[1:] if target.startswith('/') else posixpath.normpath(posixpath.join(src_base, target))
+        if resolved not in relocated:
+            return element
+        new_target = posixpath.relpath(relocated[resolved], out_base).encode('utf-8')
+        return element[:target_match.start(1)] + new_target + element[target_match.end(1):]
+
+    return re.sub(rb'<(?:\w+:)?Relationship\b[^>]*>', fix, data)
+
+
+SHEET_CACHE_VERSION = 1
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sheet_cache_path(config, input_path):
+    """Cache file for the decoded input sheets, keyed by file content hash and sheet names."""
+    key = hashlib.sha256()
+    key.update(f"v{SHEET_CACHE_VERSION}:{file_sha256(input_path)}".encode('utf-8'))
+    for sheet_key in ('source', 'reference', 'payment'):
+        key.update(b'\0' + config['input']['sheet'][sheet_key]['name'].encode('utf-8'))
+    return os.path.join(config['cache_dir'], key.hexdigest() + '.pickle')
+
+
+def evict_sheet_cache(config):
+    """Drop cache entries older than cache_max_age_days, then the oldest ones
+    until the cache directory fits in cache_max_size_mb."""
+    cache_dir = config['cache_dir']
+    max_age = config.get('cache_max_age_days', 7) * 86400
+    max_size = config.get('cache_max_size_mb', 200) * 1024 * 1024
+    now = time.time()
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.pickle'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if now - st.st_mtime > max_age:
+            os.remove(path)
+        else:
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _mtime, size, _path in entries)
+    for _mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        os.remove(path)
+        total -= size
+
+
+def load_cached_tables(config, input_path):
+    """Return the cached SheetTables for input_path, or None on a cache miss.
+
+    A hit refreshes the entry's modification time, so eviction drops the
+    least recently used entries first. Unreadable entries count as misses.
+    """
+    path = sheet_cache_path(config, input_path)
+    max_age = config.get('cache_max_age_days', 7) * 86400
+    try:
+        if time.time() - os.path.getmtime(path) > max_age:
+            return None
+        with open(path, 'rb') as f:
+            payload = pickle.load(f)
+        os.utime(path)
+    except Exception:
+        return None
+    return {sheet_key: SheetTable.from_columns(*entry) for sheet_key, entry in payload.items()}
+
+
+def save_cached_tables(config, input_path, tables):
+    """Store the decoded sheets for later runs on the same input file, then evict stale entries.
+
+    Cache write failures are reported but never abort processing.
+    """
+    try:
+        os.makedirs(config['cache_dir'], exist_ok=True)
+        path = sheet_cache_path(config, input_path)
+        payload = {sheet_key: (table.name, table.headers, table.columns)
+                   for sheet_key, table in tables.items()}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        evict_sheet_cache(config)
+    except Exception as e:
+        print(f"警告：写入表格缓存失败: {e}")
+
+
+VALIDATION_CACHE_VERSION = 2
+
+
+class _DigestWriter:
+    """File-like sink that feeds written bytes into a hash object."""
+
+    def __init__(self, digest):
+        self.write = digest.update
+
+
+def validation_cache_path(ctx, sheet_key, rule_classes, errors_so_far):
+    """Cache file for one validation sheet pass.
+
+    Keyed by the decoded contents of the sheet, its configuration section,
+    the rules run on it and the error budget settings, so an unchanged sheet
+    hits across runs and across configurations sharing the cache directory.
+    """
+    config = ctx.config
+    settings = (sheet_key, config['input']['sheet'][sheet_key], [cls.__qualname__ for cls in rule_classes],
+                ctx.error_budget, ctx.fail_fast, errors_so_far if ctx.fail_fast else 0)
+    key = hashlib.sha256(f"validation-v{VALIDATION_CACHE_VERSION}:{settings!r}".encode('utf-8'))
+    table = ctx.tables[sheet_key]
+    pickler = pickle.Pickler(_DigestWriter(key), protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.fast = True  # no memo: the digest depends on the values only, not on object identity
+    pickler.dump((table.headers, table.columns))
+    return os.path.join(config['cache_dir'], 'validation-' + key.hexdigest() + '.pickle')
+
+
+def load_cached_validation(config, path):
+    """Return a cached sheet pass result (see _sheet_pass_worker), or None on a miss."""
+    max_age = config.get('cache_max_age_days', 7) * 86400
+    try:
+        if time.time() - os.path.getmtime(path) > max_age:
+            return None
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+        os.utime(path)
+    except Exception:
+        return None
+    return result
+
+
+def save_cached_validation(config, path, result):
+    """Store a sheet pass result; failures are reported but never abort processing."""
+    try:
+        os.makedirs(config['cache_dir'], exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        evict_sheet_cache(config)
+    except Exception as e:
+        print(f"警告：写入验证结果缓存失败: {e}")
 
 
 class FormulaError(Exception):
@@ -50,20 +1055,30 @@ class FormulaError(Exception):
     pass
 
 
+# Built-in formula functions -> (minimum, maximum) number of arguments (None: unbounded)
+FORMULA_FUNCTIONS = {'ROUND': (2, 2), 'MIN': (1, None), 'MAX': (1, None), 'ABS': (1, 1), 'IF': (3, 3)}
+
+# Comparison operators; they evaluate to 1.0 (true) or 0.0 (false)
+FORMULA_COMPARISONS = ('=', '<>', '<', '<=', '>', '>=')
+
+
 def tokenize_formula(formula, known_names):
     """Tokenize a formula string into tokens (column names, operators, numbers, parens).
 
     Uses longest-match regex against known_names so column names containing
     parentheses (e.g. 税前应发工资总额(不含差补)) are matched as single tokens.
+    A built-in function name followed by '(' (case-insensitive) becomes one
+    token such as 'MAX(', unless a known column name starting that way
+    (e.g. 'MAX(月)') matches there.
     """
-    # Build alternation pattern: longest names first so they match before substrings
-    if known_names:
-        str_names = [str(n) for n in known_names]
-        escaped = [re.escape(n) for n in sorted(str_names, key=len, reverse=True)]
-        name_pattern = '|'.join(escaped)
-        pattern = re.compile(r'(?:' + name_pattern + r')|(?:\d+(?:\.\d+)?)')
-    else:
-        pattern = re.compile(r'(?:\d+(?:\.\d+)?)')
+    # Build alternation pattern: longest names first so they match before substrings.
+    # Names that start like a function call go before the functions, the others after
+    function_pattern = r'(?P<function>(?i:' + '|'.join(FORMULA_FUNCTIONS) + r')\s*\()'
+    call_like = []
+    other_names = []
+    for name in sorted((str(n) for n in known_names or ()), key=len, reverse=True):
+        (call_like if re.match(function_pattern, name) else other_names).append(re.escape(name))
+    pattern = re.compile('|'.join(call_like + [function_pattern] + other_names + [r'(?:\d+(?:\.\d+)?)']))
 
     tokens = []
     pos = 0
@@ -76,13 +1091,22 @@ def tokenize_formula(formula, known_names):
             if ch.isspace():
                 i += 1
                 continue
-            if ch in '+-*/()':
+            if ch in '+-*/(),=':
                 tokens.append(ch)
                 i += 1
                 continue
+            if ch in '<>':
+                # <, <=, <> and >, >=
+                if text[i + 1:i + 2] == '=' or (ch == '<' and text[i + 1:i + 2] == '>'):
+                    tokens.append(text[i:i + 2])
+                    i += 2
+                else:
+                    tokens.append(ch)
+                    i += 1
+                continue
             # Collect consecutive non-operator chars as unknown word
             j = i
-            while j < len(text) and not text[j].isspace() and text[j] not in '+-*/()':
+            while j < len(text) and not text[j].isspace() and text[j] not in '+-*/(),=<>':
                 j += 1
             word = text[i:j]
             raise FormulaError(f"无法识别的列名 '{word}'")
@@ -90,7 +1114,10 @@ def tokenize_formula(formula, known_names):
     for m in pattern.finditer(formula):
         gap = formula[pos:m.start()]
         scan_gap(gap)
-        tokens.append(m.group(0))
+        if m.group('function'):
+            tokens.append(m.group('function')[:-1].strip().upper() + '(')
+        else:
+            tokens.append(m.group(0))
         pos = m.end()
 
     # Process trailing characters
@@ -103,9 +1130,14 @@ def parse_formula(tokens):
     """Recursive-descent parser for formula tokens.
 
     Grammar:
-      expr   -> term (('+' | '-') term)*
-      term   -> factor (('*' | '/') factor)*
-      factor -> NAME | NUMBER | '(' expr ')' | '-' factor
+      expr       -> comparison
+      comparison -> sum (('=' | '<>' | '<' | '<=' | '>' | '>=') sum)*
+      sum        -> term (('+' | '-') term)*
+      term       -> factor (('*' | '/') factor)*
+      factor     -> NAME | NUMBER | '(' expr ')' | '-' factor | FUNCTION '(' expr (',' expr)* ')'
+
+    Function calls become ('call', name, (argument, ...)); the number of
+    decimals of ROUND must be a constant.
     """
     pos = [0]  # mutable position tracker
 
@@ -119,6 +1151,14 @@ def parse_formula(tokens):
         return t
 
     def expr():
+        left = sum_()
+        while peek() in FORMULA_COMPARISONS:
+            op = consume()
+            right = sum_()
+            left = (op, left, right)
+        return left
+
+    def sum_():
         left = term()
         while peek() in ('+', '-'):
             op = consume()
@@ -134,6 +1174,21 @@ def parse_formula(tokens):
             left = (op, left, right)
         return left
 
+    def call(name):
+        args = [expr()]
+        while peek() == ',':
+            consume()
+            args.append(expr())
+        if peek() != ')':
+            raise FormulaError("缺少右括号 ')'")
+        consume()
+        least, most = FORMULA_FUNCTIONS[name]
+        if len(args) < least or (most is not None and len(args) > most):
+            raise FormulaError(f"函数 {name} 的参数个数不正确")
+        if name == 'ROUND' and collect_refs(args[1]):
+            raise FormulaError("ROUND 的小数位数必须是常数")
+        return ('call', name, tuple(args))
+
     def factor():
         t = peek()
         if t is None:
@@ -148,8 +1203,11 @@ def parse_formula(tokens):
         if t == '-':
             consume()
             return ('-', ('num', 0.0), factor())
-        if t in ('+', '*', '/'):
+        if t in ('+', '*', '/', ',', ')') or t in FORMULA_COMPARISONS:
             raise FormulaError(f"意外的运算符 '{t}'")
+        if t.endswith('(') and t[:-1] in FORMULA_FUNCTIONS:
+            consume()
+            return call(t[:-1])
         # Number literal
         try:
             val = float(t)
@@ -174,6 +1232,9 @@ def collect_refs(ast):
         refs.append(ast[1])
     elif ast[0] == 'num':
         pass
+    elif ast[0] == 'call':
+        for arg in ast[2]:
+            refs.extend(collect_refs(arg))
     else:
         # Binary or unary operator
         if len(ast) == 3:
@@ -184,11 +1245,51 @@ def collect_refs(ast):
     return refs
 
 
+def apply_formula_operator(op, left, right):
+    """The value of a binary formula operator; comparisons give 1.0 or 0.0."""
+    if op == '+':
+        return left + right
+    if op == '-':
+        return left - right
+    if op == '*':
+        return left * right
+    if op == '/':
+        if right == 0:
+            raise FormulaError("除零错误")
+        return left / right
+    if op == '=':
+        return 1.0 if left == right else 0.0
+    if op == '<>':
+        return 1.0 if left != right else 0.0
+    if op == '<':
+        return 1.0 if left < right else 0.0
+    if op == '<=':
+        return 1.0 if left <= right else 0.0
+    if op == '>':
+        return 1.0 if left > right else 0.0
+    if op == '>=':
+        return 1.0 if left >= right else 0.0
+    raise FormulaError(f"未知运算符 '{op}'")
+
+
+def apply_formula_function(name, args):
+    """The value of a built-in function other than IF (which evaluates lazily)."""
+    if name == 'ROUND':
+        return round(args[0], int(args[1]))
+    if name == 'MIN':
+        return min(args)
+    if name == 'MAX':
+        return max(args)
+    if name == 'ABS':
+        return abs(args[0])
+    raise FormulaError(f"未知函数 '{name}'")
+
+
 def evaluate_formula(ast, values):
     """Evaluate a formula AST against a values dict (name -> float).
 
     None values are treated as 0.0.  Division by zero raises FormulaError.
-    Result is rounded to 2 decimal places.
+    Only the chosen branch of IF is evaluated.
     """
     if ast[0] == 'num':
         return ast[1]
@@ -197,129 +1298,717 @@ def evaluate_formula(ast, values):
         if v is None:
             v = 0.0
         return v
+    if ast[0] == 'call':
+        name, args = ast[1], ast[2]
+        if name == 'IF':
+            return evaluate_formula(args[1] if evaluate_formula(args[0], values) != 0 else args[2], values)
+        return apply_formula_function(name, [evaluate_formula(arg, values) for arg in args])
     # Unary minus: ('-', ('num', 0.0), operand)
     if ast[0] == '-' and len(ast) == 3 and ast[1] == ('num', 0.0):
         return -evaluate_formula(ast[2], values)
     # Binary operators
-    op = ast[0]
     left = evaluate_formula(ast[1], values)
     right = evaluate_formula(ast[2], values)
-    if op == '+':
-        return left + right
-    if op == '-':
-        return left - right
-    if op == '*':
-        return left * right
-    if op == '/':
-        if right == 0:
-            raise FormulaError("除零错误")
-        return left / right
-    raise FormulaError(f"未知运算符 '{op}'")
+    return apply_formula_operator(ast[0], left, right)
 
 
-def split_row(source_row, ref_by_employee, source_headers, reference_headers, config,
-              source_col_map, ref_col_map, splitting_col_set):
-    """Split a row based on reference data."""
-    # Precompute all column indices once using O(1) map lookups
-    employee_id_col = source_col_map[config['input']['sheet']['source']['columns']['employee_id']]
-    ref_hours_col = ref_col_map[config['input']['sheet']['reference']['columns']['project_hours']]
-    project_id_col = source_col_map.get(config['input']['sheet']['source']['columns']['project_id'])
-    project_category_col = source_col_map.get(config['input']['sheet']['source']['columns']['project_category'])
-    project_hours_col = source_col_map.get(config['input']['sheet']['source']['columns']['project_hours'])
-    ref_project_id_col = ref_col_map.get(config['input']['sheet']['reference']['columns']['project_id'])
-    ref_project_category_col = ref_col_map.get(config['input']['sheet']['reference']['columns']['project_category'])
-    ref_project_hours_col = ref_col_map.get(config['input']['sheet']['reference']['columns']['project_hours'])
+class FormulaProgram:
+    """All computed_columns formulas optimized together into straight-line steps.
+
+    Formulas are resolved against operands: 'v<i>' for the referenced
+    columns read from the row (loads: (operand, 0-based position), in
+    ref_names order) and 'c<k>' for the k-th computed column once it has
+    been computed, so later formulas reuse it. Expressions use ('var',
+    operand) leaves and ('neg', operand) for unary minus. Then:
+
+    - constant folding: operators and functions with constant arguments
+      (and IF with a constant condition) become numbers, except division
+      by zero, which is left to fail at evaluation as before;
+    - common subexpressions: a subtree occurring more than once across all
+      formulas becomes a temporary 't<j>' computed once, ahead of its first
+      use. Subtrees with a division that only occur inside IF branches
+      stay in place, as their evaluation is conditional.
+
+    steps are (operand, expression, 0-based column position or None for
+    temporaries), in evaluation order. Computed column values are rounded
+    to 2 places.
+    """
+
+    def __init__(self, computed_asts, ref_names, source_col_map):
+        operands = {}
+        self.loads = []
+        for i, name in enumerate(ref_names):
+            operands[name] = f'v{i}'
+            self.loads.append((f'v{i}', source_col_map[name] - 1))
+        formulas = []
+        for k, (cc_name, ast, cc_idx) in enumerate(computed_asts):
+            formulas.append((f'c{k}', self._fold(self._resolve(ast, operands)), cc_idx - 1))
+            operands[cc_name] = f'c{k}'
+
+        occurrences = {}  # subtree -> [count, has an unconditional occurrence]
+        for _operand, expression, _pos in formulas:
+            self._count(expression, occurrences, False)
+        self._shared = {expression: None for expression, (count, unconditional) in occurrences.items()
+                        if count > 1 and (unconditional or not self._divides(expression))}
+
+        self.steps = []
+        for operand, expression, pos in formulas:
+            self.steps.append((operand, self._share(expression), pos))
+
+    def _resolve(self, ast, operands):
+        if ast[0] == 'num':
+            return ast
+        if ast[0] == 'ref':
+            operand = operands.get(ast[1])
+            return ('var', operand) if operand is not None else ('num', 0.0)
+        if ast[0] == 'call':
+            return ('call', ast[1], tuple(self._resolve(arg, operands) for arg in ast[2]))
+        if ast[0] == '-' and ast[1] == ('num', 0.0):
+            return ('neg', self._resolve(ast[2], operands))
+        return (ast[0], self._resolve(ast[1], operands), self._resolve(ast[2], operands))
+
+    def _fold(self, ast):
+        kind = ast[0]
+        if kind in ('num', 'var'):
+            return ast
+        if kind == 'neg':
+            operand = self._fold(ast[1])
+            return ('num', -operand[1]) if operand[0] == 'num' else ('neg', operand)
+        if kind == 'call':
+            args = tuple(self._fold(arg) for arg in ast[2])
+            if ast[1] == 'IF' and args[0][0] == 'num':
+                return args[1] if args[0][1] != 0 else args[2]
+            if ast[1] != 'IF' and all(arg[0] == 'num' for arg in args):
+                return ('num', apply_formula_function(ast[1], [arg[1] for arg in args]))
+            return ('call', ast[1], args)
+        left, right = self._fold(ast[1]), self._fold(ast[2])
+        if left[0] == 'num' and right[0] == 'num' and not (kind == '/' and right[1] == 0):
+            return ('num', apply_formula_operator(kind, left[1], right[1]))
+        return (kind, left, right)
+
+    def _count(self, ast, occurrences, conditional):
+        if ast[0] in ('num', 'var'):
+            return
+        entry = occurrences.setdefault(ast, [0, False])
+        entry[0] += 1
+        entry[1] = entry[1] or not conditional
+        if ast[0] == 'call':
+            for i, arg in enumerate(ast[2]):
+                self._count(arg, occurrences, conditional or (ast[1] == 'IF' and i > 0))
+        else:
+            for operand in ast[1:]:
+                self._count(operand, occurrences, conditional)
+
+    def _divides(self, ast):
+        if ast[0] in ('num', 'var'):
+            return False
+        if ast[0] == '/':
+            return True
+        return any(self._divides(operand) for operand in (ast[2] if ast[0] == 'call' else ast[1:]))
+
+    def _share(self, ast):
+        """ast with shared subtrees replaced by their temporaries, defining those not defined yet."""
+        if ast[0] in ('num', 'var'):
+            return ast
+        if ast[0] == 'call':
+            rewritten = ('call', ast[1], tuple(self._share(arg) for arg in ast[2]))
+        else:
+            rewritten = (ast[0],) + tuple(self._share(operand) for operand in ast[1:])
+        if ast not in self._shared:
+            return rewritten
+        if self._shared[ast] is None:
+            self._shared[ast] = f't{len([step for step in self.steps if step[2] is None])}'
+            self.steps.append((self._shared[ast], rewritten, None))
+        return ('var', self._shared[ast])
+
+
+def formula_source(ast):
+    """Python expression source of a FormulaProgram expression (operands are local variables)."""
+    kind = ast[0]
+    if kind == 'num':
+        return repr(ast[1])
+    if kind == 'var':
+        return ast[1]
+    if kind == 'neg':
+        return f"(-{formula_source(ast[1])})"
+    if kind == 'call':
+        name, args = ast[1], [formula_source(arg) for arg in ast[2]]
+        if name == 'IF':
+            return f"({args[1]} if {args[0]} != 0 else {args[2]})"
+        if name == 'ROUND':
+            digits = ast[2][1]
+            return f"round({args[0]}, {int(digits[1]) if digits[0] == 'num' else f'int({args[1]})'})"
+        if name in ('MIN', 'MAX') and len(args) == 1:
+            return args[0]
+        return f"{name.lower()}({', '.join(args)})"
+    left, right = formula_source(ast[1]), formula_source(ast[2])
+    if kind in FORMULA_COMPARISONS:
+        op = {'=': '==', '<>': '!='}.get(kind, kind)
+        return f"(1.0 if {left} {op} {right} else 0.0)"
+    if kind not in ('+', '-', '*', '/'):
+        raise FormulaError(f"未知运算符 '{kind}'")
+    return f"({left} {kind} {right})"
+
+
+def compile_computed_columns(computed_asts, ref_names, source_col_map):
+    """Compile all computed column formulas into one straight-line Python function.
+
+    The function takes a split result row (a value list padded to the
+    output width) and sets its computed columns in place, with the same
+    results as evaluate_computed_row: the FormulaProgram's referenced
+    columns are read once by their resolved positions into locals (None as
+    0.0), shared subexpressions are computed once and each formula is a
+    single expression over those locals and the earlier computed columns,
+    rounded to 2 places. Division by zero raises FormulaError.
+    """
+    ref_names = list(ref_names)
+    program = FormulaProgram(computed_asts, ref_names, source_col_map)
+    lines = ['def computed_columns(row):', '    try:']
+    for operand, pos in program.loads:
+        lines.append(f'        {operand} = row[{pos}]')
+        lines.append(f'        {operand} = 0.0 if {operand} is None else float({operand})')
+    lines += ['        pass', '    except (ValueError, TypeError):', '        reject(row)', '    try:']
+    for operand, expression, pos in program.steps:
+        if pos is None:
+            lines.append(f'        {operand} = {formula_source(expression)}')
+        else:
+            lines.append(f'        {operand} = round({formula_source(expression)}, 2)')
+            lines.append(f'        row[{pos}] = {operand}')
+    lines += ['        pass', '    except ZeroDivisionError:', '        raise FormulaError("除零错误") from None']
+
+    def reject(row):
+        for hdr_name in ref_names:
+            v = row[source_col_map[hdr_name] - 1]
+            if v is not None:
+                try:
+                    float(v)
+                except (ValueError, TypeError):
+                    fatal(f"Error: 计算列引用的列 '{hdr_name}' 存在非数值 '{v}'")
+
+    namespace = {'round': round, 'float': float, 'min': min, 'max': max, 'abs': abs,
+                 'FormulaError': FormulaError, 'reject': reject}
+    exec(compile('\n'.join(lines), '<computed_columns>', 'exec'), namespace)
+    return namespace['computed_columns']
 
-    employee_id = source_row[employee_id_col - 1].value
 
-    # O(1) lookup in pre-indexed reference dict
-    matching_ref_rows = ref_by_employee.get(employee_id, [])
+class SplitPlan:
+    """How the source rows of one employee_id are split; built once per employee.
+
+    kind is 'copy' (no reference rows: rows are copied as is), 'zero' (total
+    hours are 0: rows are copied unsplit but take the project columns of the
+    first reference row) or 'split'. For each result row, replacements holds
+    the (column, value) pairs taken from its reference row and ref_keys the
+    normalized (project_id, project_category) payment lookup key; ratios
+    holds each reference row's share of the total hours and weights the
+    same hours as exact integers for split_arithmetic: cents ('split' only).
+    """
+
+    __slots__ = ('kind', 'replacements', 'ref_keys', 'ratios', 'weights')
+
+    def __init__(self, kind, replacements=(), ref_keys=(), ratios=None, weights=None):
+        self.kind = kind
+        self.replacements = replacements
+        self.ref_keys = ref_keys
+        self.ratios = ratios
+        self.weights = weights
+
+    @property
+    def fan_out(self):
+        """Number of result rows per source row."""
+        return len(self.ratios) if self.kind == 'split' else 1
+
+    def payment_keys(self, employer_key, project_id_key, project_category_key):
+        """Payment lookup keys of the result rows of a source row with the given normalized keys.
+
+        Split and zero-hour rows take the reference project.
+        """
+        if self.kind == 'copy':
+            return [(employer_key, project_id_key, project_category_key)]
+        return [(employer_key, proj_id_key, proj_category_key)
+                for proj_id_key, proj_category_key in self.ref_keys]
+
+
+class SplitPlanner:
+    """Builds the SplitPlan of each employee_id on first use and reuses it.
+
+    Column indices are resolved from the configuration and reference rows
+    are indexed by employee_id once, so employees with several source rows
+    (multiple employers, corrections) cost one plan.
+    """
+
+    def __init__(self, config, reference, source_col_map, ref_col_map):
+        source_cols = config['input']['sheet']['source']['columns']
+        ref_cols = config['input']['sheet']['reference']['columns']
+        self.reference = reference
+        self.ref_hours_col = ref_col_map[ref_cols['project_hours']]
+        self.ref_hours = reference.floats(self.ref_hours_col)
+        self.ref_proj_id_keys = reference.keys(ref_col_map[ref_cols['project_id']])
+        self.ref_proj_category_keys = reference.keys(ref_col_map[ref_cols['project_category']])
+
+        # Reference columns replacing project_id, project_category, project_hours in result rows
+        self.replaced_columns = []
+        for key in ('project_id', 'project_category', 'project_hours'):
+            col, ref_col = source_col_map.get(source_cols[key]), ref_col_map.get(ref_cols[key])
+            if col and ref_col:
+                self.replaced_columns.append((col, reference.values(ref_col)))
+
+        # Pre-index reference rows by employee_id for O(1) lookup
+        self.ref_by_employee = {}  # employee_id -> reference data row indices
+        for ref_idx, emp_id in enumerate(reference.values(ref_col_map[ref_cols['employee_id']])):
+            self.ref_by_employee.setdefault(emp_id, []).append(ref_idx)
+        self._plans = {}
+
+    def plan(self, employee_id):
+        """The SplitPlan for employee_id."""
+        plan = self._plans.get(employee_id)
+        if plan is None:
+            plan = self._plans[employee_id] = self._build(employee_id)
+        return plan
+
+    def _build(self, employee_id):
+        matching_ref_rows = self.ref_by_employee.get(employee_id)
+        if not matching_ref_rows:
+            return SplitPlan('copy')
+
+        # 计算reference表中匹配行的总工时
+        ref_hours = self.ref_hours
+        total_ref_hours = 0
+        for ref_idx in matching_ref_rows:
+            if ref_hours[ref_idx] is None:
+                fatal(f"Error: Non-numeric project_hours '{self.reference.values(self.ref_hours_col)[ref_idx]}' "
+                      f"in reference sheet for employee_id='{employee_id}'")
+            total_ref_hours += ref_hours[ref_idx]
+
+        if total_ref_hours == 0:
+            # 工时为0时，不拆分金额，但用 reference 的 project_id/project_category/project_hours 替换源表对应列
+            matching_ref_rows = matching_ref_rows[:1]
+            ratios = weights = None
+        else:
+            # 根据reference表中的总工时计算比例
+            ratios = [ref_hours[ref_idx] / total_ref_hours for ref_idx in matching_ref_rows]
+            weights = integer_weights([ref_hours[ref_idx] for ref_idx in matching_ref_rows])
+        replacements = [[(col, ref_values[ref_idx]) for col, ref_values in self.replaced_columns]
+                        for ref_idx in matching_ref_rows]
+        ref_keys = [(self.ref_proj_id_keys[ref_idx], self.ref_proj_category_keys[ref_idx])
+                    for ref_idx in matching_ref_rows]
+        return SplitPlan('split' if ratios else 'zero', replacements, ref_keys, ratios, weights)
 
-    if not matching_ref_rows:
+
+def integer_weights(hours):
+    """Scale hours to integers with exactly the proportions of their decimal forms.
+
+    Hours are taken as the decimals they are shown as (0.1 is 1/10, not the
+    nearest binary fraction) and scaled by their common denominator.
+    """
+    fractions = [Fraction(repr(h)) for h in hours]
+    denominator = 1
+    for f in fractions:
+        denominator = denominator * f.denominator // math.gcd(denominator, f.denominator)
+    return [int(f * denominator) for f in fractions]
+
+
+def to_cents(amount):
+    """Amount as an integer number of cents, from its decimal form (rounded half to even)."""
+    return int(Decimal(repr(amount)).scaleb(2).quantize(1, ROUND_HALF_EVEN))
+
+
+def allocate_split(amounts, ratios):
+    """Allocate amounts over the result rows of a split.
+
+    Every result row but the last takes amount * ratio truncated toward zero
+    to cents; the last takes the remainder rounded to cents, so the parts
+    always add up to the amount. Returns one list of values per ratio.
+    """
+    allocated = []
+    remain_values = list(amounts)
+    for ratio in ratios[:-1]:
+        values = []
+        for j, amount in enumerate(amounts):
+            proportional = amount * ratio
+            # 向零取整：正数向下、负数向上，确保余数不反号
+            if proportional >= 0:
+                value = math.floor(proportional * 100) / 100
+            else:
+                value = math.ceil(proportional * 100) / 100
+            remain_values[j] -= value
+            values.append(value)
+        allocated.append(values)
+    allocated.append([round(remain, 2) for remain in remain_values])
+    return allocated
+
+
+def allocate_split_cents(amounts, weights, largest_remainder=False):
+    """Allocate integer cent amounts over integer weights with integer arithmetic only.
+
+    Each result row takes its share truncated toward zero. The cents left
+    over go to the last row, or with largest_remainder one cent each to the
+    rows with the largest truncated fractions (earlier rows first on ties).
+    Returns one list of cent values per weight.
+    """
+    total_weight = sum(weights)
+    allocated = [[] for _ in weights]
+    for cents in amounts:
+        magnitude = abs(cents)
+        shares = []
+        remainders = []
+        for weight in weights:
+            share, remainder = divmod(magnitude * weight, total_weight)
+            shares.append(share)
+            remainders.append(remainder)
+        rest = magnitude - sum(shares)
+        if largest_remainder:
+            for i in sorted(range(len(weights)), key=lambda i: -remainders[i])[:rest]:
+                shares[i] += 1
+        else:
+            shares[-1] += rest
+        for values, share in zip(allocated, shares):
+            values.append(share if cents >= 0 else -share)
+    return allocated
+
+
+def allocate_splits_numpy(source, planner, employee_ids, split_positions, row_indices=None):
+    """Allocate the splitting columns of all split source rows at once with NumPy.
+
+    Source rows are grouped by the number of result rows of their employee's
+    plan; each group is one amounts matrix (rows x splitting columns) times
+    one ratio matrix (rows x result rows). Values match allocate_split()
+    exactly: truncation is elementwise, the remainder is subtracted in
+    result row order and rounded with Python's round(). Returns the
+    SplitAllocations of all rows, or of the rows listed in row_indices.
+    """
+    columns = [source.floats(j + 1) for j in split_positions]
+    groups = {}  # number of result rows -> ([row_idx], [ratios])
+    if row_indices is None:
+        row_indices = range(len(employee_ids))
+    for row_idx in row_indices:
+        plan = planner.plan(employee_ids[row_idx])
+        if plan.kind == 'split':
+            rows, ratios = groups.setdefault(len(plan.ratios), ([], []))
+            rows.append(row_idx)
+            ratios.append(plan.ratios)
+
+    allocations = SplitAllocations()
+    for count, (rows, ratios) in groups.items():
+        amounts = numpy.array([[column[row_idx] if column[row_idx] is not None else 0.0 for column in columns] for row_idx in rows],
+                              dtype=numpy.float64).reshape(len(rows), len(columns))
+        ratio_matrix = numpy.array(ratios, dtype=numpy.float64)
+        # + 0.0 turns -0.0 into 0.0, as math.floor()/math.ceil() return integers
+        shares = (numpy.trunc(amounts[:, None, :] * ratio_matrix[:, :-1, None] * 100) + 0.0) / 100
+        remain = amounts.copy()
+        for i in range(count - 1):
+            remain -= shares[:, i, :]
+        allocations.add(rows, shares, remain)
+    return allocations
+
+
+class SplitAllocations:
+    """allocate_splits_numpy() results, kept in their NumPy arrays until a row is split.
+
+    A window of allocations costs 8 bytes per amount instead of a list of
+    Python float lists per source row; get() and pop() convert one row to
+    the layout of allocate_split().
+    """
+
+    __slots__ = ('_arrays', '_index')
+
+    def __init__(self):
+        self._arrays = []  # (shares, remain) per number of result rows
+        self._index = {}   # row_idx -> (position in _arrays, row in its arrays)
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, rows, shares, remain):
+        """Take the shares (rows x result rows - 1 x columns) and remainders (rows x columns) of rows."""
+        group = len(self._arrays)
+        self._arrays.append((shares, remain))
+        self._index.update((row_idx, (group, i)) for i, row_idx in enumerate(rows))
+
+    def get(self, row_idx, default=None):
+        """The allocate_split() layout of row_idx's allocation."""
+        position = self._index.get(row_idx)
+        if position is None:
+            return default
+        group, i = position
+        shares, remain = self._arrays[group]
+        row_shares = shares[i].tolist()
+        row_shares.append([round(value, 2) for value in remain[i].tolist()])
+        return row_shares
+
+    def pop(self, row_idx, default=None):
+        """get() row_idx's allocation and drop it from the index."""
+        allocation = self.get(row_idx, default)
+        self._index.pop(row_idx, None)
+        return allocation
+
+
+def split_row(source_values, row_idx, source, plan, split_positions, allocated=None,
+              remainder_policy=None):
+    """Split a row according to its employee's SplitPlan.
+
+    source_values are the cell values of the source row, row_idx its 0-based
+    data row index in the source SheetTable and split_positions the 0-based
+    positions of the splitting columns. allocated optionally gives the
+    precomputed allocate_split() result for the row. remainder_policy
+    ('last' or 'largest') selects integer-cent allocation; None keeps float
+    arithmetic. Returns the result rows as value lists; styles are applied
+    when the rows are written.
+    """
+    if plan.kind == 'copy':
         # No matching reference rows, copy source row as is
-        return [list(source_row)]
+        return [list(source_values)]
 
-    # 计算reference表中匹配行的总工时
-    total_ref_hours = 0
-    for ref_row in matching_ref_rows:
-        try:
-            ref_hours = float(ref_row[ref_hours_col - 1].value)
-        except (ValueError, TypeError):
-            fatal(f"Error: Non-numeric project_hours '{ref_row[ref_hours_col - 1].value}' "
-                  f"in reference sheet for employee_id='{employee_id}'")
-        total_ref_hours += ref_hours
-
-    if total_ref_hours == 0:
-        # 工时为0时，不拆分金额，但用 reference 的 project_id/project_category/project_hours 替换源表对应列
-        ref_row = matching_ref_rows[0]
-        result_row = list(source_row)
-        if project_id_col and ref_project_id_col:
-            result_row[project_id_col - 1].value = ref_row[ref_project_id_col - 1].value
-        if project_category_col and ref_project_category_col:
-            result_row[project_category_col - 1].value = ref_row[ref_project_category_col - 1].value
-        if project_hours_col and ref_project_hours_col:
-            result_row[project_hours_col - 1].value = ref_row[ref_project_hours_col - 1].value
+    if plan.kind == 'zero':
+        result_row = list(source_values)
+        for col, value in plan.replacements[0]:
+            result_row[col - 1] = value
         return [result_row]
 
     # Split the row
-    # Track remaining values for each splitting column (avoid deepcopy of Cell objects)
-    remain_values = []
-    for j, cell in enumerate(source_row):
-        if cell.value is not None and cell.column in splitting_col_set:
-            try:
-                remain_values.append(float(cell.value))
-            except (ValueError, TypeError):
-                fatal(f"Error: 无法拆分'{source_headers[j]}:{source_row[j].value}'")
-        else:
-            remain_values.append(0.0)  # placeholder for non-splitting columns
+    # Decoded source amounts of the splitting columns (None for empty cells, left as is)
+    amounts = []
+    for j in split_positions:
+        value = source_values[j] if j < len(source_values) else None
+        if value is None:
+            amounts.append(None)
+            continue
+        amount = source.floats(j + 1)[row_idx]
+        if amount is None:
+            fatal(f"Error: 无法拆分'{source.headers[j]}:{value}'")
+        amounts.append(amount)
+    if remainder_policy is not None:
+        # 整数分：金额一次转换为分，按整数工时权重分配，写出时再换算为元
+        allocated = [[cents / 100 for cents in values] for values in allocate_split_cents(
+            [to_cents(a) if a is not None else 0 for a in amounts], plan.weights,
+            largest_remainder=remainder_policy == 'largest')]
+    elif allocated is None:
+        allocated = allocate_split([a if a is not None else 0.0 for a in amounts], plan.ratios)
 
     result_rows = []
-    for i, ref_row in enumerate(matching_ref_rows):
-        try:
-            ref_hours = float(ref_row[ref_hours_col - 1].value)
-        except (ValueError, TypeError):
-            fatal(f"Error: Non-numeric project_hours '{ref_row[ref_hours_col - 1].value}' "
-                  f"in reference sheet for employee_id='{employee_id}'")
-        ratio = ref_hours / total_ref_hours  # 根据reference表中的总工时计算比例
-
-        # Create new row with same style as source
-        new_row = []
-        for j, cell in enumerate(source_row):
-            new_cell = copy(cell)
-            if cell.value is not None and cell.column in splitting_col_set:
-                # Split numeric values
-                try:
-                    if i < len(matching_ref_rows) - 1:
-                        proportional = float(cell.value) * ratio
-                        # 向零取整：正数向下、负数向上，确保余数不反号
-                        if proportional >= 0:
-                            new_cell.value = math.floor(proportional * 100) / 100
-                        else:
-                            new_cell.value = math.ceil(proportional * 100) / 100
-                        remain_values[j] -= new_cell.value
-                    else:
-                        new_cell.value = round(remain_values[j], 2)
-                except (ValueError, TypeError):
-                    fatal(f"Error: 无法拆分'{source_headers[j]}:{source_row[j].value}'")
-            new_row.append(new_cell)
+    for values, replacements in zip(allocated, plan.replacements):
+        # New row starts from the source values
+        new_row = list(source_values)
+        for j, amount, value in zip(split_positions, amounts, values):
+            if amount is not None:
+                new_row[j] = value
 
         # 只更新project_id, project_category, project_hours这三列
-        if project_id_col and ref_project_id_col:
-            new_row[project_id_col - 1].value = ref_row[ref_project_id_col - 1].value
+        for col, value in replacements:
+            new_row[col - 1] = value
 
+        result_rows.append(new_row)
 
-        if project_category_col and ref_project_category_col:
-            new_row[project_category_col - 1].value = ref_row[ref_project_category_col - 1].value
+    return result_rows
 
-        if project_hours_col and ref_project_hours_col:
-            new_row[project_hours_col - 1].value = ref_row[ref_project_hours_col - 1].value
+def shard_source_rows(employee_ids, planner, shards, row_indices=None):
+    """Partition source row indices (all, or those in row_indices) into balanced shards by employee_id.
 
-        result_rows.append(new_row)
+    Rows of one employee stay together, except for high fan-out employees
+    whose rows alone would outweigh a shard's fair share: those are cut into
+    pieces. Pieces are weighed by their number of result rows and dealt
+    largest first to the lightest shard. Each shard lists its rows in
+    source order.
+    """
+    groups = {}  # employee_id -> source row indices
+    if row_indices is None:
+        row_indices = range(len(employee_ids))
+    for row_idx in row_indices:
+        groups.setdefault(employee_ids[row_idx], []).append(row_idx)
+    total = sum(len(rows) * planner.plan(emp_id).fan_out for emp_id, rows in groups.items())
+    fair_share = max(1, -(-total // shards))
+
+    pieces = []  # (result rows, source row indices)
+    for emp_id, rows in groups.items():
+        fan_out = planner.plan(emp_id).fan_out
+        step = max(1, fair_share // fan_out)
+        for start in range(0, len(rows), step):
+            piece = rows[start:start + step]
+            pieces.append((len(piece) * fan_out, piece))
+    pieces.sort(key=itemgetter(0), reverse=True)
+
+    loads = [(0, i) for i in range(shards)]
+    assigned = [[] for _ in range(shards)]
+    for weight, piece in pieces:
+        load, i = heapq.heappop(loads)
+        assigned[i].extend(piece)
+        heapq.heappush(loads, (load + weight, i))
+    return [sorted(rows) for rows in assigned if rows]
+
+
+class ShardSplitter:
+    """Splits source rows from the decoded tables alone: the work of one split_workers shard.
+
+    Result rows come back as SplitPatches against the source values, i.e.
+    the values that split_row and populate_payment_account set; the parent
+    process applies them to the source cell values it holds.
+    """
 
-    return result_rows
+    def __init__(self, config, source, reference, source_col_map, ref_col_map, source_headers,
+                 payment_mapping, split_positions, remainder_policy):
+        source_cols = config['input']['sheet']['source']['columns']
+        self.config = config
+        self.source = source
+        self.source_col_map = source_col_map
+        self.source_headers = source_headers
+        self.payment_mapping = payment_mapping
+        self.split_positions = split_positions
+        self.remainder_policy = remainder_policy
+        self.planner = SplitPlanner(config, reference, source_col_map, ref_col_map)
+        self.employee_ids = source.values(source_col_map[source_cols['employee_id']])
+        self.key_columns = [source.keys(source_col_map[source_cols[key]])
+                            for key in ('employer_name', 'project_id', 'project_category')]
+        # Positions always written: payment output columns, plus the reference
+        # project columns for rows with matching reference rows
+        self.output_positions = {source_col_map[header] - 1
+                                 for header in config['input']['sheet']['payment']['output_columns']}
+        self.replaced_positions = self.output_positions | {
+            col - 1 for col, _values in self.planner.replaced_columns}
+
+    def split(self, row_indices):
+        """SplitPatches of the result rows of the source rows in row_indices."""
+        allocations = {}
+        if self.config.get('split_engine', 'python') == 'numpy' and numpy is not None:
+            allocations = allocate_splits_numpy(self.source, self.planner, self.employee_ids,
+                                                self.split_positions, row_indices)
+        patches = SplitPatches(self.output_positions, self.replaced_positions, self.split_positions)
+        for row_idx in row_indices:
+            values = self.source.row(row_idx)
+            plan = self.planner.plan(self.employee_ids[row_idx])
+            rows = split_row(values, row_idx, self.source, plan, self.split_positions,
+                             allocations.get(row_idx), self.remainder_policy)
+            populate_payment_account(rows, self.payment_mapping, self.config, self.source_col_map,
+                                     self.source_headers,
+                                     plan.payment_keys(*(keys[row_idx] for keys in self.key_columns)))
+            patches.append(plan.kind, rows)
+        return patches
+
+
+class SplitPatches:
+    """The result rows of a shard of source rows, stored compactly as patches against the source values.
+
+    Every result row patches the payment output columns (copy_positions);
+    rows of employees with reference rows also the reference project columns
+    (project_positions) and split rows the splitting columns. Rather than a
+    list of (position, value) pairs per result row, the patched values of all
+    rows go into one flat list and the split amounts into one array of
+    doubles (NaN for empty amounts), with per source row offsets: tens of
+    bytes per result row instead of a tuple and a boxed float per value.
+    """
+
+    __slots__ = ('positions', 'split_positions', 'kinds', 'fan_outs', 'value_starts', 'amount_starts',
+                 'values', 'amounts')
+
+    KINDS = ('copy', 'zero', 'split')
+
+    def __init__(self, copy_positions, project_positions, split_positions):
+        self.positions = (sorted(copy_positions), sorted(project_positions))
+        self.split_positions = split_positions
+        self.kinds = bytearray()
+        self.fan_outs = array('l')
+        self.value_starts = array('l', [0])
+        self.amount_starts = array('l', [0])
+        self.values = []
+        self.amounts = array('d')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, kind, rows):
+        """Add the result rows (value lists) of the next source row, split according to a plan of kind."""
+        positions = self.positions[kind != 'copy']
+        for row in rows:
+            self.values.extend(row[j] for j in positions)
+            if kind == 'split':
+                self.amounts.extend(math.nan if row[j] is None else row[j] for j in self.split_positions)
+        self.kinds.append(self.KINDS.index(kind))
+        self.fan_outs.append(len(rows))
+        self.value_starts.append(len(self.values))
+        self.amount_starts.append(len(self.amounts))
+
+    def result_rows(self, i, source_values, width):
+        """Build the result rows of the i-th source row from its source_values."""
+        kind = self.KINDS[self.kinds[i]]
+        positions = self.positions[kind != 'copy']
+        values = iter(self.values[self.value_starts[i]:self.value_starts[i + 1]])
+        amounts = iter(self.amounts[self.amount_starts[i]:self.amount_starts[i + 1]])
+        rows = []
+        for _ in range(self.fan_outs[i]):
+            row = list(source_values)
+            row.extend([None] * (width - len(row)))
+            if kind == 'split':
+                for j, amount in zip(self.split_positions, amounts):
+                    row[j] = None if math.isnan(amount) else amount
+            for j, value in zip(positions, values):
+                row[j] = value
+            rows.append(row)
+        return rows
+
+
+_shard_splitter = None  # ShardSplitter of a split_workers pool process
+
+
+class _WorkerFatal(Exception):
+    """Raised by fatal() in a split_workers pool process; carries the message to the parent."""
+
+
+def _init_split_worker(*args):
+    """Process pool initializer: takes the tables and indices once per worker process."""
+    global _shard_splitter
+    _shard_splitter = ShardSplitter(*args)
+
+
+def _split_shard_worker(row_indices):
+    """Process pool entry point: split one shard of source rows.
+
+    Returns (patches, None), or (None, message) when splitting hit a fatal
+    error; the parent reports it.
+    """
+    try:
+        return _shard_splitter.split(row_indices), None
+    except _WorkerFatal as e:
+        return None, e.args[0]
 
-def populate_payment_account(rows, payment_mapping, config, source_col_map, source_headers):
-    """Populate output columns from payment mapping for each row (without merging)."""
+
+def split_in_workers(workers, planner, employee_ids, window, *splitter_args):
+    """Split the source rows in a pool of worker processes, sharded by employee_id.
+
+    splitter_args are the ShardSplitter arguments; they reach each worker
+    once, through the pool initializer (inherited on fork, not pickled per
+    task). Rows are split window rows at a time, the next window already
+    running while the caller consumes the current one. Yields
+    {row_idx: (SplitPatches, position of row_idx in them)} per window. A
+    fatal error in a worker cancels the queued shards and is reported
+    through fatal() here.
+    """
+    def submit(start):
+        shards = shard_source_rows(employee_ids, planner, workers,
+                                   range(start, min(start + window, len(employee_ids))))
+        return shards, [pool.submit(_split_shard_worker, shard) for shard in shards]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_split_worker,
+                             initargs=splitter_args) as pool:
+        pending = submit(0)
+        for start in range(0, len(employee_ids), window):
+            shards, futures = pending
+            if start + window < len(employee_ids):
+                pending = submit(start + window)
+            patches = {}
+            for shard, future in zip(shards, futures):
+                shard_patches, error = future.result()
+                if error is not None:
+                    for queued in futures + pending[1]:
+                        queued.cancel()
+                    fatal(error)
+                patches.update((row_idx, (shard_patches, i)) for i, row_idx in enumerate(shard))
+            yield patches
+
+
+def populate_payment_account(rows, payment_mapping, config, source_col_map, source_headers, keys=None):
+    """Populate output columns from payment mapping for each row value list (without merging).
+
+    keys optionally gives each row's pre-normalized (employer_name, project_id,
+    project_category) lookup key; otherwise keys are derived from the row values.
+    """
     employer_name_col = source_col_map.get(config['input']['sheet']['source']['columns']['employer_name'])
     project_id_col = source_col_map.get(config['input']['sheet']['source']['columns']['project_id'])
     project_category_col = source_col_map.get(config['input']['sheet']['source']['columns']['project_category'])
@@ -327,23 +2016,22 @@ def populate_payment_account(rows, payment_mapping, config, source_col_map, sour
 
     output_columns = config['input']['sheet']['payment']['output_columns']
 
-    # Ensure all rows have enough cells for output columns
+    # Ensure all rows have enough values for output columns
     max_cols = len(source_headers)
     for row in rows:
-        while len(row) < max_cols:
-            dummy = Cell(None, column=len(row) + 1)
-            dummy.value = None
-            dummy._style = copy(row[0]._style) if row else None
-            row.append(dummy)
+        row.extend([None] * (max_cols - len(row)))
 
-    for row in rows:
-        proj_id = row[project_id_col - 1].value
-        proj_id_str = str(proj_id).strip() if proj_id is not None else ''
-        employer_name = row[employer_name_col - 1].value if employer_name_col else None
-        employer_name_str = str(employer_name).strip() if employer_name is not None else ''
-        proj_category = row[project_category_col - 1].value if project_category_col else None
-        proj_category_str = str(proj_category).strip() if proj_category is not None else ''
-        emp_id = row[employee_id_col - 1].value
+    for i, row in enumerate(rows):
+        if keys is not None:
+            employer_name_str, proj_id_str, proj_category_str = keys[i]
+        else:
+            proj_id = row[project_id_col - 1]
+            proj_id_str = str(proj_id).strip() if proj_id is not None else ''
+            employer_name = row[employer_name_col - 1] if employer_name_col else None
+            employer_name_str = str(employer_name).strip() if employer_name is not None else ''
+            proj_category = row[project_category_col - 1] if project_category_col else None
+            proj_category_str = str(proj_category).strip() if proj_category is not None else ''
+        emp_id = row[employee_id_col - 1]
 
         # Use composite key (employer_name, project_id, project_category) to look up payment mapping
         lookup_key = (employer_name_str, proj_id_str, proj_category_str)
@@ -357,79 +2045,1120 @@ def populate_payment_account(rows, payment_mapping, config, source_col_map, sour
         for out_header in output_columns:
             out_col_idx = source_col_map.get(out_header)
             if out_col_idx:
-                row[out_col_idx - 1].value = matched.get(out_header)
+                row[out_col_idx - 1] = matched.get(out_header)
 
 
 
 
-def check_null_columns(source, reference, payment,
-                       source_headers, reference_headers, payment_headers,
-                       config, errors):
-    """Configurable empty-value detection from null_check_columns per sheet.
+def evaluate_formula_numpy(ast, columns, size, active=None):
+    """Evaluate a FormulaProgram expression over whole columns.
 
-    Scans configured columns for each sheet (source/reference/payment) and
-    reports every row where the value is None, empty string, or whitespace-only.
-    Fully-empty rows (all cells None) are skipped to avoid noise from
-    formatting-only trailing rows.
+    columns maps operands to NumPy arrays of size values (missing
+    ones are 0.0). Elementwise the same arithmetic as evaluate_formula; IF
+    computes both branches but only the rows selecting a branch (within
+    the active mask, all rows by default) count for it. Division by zero
+    in an active row raises FormulaError listing the offending positions.
     """
-    sheets_cfg = config['input']['sheet']
-
-    sheet_info = [
-        ('source', source, source_headers),
-        ('reference', reference, reference_headers),
-        ('payment', payment, payment_headers),
-    ]
-
-    for sheet_key, sheet, sheet_headers in sheet_info:
-        sheet_cfg = sheets_cfg.get(sheet_key, {})
-        null_check_columns = sheet_cfg.get('null_check_columns')
-        if not null_check_columns:
+    kind = ast[0]
+    if kind == 'num':
+        return numpy.full(size, ast[1])
+    if kind == 'var':
+        column = columns.get(ast[1])
+        return column if column is not None else numpy.zeros(size)
+    if kind == 'neg':
+        return -evaluate_formula_numpy(ast[1], columns, size, active)
+    if kind == 'call':
+        name, args = ast[1], ast[2]
+        if name == 'IF':
+            chosen = evaluate_formula_numpy(args[0], columns, size, active) != 0
+            if active is None:
+                active = numpy.ones(size, dtype=bool)
+            return numpy.where(chosen, evaluate_formula_numpy(args[1], columns, size, active & chosen),
+                               evaluate_formula_numpy(args[2], columns, size, active & ~chosen))
+        values = [evaluate_formula_numpy(arg, columns, size, active) for arg in args]
+        if name == 'ROUND':
+            return round_numpy(values[0], int(args[1][1]) if args[1][0] == 'num' else int(values[1][0]))
+        if name in ('MIN', 'MAX'):
+            # min()/max() keep the first of equal values (0.0 and -0.0 included)
+            result = values[0]
+            for value in values[1:]:
+                result = numpy.where(value < result if name == 'MIN' else value > result, value, result)
+            return result
+        if name == 'ABS':
+            return numpy.abs(values[0])
+        raise FormulaError(f"未知函数 '{name}'")
+    left = evaluate_formula_numpy(ast[1], columns, size, active)
+    right = evaluate_formula_numpy(ast[2], columns, size, active)
+    if kind == '+':
+        return left + right
+    if kind == '-':
+        return left - right
+    if kind == '*':
+        return left * right
+    if kind == '/':
+        zero = right == 0
+        if active is not None:
+            zero &= active
+        if zero.any():
+            raise FormulaError("除零错误", numpy.flatnonzero(zero).tolist())
+        return left / right
+    if kind in FORMULA_COMPARISONS:
+        compare = {'=': numpy.equal, '<>': numpy.not_equal, '<': numpy.less, '<=': numpy.less_equal,
+                   '>': numpy.greater, '>=': numpy.greater_equal}[kind]
+        return compare(left, right).astype(numpy.float64)
+    raise FormulaError(f"未知运算符 '{kind}'")
+
+
+def round_numpy(values, digits=2):
+    """Python's round(value, digits) of each element of a float array.
+
+    rint() of the value scaled by 10**digits, scaled back, is the correctly
+    rounded result everywhere except next to a .5 tie of the scaled value
+    (where the scaling's rounding error can cross it) and past 2**52; those
+    few elements are rounded one by one with round().
+    """
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        if digits >= 0:
+            scaled = values * 10.0 ** digits
+            rounded = numpy.rint(scaled) / 10.0 ** digits
+        else:
+            scaled = values / 10.0 ** -digits
+            rounded = numpy.rint(scaled) * 10.0 ** -digits
+        magnitude = numpy.abs(scaled)
+        near_tie = numpy.abs(scaled - numpy.floor(scaled) - 0.5) <= 1e-9 + magnitude * 4e-16
+        exact = near_tie | ~(magnitude < 2 ** 52)
+    for i in numpy.flatnonzero(exact):
+        rounded[i] = round(float(values[i]), digits)
+    return rounded
+
+
+def evaluate_computed_rows_numpy(rows, computed_asts, ref_names, source_col_map):
+    """Evaluate computed columns in place on many split result rows at once.
+
+    Each step of the FormulaProgram is evaluated once over NumPy arrays of
+    the referenced columns (None as 0.0), computed columns rounded like
+    round(value, 2), with the same results as evaluate_computed_row on
+    every row. Returns False, leaving the rows untouched, when a referenced
+    value is not numeric (the caller reports it row by row). Division by
+    zero raises FormulaError with the indices into rows of the offending
+    rows as its second argument.
+    """
+    size = len(rows)
+    program = FormulaProgram(computed_asts, ref_names, source_col_map)
+    columns = {}
+    try:
+        for operand, pos in program.loads:
+            columns[operand] = numpy.array([0.0 if row[pos] is None else float(row[pos]) for row in rows],
+                                           dtype=numpy.float64)
+    except (ValueError, TypeError):
+        return False
+    names = {cc_idx - 1: cc_name for cc_name, _ast, cc_idx in computed_asts}
+    results = []
+    for i, (operand, expression, pos) in enumerate(program.steps):
+        try:
+            # Rows not selected by an IF branch may divide by zero or overflow there silently
+            with numpy.errstate(all='ignore'):
+                values = evaluate_formula_numpy(expression, columns, size)
+        except FormulaError as e:
+            if len(e.args) < 2:
+                raise
+            # A shared subexpression is reported under the computed column it precedes
+            cc_name = names[next(step[2] for step in program.steps[i:] if step[2] is not None)]
+            raise FormulaError(f"计算列 '{cc_name}' {e.args[0]}", e.args[1]) from None
+        if pos is not None:
+            values = round_numpy(values)
+            results.append((pos, values.tolist()))
+        columns[operand] = values
+    for pos, values in results:
+        for row, value in zip(rows, values):
+            row[pos] = value
+    return True
+
+
+def verify_computed_groups_numpy(groups, computed_asts, emp_col):
+    """verify_computed_group for many (source values, result rows) groups, vectorized per column.
+
+    Groups with the same number of result rows form one matrix per computed
+    column; result rows are summed in order, one column of the matrix at a
+    time, so sums equal the sequential sums of verify_computed_group.
+    Returns the error messages in the same order.
+    """
+    failed = set()  # (group index, computed column index)
+    sums = {}
+    by_count = {}  # number of result rows -> group indices
+    for i, (_src_row, result_rows) in enumerate(groups):
+        by_count.setdefault(len(result_rows), []).append(i)
+    for count, members in by_count.items():
+        for k, (_cc_name, _ast, cc_idx) in enumerate(computed_asts):
+            sources = []
+            for i in members:
+                src_row = groups[i][0]
+                src_val = src_row[cc_idx - 1] if cc_idx <= len(src_row) else None
+                try:
+                    sources.append(float(src_val) if src_val is not None else math.nan)
+                except (ValueError, TypeError):
+                    sources.append(math.nan)
+            values = numpy.array([[row[cc_idx - 1] for row in groups[i][1]] for i in members],
+                                 dtype=numpy.float64).reshape(len(members), count)
+            total = numpy.zeros(len(members))
+            for j in range(count):
+                total = total + values[:, j]
+            with numpy.errstate(invalid='ignore'):
+                mismatched = numpy.abs(total - numpy.array(sources)) > 0.001
+            for m in numpy.flatnonzero(mismatched):
+                failed.add((members[m], k))
+                sums[members[m], k] = (float(total[m]), sources[m])
+    errors = []
+    for i, k in sorted(failed):
+        cc_name = computed_asts[k][0]
+        result_sum, src_val_f = sums[i, k]
+        errors.append(
+            f"计算列 '{cc_name}' 源行 employee_id='{groups[i][0][emp_col - 1]}' "
+            f"拆分结果合计 ({result_sum:.2f}) 与源行值 ({src_val_f:.2f}) 不一致"
+        )
+    return errors
+
+
+def evaluate_computed_row(row, computed_asts, ref_names, source_col_map, max_cols):
+    """Evaluate computed columns in place on one split result row (a value list).
+
+    The reference implementation of compile_computed_columns().
+    """
+    # Pad row to max_cols if needed (for newly appended columns)
+    row.extend([None] * (max_cols - len(row)))
+    # Build values dict from referenced columns only
+    values = {}
+    for hdr_name in ref_names:
+        col_idx = source_col_map[hdr_name]
+        v = row[col_idx - 1]
+        if v is None:
+            values[hdr_name] = 0.0
+        else:
+            try:
+                values[hdr_name] = float(v)
+            except (ValueError, TypeError):
+                fatal(f"Error: 计算列引用的列 '{hdr_name}' 存在非数值 '{v}'")
+    # Evaluate formulas in order
+    for cc_name, ast, cc_idx in computed_asts:
+        result_val = evaluate_formula(ast, values)
+        result_val = round(result_val, 2)
+        values[cc_name] = result_val
+        row[cc_idx - 1] = result_val
+
+
+def verify_computed_group(src_row, result_rows, computed_asts, emp_id):
+    """Check that computed columns of a source row's split results sum to the source value.
+
+    src_row and result_rows are value lists. Returns a list of error messages
+    (empty when all columns match).
+    """
+    errors = []
+    for cc_name, _ast, cc_idx in computed_asts:
+        # Skip if source row doesn't have this column (e.g. newly appended)
+        if cc_idx > len(src_row):
+            continue
+        src_val = src_row[cc_idx - 1]
+        if src_val is None:
+            continue  # Source had no value for this column, skip
+        try:
+            src_val_f = float(src_val)
+        except (ValueError, TypeError):
             continue
+        # Sum computed values across all result rows from this source row
+        result_sum = 0.0
+        for result_row in result_rows:
+            v = result_row[cc_idx - 1]
+            if v is not None:
+                try:
+                    result_sum += float(v)
+                except (ValueError, TypeError):
+                    pass
+        if abs(result_sum - src_val_f) > 0.001:
+            errors.append(
+                f"计算列 '{cc_name}' 源行 employee_id='{emp_id}' "
+                f"拆分结果合计 ({result_sum:.2f}) 与源行值 ({src_val_f:.2f}) 不一致"
+            )
+    return errors
+
+
+SPLIT_WINDOW_ROWS = 20000  # source rows per batch of numpy allocations / worker patches / numpy computed columns
+
+
+def batched(iterable, size):
+    """Lists of up to size consecutive items of iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ResultGroup:
+    """The result rows of one source row on their way through the SplitPipeline."""
+
+    __slots__ = ('row_idx', 'source_values', 'style_cells', 'plan', 'rows', 'populated')
+
+    def __init__(self, row_idx, source_values, style_cells):
+        self.row_idx = row_idx
+        self.source_values = source_values
+        self.style_cells = style_cells
+        self.plan = None
+        self.rows = None
+        self.populated = False
+
+
+class SplitPipeline:
+    """Turns source rows into result rows as a chain of generator stages.
+
+    read -> split -> populate -> compute -> verify: each stage passes on one
+    source row's ResultGroup at a time and the writer consumes them as they
+    come, so intermediate state is bounded by the current group (plus one
+    window of SPLIT_WINDOW_ROWS precomputed numpy allocations or worker
+    patches) instead of growing with the sheet. Computed column mismatches
+    are collected in computed_errors.
+    """
+
+    def __init__(self, config, tables, payment_mapping, source_headers, reference_headers):
+        self.config = config
+        self.source = tables['source']
+        self.payment_mapping = payment_mapping
+        self.source_headers = source_headers
+        self.source_col_map = source_col_map = {name: idx + 1 for idx, name in enumerate(source_headers)}
+        ref_col_map = {name: idx + 1 for idx, name in enumerate(reference_headers)}
+        self.width = len(source_headers)
+        source_cols = config['input']['sheet']['source']['columns']
+
+        # Precompute splitting column positions (0-based, in column order) for split_row
+        self.split_positions = sorted({source_col_map[col_name] - 1
+                                       for col_name in config['input']['splitting_columns']
+                                       if col_name in source_col_map})
+
+        # Pre-parse computed column formulas
+        self.computed_asts = []  # list of (name, ast, col_index)
+        known_for_parse = set(source_headers)
+        for cc_name, cc_formula in (config['input'].get('computed_columns') or {}).items():
+            ast = parse_formula(tokenize_formula(cc_formula, known_for_parse))
+            self.computed_asts.append((cc_name, ast, source_col_map[cc_name]))
+            known_for_parse.add(cc_name)
+        # Pre-collect all column names referenced in any formula
+        self.ref_names = set()
+        for _cc_name, ast, _cc_idx in self.computed_asts:
+            self.ref_names.update(collect_refs(ast))
+        self.computed_columns = None
+        if self.computed_asts:
+            self.computed_columns = compile_computed_columns(self.computed_asts, self.ref_names, source_col_map)
+        self.computed_engine = config.get('computed_engine', 'python')
+        if self.computed_engine == 'numpy' and numpy is None:
+            print("未安装 numpy，computed_engine 回退为 python")
+            self.computed_engine = 'python'
+
+        # Split plans: built once per employee_id, shared by all of its source rows
+        self.planner = SplitPlanner(config, tables['reference'], source_col_map, ref_col_map)
+        self.emp_col = source_col_map[source_cols['employee_id']]
+        # Normalized payment lookup key columns
+        self.key_columns = [self.source.keys(source_col_map[source_cols[key]])
+                            for key in ('employer_name', 'project_id', 'project_category')]
+
+        self.remainder_policy = None
+        if config.get('split_arithmetic', 'float') == 'cents':
+            self.remainder_policy = config.get('remainder_policy', 'last')
+        self.split_engine = config.get('split_engine', 'python')
+        if self.split_engine == 'numpy' and numpy is None:
+            print("未安装 numpy，split_engine 回退为 python")
+            self.split_engine = 'python'
+        self.split_workers = config.get('split_workers', 1)
+        self.ref_table = tables['reference']
+        self.ref_col_map = ref_col_map
+
+        self.computed_errors = []
+        self.t_split = self.t_compute = 0.0
+        self.computed_rows = 0
+
+    def run(self, ws, values_from_tables=False):
+        """All stages chained over the data rows of source worksheet ws."""
+        return self.verify(self.compute(self.populate(self.split(self.read(ws, values_from_tables)))))
+
+    def read(self, ws, values_from_tables=False):
+        """Stage: a ResultGroup per source data row, with its values and style cells.
+
+        Result rows are built from values only; the source cells just supply
+        styles. With values_from_tables the values come from the decoded
+        table (styled cells may hold formulas instead of their cached values).
+        """
+        total = self.source.nrows
+        report_every = self.config.get('write_batch_size', 500)
+        t_start = time.time()
+        for row_idx, row in enumerate(ws.iter_rows(min_row=2, max_row=total + 1)):
+            row_counter = row_idx + 1
+            if row_counter % report_every == 0 or row_counter == 1:
+                elapsed = time.time() - t_start
+                rate = row_counter / elapsed if elapsed > 0 else 0
+                eta = (total - row_counter) / rate if rate > 0 else 0
+                print(f"正在处理第 {row_counter}/{total} 行 (已耗时 {elapsed:.0f}s, 速度 {rate:.1f} 行/秒, 预计剩余 {eta:.0f}s)...")
+            source_values = [cell.value for cell in row]
+            if values_from_tables:
+                for j, value in enumerate(self.source.row(row_idx)[:len(source_values)]):
+                    source_values[j] = value
+            yield ResultGroup(row_idx, source_values, result_style_cells(row, self.width))
+
+    def _precomputed_windows(self):
+        """Per SPLIT_WINDOW_ROWS source rows: {row_idx: worker patches or numpy allocation}, or None."""
+        employee_ids = self.source.values(self.emp_col)
+        if self.split_workers > 1:
+            # Workers split their shards themselves (with the numpy engine, if selected)
+            return split_in_workers(
+                self.split_workers, self.planner, employee_ids, SPLIT_WINDOW_ROWS,
+                self.config, self.source, self.ref_table, self.source_col_map, self.ref_col_map,
+                self.source_headers, self.payment_mapping, self.split_positions, self.remainder_policy)
+        if self.split_engine == 'numpy':
+            return (allocate_splits_numpy(self.source, self.planner, employee_ids, self.split_positions,
+                                          range(start, min(start + SPLIT_WINDOW_ROWS, len(employee_ids))))
+                    for start in range(0, len(employee_ids), SPLIT_WINDOW_ROWS))
+        return None
+
+    def split(self, groups):
+        """Stage: split each source row by its employee's plan (workers also populate payment columns)."""
+        windows = self._precomputed_windows()
+        precomputed = {}
+        for group in groups:
+            t0 = time.time()
+            if windows is not None and group.row_idx % SPLIT_WINDOW_ROWS == 0:
+                precomputed = next(windows)
+            # The employee's plan decides whether this source row is split (matching ref with total hours > 0)
+            group.plan = self.planner.plan(group.source_values[self.emp_col - 1])
+            if self.split_workers > 1:
+                # Split and payment columns were computed by a worker process
+                patches, i = precomputed.pop(group.row_idx)
+                group.rows = patches.result_rows(i, group.source_values, self.width)
+                group.populated = True
+            else:
+                group.rows = split_row(group.source_values, group.row_idx, self.source, group.plan,
+                                       self.split_positions, precomputed.pop(group.row_idx, None),
+                                       self.remainder_policy)
+            self.t_split += time.time() - t0
+            yield group
+
+    def populate(self, groups):
+        """Stage: fill the payment output columns of each result row."""
+        for group in groups:
+            if not group.populated:
+                row_idx = group.row_idx
+                populate_payment_account(group.rows, self.payment_mapping, self.config, self.source_col_map,
+                                         self.source_headers,
+                                         group.plan.payment_keys(*(keys[row_idx] for keys in self.key_columns)))
+                group.populated = True
+            yield group
+
+    def compute(self, groups):
+        """Stage: evaluate the computed columns of split rows."""
+        if self.computed_asts and self.computed_engine == 'numpy':
+            yield from self._compute_windows(groups)
+            return
+        for group in groups:
+            if self.computed_asts and group.plan.kind == 'split':
+                t0 = time.time()
+                for result_row in group.rows:
+                    # Pad row to the output width (for newly appended columns)
+                    result_row.extend([None] * (self.width - len(result_row)))
+                    self.computed_columns(result_row)
+                self.computed_rows += len(group.rows)
+                self.t_compute += time.time() - t0
+            yield group
+
+    def _compute_windows(self, groups):
+        """compute() with computed_engine: numpy: each formula once over the split rows of a window of groups."""
+        for window in batched(groups, SPLIT_WINDOW_ROWS):
+            split_groups = [group for group in window if group.plan.kind == 'split']
+            rows = [result_row for group in split_groups for result_row in group.rows]
+            if rows:
+                t0 = time.time()
+                for result_row in rows:
+                    result_row.extend([None] * (self.width - len(result_row)))
+                try:
+                    vectorized = evaluate_computed_rows_numpy(rows, self.computed_asts, self.ref_names,
+                                                              self.source_col_map)
+                except FormulaError as e:
+                    source_rows = [group.row_idx + 2 for group in split_groups for _row in group.rows]
+                    offending = sorted({source_rows[i] for i in e.args[1]})
+                    listed = ', '.join(str(row) for row in offending[:10])
+                    more = f" 等 {len(offending)} 行" if len(offending) > 10 else ""
+                    raise FormulaError(f"{e.args[0]}：源表第 {listed} 行{more}") from None
+                if not vectorized:
+                    # A referenced value is not numeric: the row by row evaluation reports it
+                    for result_row in rows:
+                        self.computed_columns(result_row)
+                self.computed_rows += len(rows)
+                self.t_compute += time.time() - t0
+            yield from window
+
+    def verify(self, groups):
+        """Stage: per source row, computed columns of the split rows must add up to the source value.
+
+        Mismatches are collected in computed_errors and reported after the file is saved.
+        """
+        if self.computed_asts and self.computed_engine == 'numpy':
+            for window in batched(groups, SPLIT_WINDOW_ROWS):
+                self.computed_errors.extend(verify_computed_groups_numpy(
+                    [(group.source_values, group.rows) for group in window if group.plan.kind == 'split'],
+                    self.computed_asts, self.emp_col))
+                yield from window
+            return
+        for group in groups:
+            if self.computed_asts and group.plan.kind == 'split':
+                self.computed_errors.extend(verify_computed_group(
+                    group.source_values, group.rows, self.computed_asts,
+                    group.source_values[self.emp_col - 1]))
+            yield group
+
+
+VALIDATION_PASSES = ('payment', 'reference', 'source')
+
+
+# Context indices a sheet pass fills (what a worker sends back and the validation cache
+# stores); everything else on the context belongs to the current run and its configuration
+_CONTEXT_INDICES = ('payment_mapping', 'payment_project_category_pairs', 'ref_employee_ids',
+                    'ref_projects_by_employee', 'ref_hours_by_employee', 'ref_project_pairs',
+                    'ref_id_types', 'src_key_rows', 'src_id_types')
+
+
+class _ErrorBudgetExhausted(Exception):
+    """Raised by ValidationRule.report() to stop a fail_fast run at its error budget."""
+
+
+class ValidationContext:
+    """State shared by the validation rules of one run.
+
+    Each sheet pass only fills the indices of its own sheet, so the passes
+    are independent and may run in worker processes; cross-sheet checks
+    read the merged indices afterwards.
+    """
+
+    def __init__(self, config, tables):
+        self.config = config
+        self.tables = tables
+        self.sheet_names = {key: config['input']['sheet'][key]['name'] for key in VALIDATION_PASSES}
+        self.payment_mapping = {}  # (employer_name, project_id, project_category) -> payment row dict
+        self.payment_project_category_pairs = set()
+        self.ref_employee_ids = set()
+        self.ref_projects_by_employee = {}  # employee_id -> set of (project_id, project_category)
+        self.ref_hours_by_employee = {}  # employee_id -> total hours (to detect 0-hour rows)
+        self.ref_project_pairs = set()  # (project_id, project_category) keys of reference rows
+        self.ref_id_types = set()
+        self.src_key_rows = set()  # (employee_id, employer_name, project_id, project_category) keys of source rows
+        self.src_id_types = set()
+        self.src_match_context_by_employee = {}  # employee_id -> employer_names of split-eligible rows
+        # Error budget of the run (not part of the indices a sheet pass sends back)
+        self.error_budget = config.get('error_budget')
+        self.fail_fast = config.get('fail_fast', False)
+        self.error_count = 0
+        self.error_counts = []  # (rule label, error count) after a run
+        self.stopped = False
+
+    def column(self, sheet_key, column_key):
+        """1-based index of a configured column (input.sheet.<sheet>.columns.<key>), or None."""
+        name = self.config['input']['sheet'][sheet_key]['columns'][column_key]
+        return get_column_index(self.tables[sheet_key].headers, name)
+
+    def partial(self):
+        """Indices filled by a sheet pass (what a worker process sends back)."""
+        return {name: getattr(self, name) for name in _CONTEXT_INDICES}
+
+    def update(self, partial):
+        """Take over the indices a sheet pass filled; every index belongs to one sheet."""
+        for name in _CONTEXT_INDICES:
+            value = partial.get(name)
+            if value:
+                setattr(self, name, value)
+
+
+class ValidationRule:
+    """One pre-processing check.
+
+    All rules of a sheet run together in a single fused pass over its rows:
+    prepare() once before the pass (returning False skips the rule's row
+    checks), row(i) for every data row (0-based), finish() once after the
+    pass for aggregate checks over that sheet. A pass only sees its own
+    sheet; state needed across sheets goes on the context. merge() runs
+    after all passes, in the main process, for cross-sheet checks (a rule
+    with sheet None only has this step). Every rule reports into its own
+    errors list through report(); the combined report follows the order of
+    VALIDATION_RULES, except that adjacent interleaved rules of one sheet
+    (row checks that used to share one loop) are reported row by row, see
+    flatten_rule_errors(). label names the check in per-check error counts.
+    """
+
+    sheet = None
+    label = None
+    interleaved = False
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.errors = []
+        self.count = 0
+
+    def report(self, message, into=None, row=None):
+        """Record one error in self.errors (or into).
+
+        Interleaved rules record (row, message) pairs. Every error is
+        counted, but with an error_budget only that many messages are kept
+        per rule. With fail_fast, reaching the budget (the first error
+        without one) stops validation.
+        """
+        ctx = self.ctx
+        self.count += 1
+        ctx.error_count += 1
+        if ctx.error_budget is None or self.count <= ctx.error_budget:
+            (self.errors if into is None else into).append((row, message) if self.interleaved else message)
+        if ctx.fail_fast and ctx.error_count >= (ctx.error_budget or 1):
+            raise _ErrorBudgetExhausted()
+
+    @property
+    def table(self):
+        return self.ctx.tables[self.sheet]
+
+    @property
+    def sheet_name(self):
+        return self.ctx.sheet_names[self.sheet]
+
+    def prepare(self):
+        pass
+
+    def row(self, i):
+        pass
+
+    def finish(self):
+        pass
+
+    def flush(self):
+        """Move buffered messages to self.errors; runs after the pass even when it stopped early."""
+
+    def merge(self):
+        pass
+
+
+class PaymentKeyRule(ValidationRule):
+    """Check 2: no duplicate (employer_name, project_id, project_category); builds the payment mapping."""
 
-        sheet_name = sheet_cfg['name']
+    sheet = 'payment'
+    label = 'Duplicate payment keys'
 
-        for col_name in null_check_columns:
-            col_idx = get_column_index(sheet_headers, col_name)
+    def prepare(self):
+        self.keys = [self.table.keys(self.ctx.column('payment', key))
+                     for key in ('employer_name', 'project_id', 'project_category')]
+        self.reported = set()
+
+    def row(self, i):
+        employer_name_str, proj_id_str, proj_category_str = [keys[i] for keys in self.keys]
+
+        # Skip rows with empty project_id, employer_name, or project_category
+        if proj_id_str == '' or employer_name_str == '' or proj_category_str == '':
+            return
+
+        pair = (employer_name_str, proj_id_str, proj_category_str)
+        mapping = self.ctx.payment_mapping
+        if pair in mapping:
+            if pair not in self.reported:
+                self.report(f"Duplicate (employer_name='{employer_name_str}', project_id='{proj_id_str}', "
+                                   f"project_category='{proj_category_str}') "
+                                   f"found in sheet '{self.sheet_name}'")
+                self.reported.add(pair)
+            return
+
+        # Build dict of all payment row values
+        mapping[pair] = dict(zip(self.table.headers, self.table.row(i)))
+
+    def finish(self):
+        # Lookup set for Check 4: (project_id, project_category) pairs
+        self.ctx.payment_project_category_pairs = set(
+            (pid, pcat) for (_, pid, pcat) in self.ctx.payment_mapping)
+
+
+class ReferenceIndexRule(ValidationRule):
+    """Index reference projects and total hours per employee for the later checks."""
+
+    sheet = 'reference'
+
+    def prepare(self):
+        self.emp_ids = self.table.values(self.ctx.column('reference', 'employee_id'))
+        self.proj_id_keys = self.table.keys(self.ctx.column('reference', 'project_id'))
+        self.proj_category_keys = self.table.keys(self.ctx.column('reference', 'project_category'))
+        self.hours = self.table.floats(self.ctx.column('reference', 'project_hours'))
+
+    def row(self, i):
+        emp_id = self.emp_ids[i]
+        if emp_id is None:
+            return
+        ctx = self.ctx
+        ctx.ref_employee_ids.add(emp_id)
+        projects = ctx.ref_projects_by_employee.setdefault(emp_id, set())
+        if self.proj_id_keys[i] != '':
+            projects.add((self.proj_id_keys[i], self.proj_category_keys[i]))
+        hours = self.hours[i]
+        ctx.ref_hours_by_employee[emp_id] = ctx.ref_hours_by_employee.get(emp_id, 0.0) + \
+            (hours if hours is not None else 0.0)  # Non-numeric hours caught by Check 8
+
+
+class EmployeeIdRule(ValidationRule):
+    """Checks 6/7: first empty employee_id of a sheet; collects id types for Check 10."""
+
+    def prepare(self):
+        col = self.ctx.column(self.sheet, 'employee_id')
+        self.emp_ids = self.table.values(col)
+        self.nulls = self.table.nulls(col)
+        self.types = getattr(self.ctx, self.types_attr)
+        self.reported = False
+
+    def row(self, i):
+        if not self.nulls[i]:
+            self.types.add(type(self.emp_ids[i]).__name__)
+        elif not self.reported:
+            self.report(f"Empty employee_id in {self.sheet} sheet '{self.sheet_name}' row {i + 2}", row=i)
+            self.reported = True
+
+
+class ReferenceEmployeeIdRule(EmployeeIdRule):
+    sheet = 'reference'
+    label = 'Empty employee_id (reference)'
+    interleaved = True
+    types_attr = 'ref_id_types'
+
+
+class SourceEmployeeIdRule(EmployeeIdRule):
+    sheet = 'source'
+    label = 'Empty employee_id (source)'
+    types_attr = 'src_id_types'
+
+
+class ReferenceDuplicateRule(ValidationRule):
+    """Check 1: no duplicate (employee_id, project_id, project_category) in the reference sheet."""
+
+    sheet = 'reference'
+    label = 'Duplicate reference rows'
+    interleaved = True
+
+    def prepare(self):
+        self.emp_ids = self.table.values(self.ctx.column('reference', 'employee_id'))
+        self.proj_ids = self.table.values(self.ctx.column('reference', 'project_id'))
+        self.proj_categories = self.table.values(self.ctx.column('reference', 'project_category'))
+        self.seen = set()
+        self.reported = set()
+
+    def row(self, i):
+        emp_id = self.emp_ids[i]
+        proj_id = self.proj_ids[i]
+        if emp_id is None or proj_id is None:
+            return
+        proj_category = self.proj_categories[i]
+        pair = (emp_id, proj_id, proj_category)
+        if pair not in self.seen:
+            self.seen.add(pair)
+        elif pair not in self.reported:
+            self.report(f"Duplicate (employee_id='{emp_id}', project_id='{proj_id}', "
+                               f"project_category='{proj_category}') "
+                               f"found in reference sheet '{self.sheet_name}'", row=i)
+            self.reported.add(pair)
+
+
+class ReferenceHoursRule(ValidationRule):
+    """Checks 8 and 9: project_hours must be numeric and not negative."""
+
+    sheet = 'reference'
+    label = 'Invalid project_hours'
+    interleaved = True
+
+    def prepare(self):
+        hours_col = self.ctx.column('reference', 'project_hours')
+        self.emp_ids = self.table.values(self.ctx.column('reference', 'employee_id'))
+        self.proj_ids = self.table.values(self.ctx.column('reference', 'project_id'))
+        self.hours_values = self.table.values(hours_col)
+        self.hours_floats = self.table.floats(hours_col)
+
+    def row(self, i):
+        hours_val = self.hours_values[i]
+        if hours_val is None:
+            return
+        hours_float = self.hours_floats[i]
+        if hours_float is None:
+            problem = 'Non-numeric'
+        elif hours_float < 0:
+            problem = 'Negative'
+        else:
+            return
+        self.report(f"{problem} project_hours '{hours_val}' in reference sheet "
+                           f"'{self.sheet_name}' row {i + 2} "
+                           f"(employee_id='{self.emp_ids[i]}', project_id='{self.proj_ids[i]}')", row=i)
+
+
+class ReferencePaymentRule(ValidationRule):
+    """Check 4: every reference (project_id, project_category) pair has a payment record."""
+
+    sheet = 'reference'
+    label = 'Reference projects without payment record'
+
+    def prepare(self):
+        self.proj_id_keys = self.table.keys(self.ctx.column('reference', 'project_id'))
+        self.proj_category_keys = self.table.keys(self.ctx.column('reference', 'project_category'))
+
+    def row(self, i):
+        if self.proj_id_keys[i] != '':
+            self.ctx.ref_project_pairs.add((self.proj_id_keys[i], self.proj_category_keys[i]))
+
+    def merge(self):
+        missing = self.ctx.ref_project_pairs - self.ctx.payment_project_category_pairs
+        for pid, pcat in sorted(missing):
+            self.report(f"(project_id='{pid}', project_category='{pcat}') in reference sheet "
+                               f"'{self.sheet_name}' has no matching record in sheet "
+                               f"'{self.ctx.sheet_names['payment']}'")
+
+
+class ZeroHourProjectsRule(ValidationRule):
+    """Check 0h: zero-hour employees must have at most one distinct project_id in reference."""
+
+    sheet = 'reference'
+    label = 'Zero-hour employees with several projects'
+
+    def finish(self):
+        for emp_id, total_hours in self.ctx.ref_hours_by_employee.items():
+            if total_hours == 0.0:
+                projects = self.ctx.ref_projects_by_employee.get(emp_id, set())
+                pids = {p for p, _ in projects}
+                if len(pids) > 1:
+                    self.report(f"employee_id='{emp_id}' has total hours=0 but multiple project_ids "
+                                       f"in reference sheet '{self.sheet_name}': {sorted(pids)}. "
+                                       f"When hours are 0, only one project_id is allowed.")
+
+
+class SourcePaymentRule(ValidationRule):
+    """Check 5: non-split source rows must have a payment record (3-field key).
+
+    Split-eligible rows take the reference projects instead; their employer
+    names are collected for Check 11.
+    """
+
+    sheet = 'source'
+    label = 'Source rows without payment record'
+
+    def prepare(self):
+        cols = [self.ctx.column('source', key) for key in ('employer_name', 'project_id', 'project_category')]
+        if not all(cols):
+            return False
+        self.employer_name_keys, self.proj_id_keys, self.proj_category_keys = \
+            [self.table.keys(col) for col in cols]
+        self.emp_ids = self.table.values(self.ctx.column('source', 'employee_id'))
+
+    def row(self, i):
+        self.ctx.src_key_rows.add((self.emp_ids[i], self.employer_name_keys[i],
+                                   self.proj_id_keys[i], self.proj_category_keys[i]))
+
+    def merge(self):
+        ctx = self.ctx
+        missing = set()
+        for emp_id, employer_name, proj_id, proj_category in ctx.src_key_rows:
+            if emp_id in ctx.ref_employee_ids:
+                # Will be split/replaced; source project_id/project_category replaced by reference
+                ctx.src_match_context_by_employee.setdefault(emp_id, set()).add(employer_name)
+            elif proj_id != '' and employer_name != '':
+                pair = (employer_name, proj_id, proj_category)
+                if pair not in ctx.payment_mapping:
+                    missing.add(pair)
+        for pair in sorted(missing):
+            self.report(f"(employer_name='{pair[0]}', project_id='{pair[1]}', "
+                               f"project_category='{pair[2]}') in source sheet "
+                               f"'{self.sheet_name}' has no matching record in sheet "
+                               f"'{self.ctx.sheet_names['payment']}'")
+
+
+class SplitPaymentRule(ValidationRule):
+    """Check 11: split-eligible rows need a payment record for every reference project.
+
+    Reference project_ids and project_categories are used after the split
+    (also for zero-hour rows, which take the reference values).
+    """
+
+    sheet = 'source'
+    label = 'Split rows without payment record'
+
+    def merge(self):
+        ctx = self.ctx
+        split_missing_pairs = set()
+        for emp_id, employer_names in ctx.src_match_context_by_employee.items():
+            ref_projects = ctx.ref_projects_by_employee.get(emp_id, set())
+            for employer_name in employer_names:
+                for proj_id, proj_cat in ref_projects:
+                    if (employer_name, proj_id, proj_cat) not in ctx.payment_mapping:
+                        split_missing_pairs.add((emp_id, employer_name, proj_id, proj_cat))
+        for emp_id, employer_name, proj_id, proj_cat in sorted(split_missing_pairs):
+            self.report(f"employee_id='{emp_id}', employer_name='{employer_name}', "
+                               f"project_id='{proj_id}', project_category='{proj_cat}' has no matching record "
+                               f"in sheet '{ctx.sheet_names['payment']}'")
+
+
+class EmployeeIdTypeRule(ValidationRule):
+    """Check 10: employee_id values must have one type across source and reference."""
+
+    label = 'employee_id type mismatch'
+
+    def merge(self):
+        all_id_types = self.ctx.ref_id_types | self.ctx.src_id_types
+        if len(all_id_types) > 1:
+            types_str = ', '.join(sorted(all_id_types))
+            self.report(f"employee_id type mismatch: found types [{types_str}] across "
+                               f"source and reference sheets. All employee_id values should be the same type.")
+
+
+class NullCheckRule(ValidationRule):
+    """Configurable empty-value detection from the sheet's null_check_columns.
+
+    Reports every row where a configured column is None, empty string, or
+    whitespace-only. Fully-empty rows (all cells None) are skipped to avoid
+    noise from formatting-only rows. All columns share the sheet pass;
+    errors are still reported column by column.
+    """
+
+    def prepare(self):
+        null_check_columns = self.ctx.config['input']['sheet'].get(self.sheet, {}).get('null_check_columns')
+        self.columns = []  # (column name, null mask, errors of this column)
+        for col_name in null_check_columns or ():
+            col_errors = []
+            col_idx = get_column_index(self.table.headers, col_name)
             if col_idx is None:
-                errors.append(f"空值检测列 '{col_name}' 不存在于表 '{sheet_name}' 中")
-                continue
+                self.report(f"空值检测列 '{col_name}' 不存在于表 '{self.sheet_name}' 中", col_errors)
+                self.columns.append((col_name, None, col_errors))
+            else:
+                self.columns.append((col_name, self.table.nulls(col_idx), col_errors))
+        self.checked = [column for column in self.columns if column[1] is not None]
+        if not self.checked:
+            return False
+        self.blank_rows = self.table.blank_rows()
 
-            for row_num, row in enumerate(sheet.iter_rows(min_row=2), start=2):
-                if all(cell.value is None for cell in row):
-                    continue
-                if is_empty_value(row[col_idx - 1].value):
-                    errors.append(
-                        f"空值检测：表 '{sheet_name}' 第 {row_num} 行，列 '{col_name}' 为空值"
-                    )
+    def row(self, i):
+        if self.blank_rows[i]:
+            return
+        for col_name, nulls, col_errors in self.checked:
+            if nulls[i]:
+                self.report(f"空值检测：表 '{self.sheet_name}' 第 {i + 2} 行，列 '{col_name}' 为空值", col_errors)
 
+    def flush(self):
+        self.errors = [error for _name, _nulls, col_errors in getattr(self, 'columns', ()) for error in col_errors]
 
-def validate_sheets(config, wb):
-    """Validate that required sheets and columns exist, and run pre-processing data checks."""
-    source_sheet = config['input']['sheet']['source']['name']
-    reference_sheet = config['input']['sheet']['reference']['name']
 
-    # Check if sheets exist
-    if source_sheet not in wb.sheetnames:
-        fatal(f"Error: Source sheet '{source_sheet}' does not exist")
-    if reference_sheet not in wb.sheetnames:
-        fatal(f"Error: Reference sheet '{reference_sheet}' does not exist")
+class SourceNullCheckRule(NullCheckRule):
+    sheet = 'source'
+    label = 'Null check (source)'
 
-    source = wb[source_sheet]
-    reference = wb[reference_sheet]
 
-    # Get header rows
-    source_headers = [cell.value for cell in source[1]]
-    reference_headers = [cell.value for cell in reference[1]]
+class ReferenceNullCheckRule(NullCheckRule):
+    sheet = 'reference'
+    label = 'Null check (reference)'
 
-    # Collect all errors first, report them together at the end
+
+class PaymentNullCheckRule(NullCheckRule):
+    sheet = 'payment'
+    label = 'Null check (payment)'
+
+
+NULL_CHECK_RULES = [SourceNullCheckRule, ReferenceNullCheckRule, PaymentNullCheckRule]
+
+# Pre-processing data checks, in report order. Adding a rule adds no sheet scan.
+VALIDATION_RULES = [
+    PaymentKeyRule,
+    ReferenceIndexRule,
+    ReferenceEmployeeIdRule,
+    ReferenceDuplicateRule,
+    ReferenceHoursRule,
+    ReferencePaymentRule,
+    ZeroHourProjectsRule,
+    SourceEmployeeIdRule,
+    SourcePaymentRule,
+    SplitPaymentRule,
+    EmployeeIdTypeRule,
+] + NULL_CHECK_RULES
+
+
+def _run_sheet_pass(ctx, sheet_key, rules):
+    """Run the rules of one sheet in a single fused pass over its rows."""
+    try:
+        row_checks = [rule.row for rule in rules
+                      if rule.prepare() is not False and type(rule).row is not ValidationRule.row]
+        if sheet_key is not None and row_checks:
+            for i in range(ctx.tables[sheet_key].nrows):
+                for check in row_checks:
+                    check(i)
+        for rule in rules:
+            rule.finish()
+    finally:
+        for rule in rules:
+            rule.flush()
+
+
+def _sheet_pass_worker(config, sheet_key, table, rule_classes, errors_so_far=0):
+    """One sheet pass on its own context (also the process pool entry point).
+
+    errors_so_far counts towards a fail_fast budget. Returns (indices,
+    (errors, count) per rule, errors of this pass, stopped).
+    """
+    ctx = ValidationContext(config, {sheet_key: table})
+    ctx.error_count = errors_so_far
+    rules = [rule_cls(ctx) for rule_cls in rule_classes]
+    try:
+        _run_sheet_pass(ctx, sheet_key, rules)
+    except _ErrorBudgetExhausted:
+        ctx.stopped = True
+    return (ctx.partial(), [(rule.errors, rule.count) for rule in rules],
+            ctx.error_count - errors_so_far, ctx.stopped)
+
+
+def _merge_pass_result(ctx, rules, result):
+    """Take over the indices, errors and counts of one sheet pass."""
+    partial, results, error_count, stopped = result
+    ctx.update(partial)
+    ctx.error_count += error_count
+    ctx.stopped = ctx.stopped or stopped
+    for rule, (rule_errors, rule_count) in zip(rules, results):
+        rule.errors, rule.count = rule_errors, rule_count
+
+
+def flatten_rule_errors(rules):
+    """The error messages of rules in report order.
+
+    Rules report in their list order, each in its own order; a run of
+    adjacent interleaved rules of one sheet is merged by row (rules in list
+    order within a row), as when those checks shared one loop.
+    """
     errors = []
+    for _key, group in groupby(rules, key=lambda rule: rule.sheet if rule.interleaved else id(rule)):
+        group = list(group)
+        if group[0].interleaved:
+            errors.extend(message for _row, message in
+                          heapq.merge(*(rule.errors for rule in group), key=lambda error: error[0]))
+        else:
+            errors.extend(group[0].errors)
+    return errors
+
+
+def run_validation_rules(ctx, rule_classes, workers=1):
+    """Run rules in one fused pass per sheet, then their cross-sheet merge step.
 
-    # Payment sheet is required
+    With a cache_dir, the result of each sheet pass is cached under a hash
+    of the sheet's contents and configuration (see validation_cache_path);
+    an unchanged sheet is not scanned again.
+
+    With workers > 1 the sheet passes run concurrently in a process pool;
+    their indices and errors are merged in VALIDATION_PASSES order, so the
+    report is the same as with a single process. With fail_fast each
+    worker counts from zero; the pass in which the merged count reaches
+    the budget is run again from the errors before it (a single process
+    would have stopped partway through it) and the later passes are
+    dropped, so the report matches there too.
+
+    Returns the errors in report order (see flatten_rule_errors()), at
+    most error_budget of them; per-rule counts are left in ctx.error_counts.
+    """
+    config = ctx.config
+    rules = [rule_cls(ctx) for rule_cls in rule_classes]
+    passes = [(sheet_key, [rule for rule in rules if rule.sheet == sheet_key])
+              for sheet_key in VALIDATION_PASSES]
+    passes = [(sheet_key, sheet_rules) for sheet_key, sheet_rules in passes if sheet_rules]
+
+    def cache_path(sheet_key, sheet_rules, errors_so_far):
+        if not config.get('cache_dir'):
+            return None
+        return validation_cache_path(ctx, sheet_key, [type(rule) for rule in sheet_rules], errors_so_far)
+
+    def cached(sheet_key, path):
+        result = load_cached_validation(config, path) if path else None
+        if result is not None:
+            print(f"已从缓存读取验证结果: {ctx.sheet_names[sheet_key]}")
+        return result
+
+    def run_pass(sheet_key, sheet_rules):
+        """One sheet pass in this process, counting on from ctx.error_count."""
+        path = cache_path(sheet_key, sheet_rules, ctx.error_count)
+        result = cached(sheet_key, path)
+        if result is None:
+            result = _sheet_pass_worker(config, sheet_key, ctx.tables[sheet_key],
+                                        [type(rule) for rule in sheet_rules], ctx.error_count)
+            if path:
+                save_cached_validation(config, path, result)
+        return result
+
+    if workers > 1 and len(passes) > 1:
+        # Passes are independent: each starts from an empty error count
+        results = {}
+        pending = []
+        for sheet_key, sheet_rules in passes:
+            path = cache_path(sheet_key, sheet_rules, 0)
+            results[sheet_key] = cached(sheet_key, path)
+            if results[sheet_key] is None:
+                pending.append((sheet_key, sheet_rules, path))
+        if pending:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+                futures = [pool.submit(_sheet_pass_worker, config, sheet_key, ctx.tables[sheet_key],
+                                       [type(rule) for rule in sheet_rules])
+                           for sheet_key, sheet_rules, _path in pending]
+                for (sheet_key, _rules, path), future in zip(pending, futures):
+                    results[sheet_key] = future.result()
+                    if path:
+                        save_cached_validation(config, path, results[sheet_key])
+        for sheet_key, sheet_rules in passes:
+            result = results[sheet_key]
+            if ctx.fail_fast and ctx.error_count and ctx.error_count + result[2] >= (ctx.error_budget or 1):
+                # The budget runs out in this pass: rerun it where a single process would start it
+                result = run_pass(sheet_key, sheet_rules)
+            _merge_pass_result(ctx, sheet_rules, result)
+            if ctx.stopped:
+                break
+    else:
+        for sheet_key, sheet_rules in passes:
+            if ctx.stopped:
+                break
+            _merge_pass_result(ctx, sheet_rules, run_pass(sheet_key, sheet_rules))
+
+    if not ctx.stopped:
+        try:
+            _run_sheet_pass(ctx, None, [rule for rule in rules if rule.sheet is None])
+            for rule in rules:
+                rule.merge()
+        except _ErrorBudgetExhausted:
+            ctx.stopped = True
+    ctx.error_counts = [(rule.label, rule.count) for rule in rules if rule.count]
+    errors = flatten_rule_errors(rules)
+    return errors if ctx.error_budget is None else errors[:ctx.error_budget]
+
+
+def check_null_columns(tables, config, errors):
+    """Configurable empty-value detection from null_check_columns per sheet.
+
+    Runs only the null-check rules (one pass per sheet, see NullCheckRule).
+    """
+    errors.extend(run_validation_rules(ValidationContext(config, tables), NULL_CHECK_RULES))
+
+
+def validate_sheets(config, wb, tables=None):
+    """Validate that required sheets and columns exist, and run pre-processing data checks.
+
+    The configured sheets are decoded once into SheetTables (wb may be opened
+    in read-only mode) and every check runs on those tables. Already decoded
+    tables (e.g. from the sheet cache) can be passed in instead.
+    Returns (tables, payment_mapping).
+    """
+    if tables is None:
+        tables = load_sheet_tables(config, wb)
+    source = tables['source']
+    reference = tables['reference']
+    payment = tables['payment']
+
+    source_sheet = config['input']['sheet']['source']['name']
     payment_sheet = config['input']['sheet']['payment']['name']
-    if payment_sheet not in wb.sheetnames:
-        fatal(f"Error: Payment sheet '{payment_sheet}' does not exist")
-    payment = wb[payment_sheet]
-    payment_headers = [cell.value for cell in payment[1]]
+
+    # Get header rows
+    source_headers = source.headers
+    reference_headers = reference.headers
+    payment_headers = payment.headers
+
+    # Collect all errors first, report them together at the end
+    errors = []
 
     # Validate required columns in source sheet
     required_source_columns = {
@@ -505,269 +3234,36 @@ def validate_sheets(config, wb):
             fatal(f"Error: output_columns header '{out_header}' not found in payment sheet '{payment_sheet}'")
 
     # --- Pre-processing data validation ---
-    ref_employee_id_col = get_column_index(reference_headers,
-                                           config['input']['sheet']['reference']['columns']['employee_id'])
-    ref_project_id_col = get_column_index(reference_headers,
-                                          config['input']['sheet']['reference']['columns']['project_id'])
-    ref_hours_col = get_column_index(reference_headers,
-                                     config['input']['sheet']['reference']['columns']['project_hours'])
-
-    source_project_id_col = get_column_index(source_headers,
-                                              config['input']['sheet']['source']['columns']['project_id'])
-
-    # Payment-related column indices
-    payment_mapping = {}
-    payment_project_id_col = get_column_index(payment_headers,
-                                              config['input']['sheet']['payment']['columns']['project_id'])
-    payment_employer_name_col = get_column_index(payment_headers,
-                                                  config['input']['sheet']['payment']['columns']['employer_name'])
-    payment_project_category_col = get_column_index(payment_headers,
-                                                     config['input']['sheet']['payment']['columns']['project_category'])
-
-    # Pre-compute output_columns column indices in payment sheet
-    payment_output_col_indices = {}
-    for out_header in output_columns:
-        payment_output_col_indices[out_header] = get_column_index(payment_headers, out_header)
-
-    # --- Payment checks ---
-    # Build payment_mapping before reference/source scans
-    ref_employee_ids = set()
-    ref_projects_by_employee = {}  # employee_id -> set of (project_id, project_category) for composite key check
-    ref_hours_by_employee = {}  # employee_id -> total_hours (to detect 0-hour rows)
-
-    # Check 2: Payment table - no duplicate (employer_name, project_id, project_category)
-    seen_payment_pairs = set()
-    reported_duplicates = set()
-    for row in payment.iter_rows(min_row=2):
-        proj_id = row[payment_project_id_col - 1].value
-        employer_name = row[payment_employer_name_col - 1].value
-        proj_category = row[payment_project_category_col - 1].value
-
-        # Skip rows with empty project_id, employer_name, or project_category
-        if proj_id is None or str(proj_id).strip() == '':
-            continue
-
-        proj_id_str = str(proj_id).strip()
-
-        if employer_name is None or str(employer_name).strip() == '':
-            continue
-        if proj_category is None or str(proj_category).strip() == '':
-            continue
-
-        proj_id_str = str(proj_id).strip()
-        employer_name_str = str(employer_name).strip()
-        proj_category_str = str(proj_category).strip()
-
-        # Check 2: no duplicate (employer_name, project_id, project_category)
-        pair = (employer_name_str, proj_id_str, proj_category_str)
-        if pair in seen_payment_pairs:
-            if pair not in reported_duplicates:
-                errors.append(f"Duplicate (employer_name='{employer_name_str}', project_id='{proj_id_str}', "
-                             f"project_category='{proj_category_str}') "
-                             f"found in sheet '{payment_sheet}'")
-                reported_duplicates.add(pair)
-            continue
-        seen_payment_pairs.add(pair)
-
-        # Build dict of all payment row values
-        row_values = {}
-        for col_idx, cell in enumerate(row, start=1):
-            header = payment_headers[col_idx - 1]
-            row_values[header] = cell.value
-        payment_mapping[pair] = row_values
-
-    # Build lookup set for Check 4: (project_id, project_category) pairs
-    payment_project_category_pairs = set((pid, pcat) for (_, pid, pcat) in payment_mapping.keys())
-
-    # --- Consolidated single-pass scan of reference sheet ---
-    # Checks 1, 4, 6, 8, 9, and partial 10 (type collection)
-    ref_project_category_col = get_column_index(reference_headers,
-                                                 config['input']['sheet']['reference']['columns']['project_category'])
-    ref_pairs = set()
-    reported_ref_duplicates = set()
-    ref_missing_pairs = set()
-    reported_empty_ref_id = False
-    ref_id_types = set()
-
-    for row_num, row in enumerate(reference.iter_rows(min_row=2), start=2):
-        emp_id = row[ref_employee_id_col - 1].value
-        proj_id = row[ref_project_id_col - 1].value
-        proj_category = row[ref_project_category_col - 1].value
-        hours_val = row[ref_hours_col - 1].value
-
-        # Check 6: empty employee_id
-        if not reported_empty_ref_id and (emp_id is None or
-           (isinstance(emp_id, str) and str(emp_id).strip() == '')):
-            errors.append(f"Empty employee_id in reference sheet '{reference_sheet}' row {row_num}")
-            reported_empty_ref_id = True
-
-        # Check 10: type info (skip if empty)
-        if emp_id is not None and not (isinstance(emp_id, str) and str(emp_id).strip() == ''):
-            ref_id_types.add(type(emp_id).__name__)
-
-        # Build ref_employee_ids and ref_projects_by_employee for source scan checks
-        # Store (project_id, project_category) tuples for 3-field matching
-        if emp_id is not None:
-            ref_employee_ids.add(emp_id)
-            if emp_id not in ref_projects_by_employee:
-                ref_projects_by_employee[emp_id] = set()
-            if proj_id is not None and str(proj_id).strip() != '':
-                proj_id_str = str(proj_id).strip()
-                proj_cat_str = str(proj_category).strip() if proj_category is not None else ''
-                ref_projects_by_employee[emp_id].add((proj_id_str, proj_cat_str))
-
-        # Track total hours per employee (for Check 11 zero-hour detection)
-        if emp_id is not None:
-            if emp_id not in ref_hours_by_employee:
-                ref_hours_by_employee[emp_id] = 0.0
-            if hours_val is not None:
-                try:
-                    ref_hours_by_employee[emp_id] += float(hours_val)
-                except (ValueError, TypeError):
-                    pass  # Non-numeric hours caught by Check 8
-
-        # Check 1: duplicate (employee_id, project_id, project_category)
-        if emp_id is not None and proj_id is not None:
-            proj_cat_str = str(proj_category).strip() if proj_category is not None else ''
-            pair = (emp_id, proj_id, proj_category)
-            if pair in ref_pairs:
-                if pair not in reported_ref_duplicates:
-                    errors.append(f"Duplicate (employee_id='{emp_id}', project_id='{proj_id}', "
-                                  f"project_category='{proj_category}') "
-                                  f"found in reference sheet '{reference_sheet}'")
-                    reported_ref_duplicates.add(pair)
-            else:
-                ref_pairs.add(pair)
-
-        # Check 4: (project_id, project_category) pair in payment
-        if proj_id is not None and str(proj_id).strip() != '':
-            proj_id_str = str(proj_id).strip()
-            proj_cat_str = str(proj_category).strip() if proj_category is not None else ''
-            if (proj_id_str, proj_cat_str) not in payment_project_category_pairs:
-                ref_missing_pairs.add((proj_id_str, proj_cat_str))
-
-        # Checks 8 and 9: non-numeric and negative hours
-        if hours_val is not None:
-            try:
-                hours_float = float(hours_val)
-                if hours_float < 0:
-                    errors.append(f"Negative project_hours '{hours_val}' in reference sheet "
-                                  f"'{reference_sheet}' row {row_num} "
-                                  f"(employee_id='{emp_id}', project_id='{proj_id}')")
-            except (ValueError, TypeError):
-                errors.append(f"Non-numeric project_hours '{hours_val}' in reference sheet "
-                              f"'{reference_sheet}' row {row_num} "
-                              f"(employee_id='{emp_id}', project_id='{proj_id}')")
-
-    # Report Check 4 errors after reference scan
-    if ref_missing_pairs:
-        for pid, pcat in sorted(ref_missing_pairs):
-            errors.append(f"(project_id='{pid}', project_category='{pcat}') in reference sheet "
-                         f"'{reference_sheet}' has no matching record in sheet '{payment_sheet}'")
-
-    # Check 0h: Zero-hour employees must have at most one distinct project_id in reference
-    for emp_id, total_hours in ref_hours_by_employee.items():
-        if total_hours == 0.0:
-            projects = ref_projects_by_employee.get(emp_id, set())
-            pids = {p for p, _ in projects}
-            if len(pids) > 1:
-                errors.append(f"employee_id='{emp_id}' has total hours=0 but multiple project_ids "
-                             f"in reference sheet '{reference_sheet}': {sorted(pids)}. "
-                             f"When hours are 0, only one project_id is allowed.")
-
-    # --- Consolidated single-pass scan of source sheet ---
-    # Checks 5, 7, partial 10 (type collection), and collect match context for split rows
-    src_employee_id_col = get_column_index(source_headers,
-                                           config['input']['sheet']['source']['columns']['employee_id'])
-    src_employer_name_col = get_column_index(source_headers,
-                                              config['input']['sheet']['source']['columns']['employer_name'])
-    src_project_category_col = get_column_index(source_headers,
-                                                 config['input']['sheet']['source']['columns']['project_category'])
-    reported_empty_src_id = False
-    src_id_types = set()
-    source_missing_pairs = set()
-    src_match_context_by_employee = {}  # employee_id -> set((employer_name,)) for split-eligible rows
-
-    for row_num, row in enumerate(source.iter_rows(min_row=2), start=2):
-        emp_id = row[src_employee_id_col - 1].value
-
-        # Check 7: empty employee_id
-        if not reported_empty_src_id and (emp_id is None or
-           (isinstance(emp_id, str) and str(emp_id).strip() == '')):
-            errors.append(f"Empty employee_id in source sheet '{source_sheet}' row {row_num}")
-            reported_empty_src_id = True
-
-        # Check 10: type info
-        if emp_id is not None and not (isinstance(emp_id, str) and str(emp_id).strip() == ''):
-            src_id_types.add(type(emp_id).__name__)
-
-        # Check 5: non-split rows must have payment mapping (3-field key)
-        if source_project_id_col and src_employer_name_col and src_project_category_col:
-            if emp_id in ref_employee_ids:
-                # Collect employer_name for composite key check (Check 11)
-                employer_name = row[src_employer_name_col - 1].value
-                employer_name_str = str(employer_name).strip() if employer_name is not None else ''
-                if emp_id not in src_match_context_by_employee:
-                    src_match_context_by_employee[emp_id] = set()
-                src_match_context_by_employee[emp_id].add(employer_name_str)
-                continue  # Will be split/replaced; source project_id/project_category replaced by reference
-            proj_id = row[source_project_id_col - 1].value
-            employer_name = row[src_employer_name_col - 1].value
-            proj_category = row[src_project_category_col - 1].value
-            if proj_id is not None and str(proj_id).strip() != '' \
-               and employer_name is not None and str(employer_name).strip() != '':
-                proj_id_str = str(proj_id).strip()
-                employer_name_str = str(employer_name).strip()
-                proj_cat_str = str(proj_category).strip() if proj_category is not None else ''
-                pair = (employer_name_str, proj_id_str, proj_cat_str)
-                if pair not in payment_mapping:
-                    source_missing_pairs.add(pair)
-
-    # Report Check 5 errors after source scan
-    if source_missing_pairs:
-        for pair in sorted(source_missing_pairs):
-            errors.append(f"(employer_name='{pair[0]}', project_id='{pair[1]}', "
-                         f"project_category='{pair[2]}') in source sheet "
-                         f"'{source_sheet}' has no matching record in sheet '{payment_sheet}'")
-
-    # Check 11: Split-eligible rows - composite key (employer_name, project_id, project_category) must exist in payment
-    # Reference project_ids and project_categories are used after split (and also for zero-hour rows
-    # which replace source project_id/project_category with reference values).
-    split_missing_pairs = set()
-    for emp_id, employer_names in src_match_context_by_employee.items():
-        ref_projects = ref_projects_by_employee.get(emp_id, set())
-        for employer_name in employer_names:
-            for proj_id, proj_cat in ref_projects:
-                pair = (employer_name, proj_id, proj_cat)
-                if pair not in payment_mapping:
-                    split_missing_pairs.add((emp_id, employer_name, proj_id, proj_cat))
-    for emp_id, employer_name, proj_id, proj_cat in sorted(split_missing_pairs):
-        errors.append(f"employee_id='{emp_id}', employer_name='{employer_name}', "
-                     f"project_id='{proj_id}', project_category='{proj_cat}' has no matching record "
-                     f"in sheet '{payment_sheet}'")
-
-    # Check 10: employee_id type mismatch between sheets
-    all_id_types = ref_id_types | src_id_types
-    if len(all_id_types) > 1:
-        types_str = ', '.join(sorted(all_id_types))
-        errors.append(f"employee_id type mismatch: found types [{types_str}] across "
-                     f"source and reference sheets. All employee_id values should be the same type.")
-
-    # --- Null check: configurable empty-value detection ---
-    check_null_columns(source, reference, payment,
-                       source_headers, reference_headers, payment_headers,
-                       config, errors)
+    # Payment, reference and source checks run as rules, one fused pass per sheet
+    ctx = ValidationContext(config, tables)
+    rule_errors = run_validation_rules(ctx, VALIDATION_RULES, config.get('validation_workers', 1))
+    errors.extend(rule_errors)
+    payment_mapping = ctx.payment_mapping
 
     # Report all collected errors at once
     if errors:
         error_msg = "Validation errors found:\n" + "\n".join(f"  - {e}" for e in errors)
+        shown = len(rule_errors)
+        if ctx.stopped or ctx.error_count > shown:
+            # Error budget: only the first messages are kept, the rest is counted per check
+            if ctx.stopped:
+                error_msg += (f"\nValidation stopped after {ctx.error_count} errors (fail_fast); "
+                              f"counts cover the rows checked so far")
+            else:
+                error_msg += f"\nShowing {shown} of {ctx.error_count} errors"
+            error_msg += "\nErrors per check:\n" + "\n".join(
+                f"  - {label}: {count}" for label, count in ctx.error_counts)
         fatal(error_msg)
 
-    return source, reference, source_headers, reference_headers, payment_mapping
+    return tables, payment_mapping
 
 
-def verify_output(config, source_headers):
-    """Verify the output file after processing. Returns a list of error messages."""
+def verify_output(config, source_headers, source_table=None):
+    """Verify the output file after processing. Returns a list of error messages.
+
+    When source_table (the decoded input source sheet) is given, source totals
+    are taken from it instead of re-reading the source sheet copy in the output.
+    """
     errors = []
     output_path = config['output']['path']
     result_sheet_name = config['output']['sheet']['result']['name']
@@ -783,7 +3279,10 @@ def verify_output(config, source_headers):
         return errors
 
     try:
-        wb = load_workbook(output_path)
+        if config.get('selective_load', False):
+            wb = SelectiveWorkbook(output_path, [result_sheet_name, source_sheet_name]).load()
+        else:
+            wb = load_workbook(output_path)
     except Exception as e:
         errors.append(f"Cannot open output file '{output_path}': {e}")
         return errors
@@ -840,8 +3339,13 @@ def verify_output(config, source_headers):
                     errors.append(f"Non-numeric value '{val}' in '{col_name}' at result row {i}")
 
     # Grand total consistency: sum of each splitting column in result should
-    # equal the sum in source (within rounding tolerance)
+    # equal the sum in source (within rounding tolerance; exactly, in cents,
+    # with split_arithmetic: cents)
+    cents = config.get('split_arithmetic', 'float') == 'cents'
+    to_sum = to_cents if cents else float
     # Precompute column indices
+    if source_table is not None:
+        source_out_headers = source_table.headers
     src_col_map_verify = {}
     res_col_map_verify = {}
     for col_name in splitting_columns:
@@ -853,24 +3357,30 @@ def verify_output(config, source_headers):
 
     if src_col_map_verify:
         # Single pass through source: sum all splitting columns
-        src_sums = {col_name: 0.0 for col_name in src_col_map_verify}
-        for row in source.iter_rows(min_row=2):
+        src_sums = {col_name: to_sum(0) for col_name in src_col_map_verify}
+        if source_table is not None:
             for col_name, col_idx in src_col_map_verify.items():
-                val = row[col_idx - 1].value
-                if val is not None:
-                    try:
-                        src_sums[col_name] += float(val)
-                    except (ValueError, TypeError):
-                        pass  # Non-numeric source values were caught by pre-checks
+                for val in source_table.floats(col_idx):
+                    if val is not None:
+                        src_sums[col_name] += to_sum(val)
+        else:
+            for row in source.iter_rows(min_row=2, max_row=used_max_row(source)):
+                for col_name, col_idx in src_col_map_verify.items():
+                    val = row[col_idx - 1].value
+                    if val is not None:
+                        try:
+                            src_sums[col_name] += to_sum(float(val))
+                        except (ValueError, TypeError):
+                            pass  # Non-numeric source values were caught by pre-checks
 
         # Single pass through result: sum all splitting columns
-        res_sums = {col_name: 0.0 for col_name in res_col_map_verify}
+        res_sums = {col_name: to_sum(0) for col_name in res_col_map_verify}
         for row in result.iter_rows(min_row=2):
             for col_name, col_idx in res_col_map_verify.items():
                 val = row[col_idx - 1].value
                 if val is not None:
                     try:
-                        res_sums[col_name] += float(val)
+                        res_sums[col_name] += to_sum(float(val))
                     except (ValueError, TypeError):
                         pass  # Already caught above
 
@@ -878,9 +3388,11 @@ def verify_output(config, source_headers):
         for col_name in splitting_columns:
             if col_name not in src_col_map_verify or col_name not in res_col_map_verify:
                 continue
-            src_sum = src_sums.get(col_name, 0.0)
-            res_sum = res_sums.get(col_name, 0.0)
-            if abs(res_sum - src_sum) > 0.001:
+            src_sum = src_sums[col_name]
+            res_sum = res_sums[col_name]
+            if res_sum != src_sum if cents else abs(res_sum - src_sum) > 0.001:
+                if cents:
+                    src_sum, res_sum = src_sum / 100, res_sum / 100
                 errors.append(f"Total mismatch for '{col_name}': "
                              f"source sum={src_sum:.2f}, result sum={res_sum:.2f}")
 
@@ -888,6 +3400,129 @@ def verify_output(config, source_headers):
     return errors
 
 
+class OutputVerifier:
+    """verify_output's checks of the result sheet, made while its rows are written.
+
+    add() takes the values of each result row in write order and keeps the
+    empty row and numeric checks and the running totals of the splitting
+    columns; errors() compares the totals with the source table. Values are
+    judged as they read back from the saved file, where empty strings
+    become empty cells. Messages and their order are those of verify_output.
+    """
+
+    def __init__(self, config, result_headers, source_table):
+        self.result_sheet_name = config['output']['sheet']['result']['name']
+        self.splitting_columns = list(dict.fromkeys(config['input']['splitting_columns']))
+        computed_col_names = list(config['input'].get('computed_columns') or {})
+        self.cents = config.get('split_arithmetic', 'float') == 'cents'
+        self.to_sum = to_cents if self.cents else float
+        self.source_table = source_table
+        self.header_errors = []
+        self.empty_errors = []
+        self.numeric_errors = []
+        self.rows = 0
+
+        # Splitting and computed columns must be numeric in the result
+        self.numeric_columns = []  # (name, 0-based position)
+        for col_name in self.splitting_columns + [name for name in computed_col_names
+                                                  if name not in self.splitting_columns]:
+            col_idx = get_column_index(result_headers, col_name)
+            if col_idx is None:
+                kind = 'Splitting' if col_name in self.splitting_columns else 'Computed'
+                self.header_errors.append(f"{kind} column '{col_name}' not found in result headers")
+            else:
+                self.numeric_columns.append((col_name, col_idx - 1))
+
+        # Totals of the splitting columns found in both the source and the result
+        self.sums = {}  # name -> [source column, running result total]
+        for col_name in self.splitting_columns:
+            src_idx = get_column_index(source_table.headers, col_name)
+            if src_idx and get_column_index(result_headers, col_name):
+                self.sums[col_name] = [src_idx, self.to_sum(0)]
+
+    def add(self, values):
+        """Check the next result row (a value list)."""
+        self.rows += 1
+        row_number = self.rows + 1
+        if all(value is None or value == '' for value in values):
+            self.empty_errors.append(f"Empty row {row_number} in result sheet '{self.result_sheet_name}'")
+        for col_name, pos in self.numeric_columns:
+            val = values[pos] if pos < len(values) else None
+            if val is not None and val != '':
+                try:
+                    number = float(val)
+                except (ValueError, TypeError):
+                    self.numeric_errors.append(f"Non-numeric value '{val}' in '{col_name}' at result row {row_number}")
+                    continue
+                total = self.sums.get(col_name)
+                if total is not None:
+                    total[1] += self.to_sum(number)
+
+    def errors(self):
+        """All error messages, the grand total consistency of the splitting columns included."""
+        errors = self.empty_errors + self.header_errors + self.numeric_errors
+        for col_name, (src_idx, res_sum) in self.sums.items():
+            src_sum = self.to_sum(0)
+            for val in self.source_table.floats(src_idx):
+                if val is not None:
+                    src_sum += self.to_sum(val)
+            if res_sum != src_sum if self.cents else abs(res_sum - src_sum) > 0.001:
+                if self.cents:
+                    src_sum, res_sum = src_sum / 100, res_sum / 100
+                errors.append(f"Total mismatch for '{col_name}': "
+                              f"source sum={src_sum:.2f}, result sum={res_sum:.2f}")
+        return errors
+
+
+def check_output_archive(config, expected_rows=None):
+    """Cheap integrity check of the saved output file, in place of reloading it.
+
+    The file must be a readable xlsx archive whose workbook lists the result
+    and source sheets, with every worksheet part present. The result sheet
+    part is read through, which checks its CRC, counting its rows that hold
+    cells (rows written only for their height hold none); with
+    expected_rows given (data rows, without the header) the count must
+    match. Returns a list of error messages.
+    """
+    row_with_cells = re.compile(rb'<row [^>]*[^/]>\s*<c[ >/]')
+    output_path = config['output']['path']
+    result_sheet_name = config['output']['sheet']['result']['name']
+    source_sheet_name = config['input']['sheet']['source']['name']
+    if not os.path.exists(output_path):
+        return [f"Output file '{output_path}' does not exist"]
+    try:
+        with zipfile.ZipFile(output_path) as archive:
+            names = set(archive.namelist())
+            if '[Content_Types].xml' not in names:
+                return [f"Cannot open output file '{output_path}': [Content_Types].xml is missing"]
+            _workbook_part, _rels, sheet_parts, _date1904 = read_workbook_sheets(archive)
+            missing = [part for part in sheet_parts.values() if part not in names]
+            if missing:
+                return [f"Cannot open output file '{output_path}': missing parts {', '.join(missing)}"]
+            if result_sheet_name not in sheet_parts:
+                return [f"Result sheet '{result_sheet_name}' not found in output file"]
+            if source_sheet_name not in sheet_parts:
+                return [f"Source sheet '{source_sheet_name}' not found in output file"]
+            rows = 0
+            tail = b''
+            with archive.open(sheet_parts[result_sheet_name]) as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    data = tail + chunk
+                    # The last row may be cut by the chunk boundary: it is counted with the next chunk
+                    cut = data.rfind(b'<row ')
+                    if cut < 0:
+                        cut = max(0, len(data) - 4)
+                    rows += len(row_with_cells.findall(data, 0, cut))
+                    tail = data[cut:]
+            rows += len(row_with_cells.findall(tail))
+    except Exception as e:
+        return [f"Cannot open output file '{output_path}': {e}"]
+    if expected_rows is not None and rows != expected_rows + 1:
+        return [f"Result sheet '{result_sheet_name}' has {rows - 1} data rows in output file, "
+                f"expected {expected_rows}"]
+    return []
+
+
 def validate_config(config):
     """Validate configuration structure. Returns computed_columns."""
     errors = []
@@ -1016,6 +3651,46 @@ def validate_config(config):
                 else:
                     seen.add(col)
 
+    # Performance options (optional)
+    split_engine = config.get('split_engine', 'python')
+    if split_engine not in ('python', 'numpy'):
+        errors.append(f"Invalid 'split_engine' value '{split_engine}' (expected 'python' or 'numpy')")
+    computed_engine = config.get('computed_engine', 'python')
+    if computed_engine not in ('python', 'numpy'):
+        errors.append(f"Invalid 'computed_engine' value '{computed_engine}' (expected 'python' or 'numpy')")
+
+    split_arithmetic = config.get('split_arithmetic', 'float')
+    if split_arithmetic not in ('float', 'cents'):
+        errors.append(f"Invalid 'split_arithmetic' value '{split_arithmetic}' (expected 'float' or 'cents')")
+    elif split_arithmetic == 'cents' and split_engine == 'numpy':
+        errors.append("'split_engine: numpy' requires 'split_arithmetic: float'")
+    remainder_policy = config.get('remainder_policy', 'last')
+    if remainder_policy not in ('last', 'largest'):
+        errors.append(f"Invalid 'remainder_policy' value '{remainder_policy}' (expected 'last' or 'largest')")
+    elif remainder_policy != 'last' and split_arithmetic != 'cents':
+        errors.append("'remainder_policy' requires 'split_arithmetic: cents'")
+
+    validation_engine = config.get('validation_engine', 'workbook')
+    if validation_engine not in ('workbook', 'streaming', 'xml'):
+        errors.append(f"Invalid 'validation_engine' value '{validation_engine}' "
+                      f"(expected 'workbook', 'streaming' or 'xml')")
+    cache_dir = config.get('cache_dir')
+    if cache_dir is not None and (not isinstance(cache_dir, str) or cache_dir.strip() == ''):
+        errors.append("Invalid 'cache_dir' in configuration (expected a non-empty path)")
+    for key in ('cache_max_size_mb', 'cache_max_age_days'):
+        value = config.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or value <= 0):
+            errors.append(f"Invalid '{key}' value '{value}' (expected a positive number)")
+    error_budget = config.get('error_budget')
+    if error_budget is not None and (isinstance(error_budget, bool) or not isinstance(error_budget, int)
+                                     or error_budget < 1):
+        errors.append(f"Invalid 'error_budget' value '{error_budget}' (expected a positive integer)")
+    for key in ('validation_workers', 'split_workers'):
+        workers = config.get(key, 1)
+        if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+            errors.append(f"Invalid '{key}' value '{workers}' (expected a positive integer)")
+
     # Check output section
     out = config.get('output')
     if out is None:
@@ -1042,7 +3717,7 @@ def validate_config(config):
 def process_excel(config):
     """Process Excel file according to configuration."""
     # Validate config structure first
-    computed_columns_cfg = validate_config(config)
+    validate_config(config)
 
     input_path = config['input']['path']
     output_path = config['output']['path']
@@ -1052,235 +3727,193 @@ def process_excel(config):
     if not os.path.exists(input_path):
         fatal(f"Error: Input file '{input_path}' does not exist")
 
-    try:
-        # Load the workbook
-        print(f"正在加载工作簿: {input_path}")
-        wb = load_workbook(input_path, data_only=True)
-        print("工作簿加载完成")
-        
-        # Validate sheets and columns
-        source, reference, source_headers, reference_headers, payment_mapping = \
-            validate_sheets(config, wb)
-        print("验证完成")
+    single_load = config.get('single_load', False)
+    validation_engine = config.get('validation_engine', 'workbook')
 
-        # Create a new workbook for output
-        output_wb = load_workbook(input_path)
+    # With single_load and the streaming and xml engines the cell values are only
+    # read into the decoded tables; the result rows then take every source value
+    # from the source table
+    tables_only = single_load or validation_engine in ('streaming', 'xml')
 
-        # If result sheet exists, remove it
-        if result_sheet in output_wb.sheetnames:
-            output_wb.remove(output_wb[result_sheet])
+    # Tables are pruned to the configured columns, except when they are cached:
+    # cached tables must also serve later runs with different column settings
+    cache_dir = config.get('cache_dir')
+    prune = not cache_dir
+
+    try:
+        selective = None
+        if config.get('selective_load', False):
+            # 选择性加载：只解析 source/reference/payment 三张表，其余 sheet 原样带入输出
+            selective = SelectiveWorkbook(
+                input_path,
+                [config['input']['sheet'][key]['name'] for key in ('source', 'reference', 'payment')],
+                discard=[result_sheet])
+
+        cached_tables = load_cached_tables(config, input_path) if cache_dir else None
+        # On a cache hit, and when the values are only read from the sheet XML, the
+        # cell values come from the decoded tables, so only the styled workbook is parsed
+        values_from_tables = cached_tables is not None or tables_only
+
+        if cached_tables is not None:
+            print(f"已从缓存读取表格数据: {cache_dir}")
+            print(f"正在加载工作簿: {input_path}")
+            wb = load_input_workbook(input_path, selective)
+            print("工作簿加载完成")
+
+            tables, payment_mapping = validate_sheets(config, wb, cached_tables)
+            print("验证完成")
+        elif validation_engine == 'streaming':
+            # 流式验证：只读模式逐行读取单元格值解码为数据表，不为这三张表创建可写工作簿的单元格对象；
+            # 拆分所用的单元格值取自数据表，工作簿只按带样式和公式的方式解析一次
+            print(f"正在流式验证工作簿: {input_path}")
+            ro_wb = load_workbook(input_path, read_only=True, data_only=True)
+            try:
+                tables = load_sheet_tables(config, ro_wb, prune=prune, keep_source=tables_only)
+            finally:
+                ro_wb.close()
+            if cache_dir:
+                save_cached_tables(config, input_path, tables)
+            tables, payment_mapping = validate_sheets(config, ro_wb, tables)
+            print("验证完成")
+
+            print(f"正在加载工作簿: {input_path}")
+            wb = load_input_workbook(input_path, selective)
+            print("工作簿加载完成")
+        elif tables_only:
+            # XML 直读：从 zip 中增量解析 sheet XML 与共享字符串，只取单元格值，不创建 Cell 对象；
+            # 工作簿只按带样式和公式的方式解析一次，拆分所用的单元格值取自解码后的数据表
+            print(f"正在直读工作簿 XML: {input_path}")
+            reader = XlsxValueReader(input_path)
+            try:
+                tables = load_sheet_tables(config, reader, prune=prune, keep_source=True)
+            finally:
+                reader.close()
+            if cache_dir:
+                save_cached_tables(config, input_path, tables)
+            tables, payment_mapping = validate_sheets(config, reader, tables)
+            print("验证完成")
+
+            print(f"正在加载工作簿: {input_path}")
+            wb = load_input_workbook(input_path, selective)
+            print("工作簿加载完成")
+        else:
+            # Load the workbook
+            print(f"正在加载工作簿: {input_path}")
+            wb = load_input_workbook(input_path, selective, data_only=True)
+            print("工作簿加载完成")
+
+            # Validate sheets and columns
+            tables = load_sheet_tables(config, wb, prune=prune)
+            if cache_dir:
+                save_cached_tables(config, input_path, tables)
+            tables, payment_mapping = validate_sheets(config, wb, tables)
+            print("验证完成")
+
+        # Values come from the decoded tables; the source worksheet supplies cells and styles
+        source = wb[config['input']['sheet']['source']['name']]
+        source_headers = list(tables['source'].headers)
+        reference_headers = tables['reference'].headers
 
         keep_style = config.get('keep_style', True)
+        write_only = config.get('write_only', False)
 
-        # Create new sheet
-        result = output_wb.create_sheet(result_sheet)
+        # Create a new workbook for output
+        if values_from_tables:
+            # 缓存命中或单元格值取自数据表：已加载的是带样式和公式的工作簿，直接用作输出
+            styled_wb = wb
+        else:
+            styled_wb = load_input_workbook(input_path, selective)
+
+        # write_only streams only the result sheet; the other sheets are carried
+        # over unchanged by the passthrough save
+        passthrough_save = config.get('passthrough_save', False) or write_only
+
+        output_wb = styled_wb
+        if write_only:
+            # 只写模式：结果表以只写方式挂在样式工作簿上逐批写出，其他 sheet 由直通保存原样拷贝
+            result = WriteOnlyWorksheet(output_wb, result_sheet)
+        else:
+            # If result sheet exists, remove it
+            if result_sheet in output_wb.sheetnames:
+                output_wb.remove(output_wb[result_sheet])
+            result = output_wb.create_sheet(result_sheet)
 
         # Copy headers
-        for cell in source[1]:
-            new_cell = result.cell(row=1, column=cell.column)
-            new_cell.value = cell.value
-            if keep_style:
-                copy_cell_style(cell, new_cell)
+        header_cells = list(source[1])
 
         # Ensure output_columns exist in source_headers; append if missing
         output_columns = config['input']['sheet']['payment']['output_columns']
         for out_header in output_columns:
             if get_column_index(source_headers, out_header) is None:
                 new_col = len(source_headers) + 1
-                header_cell = result.cell(row=1, column=new_col)
-                header_cell.value = out_header
+                header_cells.append(Cell(None, column=new_col, value=out_header))
                 source_headers.append(out_header)
 
-        # Precompute column name -> index maps for O(1) lookups (after source_headers is finalized)
-        source_col_map = {name: idx + 1 for idx, name in enumerate(source_headers)}
-        ref_col_map = {name: idx + 1 for idx, name in enumerate(reference_headers)}
-
-        # Precompute splitting column indices as set (fast membership test in split_row)
-        splitting_col_set = set()
-        for col_name in config['input']['splitting_columns']:
-            idx = source_col_map.get(col_name)
-            if idx is not None:
-                splitting_col_set.add(idx)
-
-        # Pre-parse computed column formulas
-        computed_columns_cfg = config.get('input', {}).get('computed_columns', {})
-        computed_asts = []  # list of (name, ast, col_index)
-        if computed_columns_cfg:
-            known_for_parse = set(source_headers)
-            for cc_name, cc_formula in computed_columns_cfg.items():
-                ast = parse_formula(tokenize_formula(cc_formula, known_for_parse))
-                cc_idx = source_col_map[cc_name]
-                computed_asts.append((cc_name, ast, cc_idx))
-                known_for_parse.add(cc_name)
-
-        # Process data rows
-        current_row = 2
-        reference_rows = list(reference.iter_rows(min_row=2))  # Convert iterator to list
-
-        # Pre-index reference rows by employee_id for O(1) lookup
-        ref_employee_id_col = ref_col_map[config['input']['sheet']['reference']['columns']['employee_id']]
-        ref_by_employee = {}
-        for ref_row in reference_rows:
-            emp_id = ref_row[ref_employee_id_col - 1].value
-            if emp_id not in ref_by_employee:
-                ref_by_employee[emp_id] = []
-            ref_by_employee[emp_id].append(ref_row)
-
-        total_source_rows = source.max_row - 1  # Subtract header row
-        total_reference_rows = len(reference_rows)
-        print(f"开始处理数据，共 {total_source_rows} 行（参考表 {total_reference_rows} 行，{len(ref_by_employee)} 个员工）")
+        if write_only:
+            # Row/column dimensions must be set before the first row is streamed
+            copy_sheet_dimensions(source, result)
+            translate_style = make_style_translator(source, result) if keep_style else None
+            result.append(to_write_only_row(result, header_cells, translate_style))
+        else:
+            for cell in header_cells:
+                new_cell = result.cell(row=1, column=cell.column)
+                new_cell.value = cell.value
+                if keep_style:
+                    copy_cell_style(cell, new_cell)
+
+        # Process data rows: split, populate, compute and verify one source row at a time,
+        # writing its result rows right away
+        pipeline = SplitPipeline(config, tables, payment_mapping, source_headers, reference_headers)
+        source_table = tables['source']
+        print(f"开始处理数据，共 {source_table.nrows} 行（参考表 {tables['reference'].nrows} 行，"
+              f"{len(pipeline.planner.ref_by_employee)} 个员工）")
+        if pipeline.split_workers > 1:
+            print(f"并行拆分：{pipeline.split_workers} 个进程")
         write_batch_size = config.get('write_batch_size', 500)
-        row_counter = 0
-        all_result_rows = []  # Collect (values_list, cells_list) tuples, write later
-        rows_to_compute = set()  # Indices of rows that need computed column evaluation
-        src_row_groups = []  # List of (source_row, [result_indices]) for per-source-row verification
-
-        # Pre-fetch column indices for split detection
-        src_emp_col = source_col_map[config['input']['sheet']['source']['columns']['employee_id']]
-        ref_hours_col = ref_col_map[config['input']['sheet']['reference']['columns']['project_hours']]
+        current_row = 2
+        t_write_total = 0.0
+        # Output checks are made on the rows as they are written, unless the saved file is to be reloaded
+        deep_verify = config.get('deep_verify', False)
+        verifier = None if deep_verify else OutputVerifier(
+            config, [cell.value for cell in header_cells], source_table)
 
         t_total_start = time.time()
-        t_split_total = 0.0
-        for row in source.iter_rows(min_row=2):
-            row_counter += 1
-            if row_counter % write_batch_size == 0 or row_counter == 1:
-                elapsed = time.time() - t_total_start
-                rate = row_counter / elapsed if elapsed > 0 else 0
-                eta = (total_source_rows - row_counter) / rate if rate > 0 else 0
-                print(f"正在处理第 {row_counter}/{total_source_rows} 行 (已耗时 {elapsed:.0f}s, 速度 {rate:.1f} 行/秒, 预计剩余 {eta:.0f}s)...")
-
-            # Determine if this source row will be split (has matching ref with total hours > 0)
-            emp_id_val = row[src_emp_col - 1].value
-            matching = ref_by_employee.get(emp_id_val, [])
-            total_ref = 0.0
-            for r in matching:
-                try:
-                    total_ref += float(r[ref_hours_col - 1].value or 0)
-                except (ValueError, TypeError):
-                    pass
-            is_split = len(matching) > 0 and total_ref > 0
-
-            t0 = time.time()
-            split_result_rows = split_row(row, ref_by_employee, source_headers, reference_headers, config,
-                                           source_col_map, ref_col_map, splitting_col_set)
-            t_split_total += time.time() - t0
-
-            # Populate output columns from payment mapping for each split row
-            populate_payment_account(split_result_rows, payment_mapping, config, source_col_map,
-                                     source_headers)
-
-            start_idx = len(all_result_rows)
-            for result_row in split_result_rows:
-                all_result_rows.append(result_row)
-
-            # Mark split rows for computed column evaluation
-            end_idx = len(all_result_rows)
-            if is_split and computed_asts:
-                for i in range(start_idx, end_idx):
-                    rows_to_compute.add(i)
-                src_row_groups.append((row, list(range(start_idx, end_idx))))
+        for group in pipeline.run(source, values_from_tables):
+            t_write_start = time.time()
+            for result_row in group.rows:
+                if write_only:
+                    result.append(to_write_only_values(result, result_row, group.style_cells, translate_style))
+                else:
+                    for col, (value, style_cell) in enumerate(zip(result_row, group.style_cells), 1):
+                        new_cell = result.cell(row=current_row, column=col)
+                        new_cell.value = value
+                        if keep_style:
+                            copy_cell_style(style_cell, new_cell)
+                if verifier is not None:
+                    verifier.add(result_row)
+                current_row += 1
+            t_write_total += time.time() - t_write_start
+        total_result_rows = current_row - 2
+        computed_errors = pipeline.computed_errors
 
         total_elapsed = time.time() - t_total_start
-        print(f"处理耗时分析：拆分 {t_split_total:.1f}s, 总计 {total_elapsed:.1f}s")
-
-        # Compute formulas for split rows
-        computed_errors = []
-        if computed_asts and rows_to_compute:
-            t_compute_start = time.time()
-            max_cols = len(source_headers)
-            # Pre-collect all column names referenced in any formula
-            ref_names = set()
-            for _cc_name, ast, _cc_idx in computed_asts:
-                ref_names.update(collect_refs(ast))
-            for idx in rows_to_compute:
-                row = all_result_rows[idx]
-                # Pad row to max_cols if needed (for newly appended columns)
-                while len(row) < max_cols:
-                    dummy = Cell(None, column=len(row) + 1)
-                    dummy.value = None
-                    row.append(dummy)
-                # Build values dict from referenced columns only
-                values = {}
-                for hdr_name in ref_names:
-                    col_idx = source_col_map[hdr_name]
-                    v = row[col_idx - 1].value
-                    if v is None:
-                        values[hdr_name] = 0.0
-                    else:
-                        try:
-                            values[hdr_name] = float(v)
-                        except (ValueError, TypeError):
-                            fatal(f"Error: 计算列引用的列 '{hdr_name}' 存在非数值 '{v}'")
-                # Evaluate formulas in order
-                for cc_name, ast, cc_idx in computed_asts:
-                    result_val = evaluate_formula(ast, values)
-                    result_val = round(result_val, 2)
-                    values[cc_name] = result_val
-                    row[cc_idx - 1].value = result_val
-            t_compute_total = time.time() - t_compute_start
-            print(f"计算列耗时：{t_compute_total:.1f}s (共 {len(rows_to_compute)} 行)")
-
-            # Per-source-row verification: sum of computed columns across split rows
-            # must equal the source row's original value.
-            # Collect all mismatches first, then report after file is saved.
-            src_employee_id_name = config['input']['sheet']['source']['columns']['employee_id']
-            computed_errors = []
-            for src_row, result_indices in src_row_groups:
-                emp_id = src_row[source_col_map[src_employee_id_name] - 1].value
-                for cc_name, _ast, cc_idx in computed_asts:
-                    # Skip if source row doesn't have this column (e.g. newly appended)
-                    if cc_idx > len(src_row):
-                        continue
-                    src_val = src_row[cc_idx - 1].value
-                    if src_val is None:
-                        continue  # Source had no value for this column, skip
-                    try:
-                        src_val_f = float(src_val)
-                    except (ValueError, TypeError):
-                        continue
-                    # Sum computed values across all result rows from this source row
-                    result_sum = 0.0
-                    for ri in result_indices:
-                        v = all_result_rows[ri][cc_idx - 1].value
-                        if v is not None:
-                            try:
-                                result_sum += float(v)
-                            except (ValueError, TypeError):
-                                pass
-                    if abs(result_sum - src_val_f) > 0.001:
-                        computed_errors.append(
-                            f"计算列 '{cc_name}' 源行 employee_id='{emp_id}' "
-                            f"拆分结果合计 ({result_sum:.2f}) 与源行值 ({src_val_f:.2f}) 不一致"
-                        )
-
-        # Batch write to worksheet
-        t_write_start = time.time()
-        current_row = 2
-        total_result_rows = len(all_result_rows)
-        for batch_start in range(0, total_result_rows, write_batch_size):
-            batch = all_result_rows[batch_start:batch_start + write_batch_size]
-            for i, result_row in enumerate(batch):
-                row_num = current_row + i
-                for cell in result_row:
-                    new_cell = result.cell(row=row_num, column=cell.column)
-                    new_cell.value = cell.value
-                    if keep_style:
-                        copy_cell_style(cell, new_cell)
-            current_row += len(batch)
-        t_write_total = time.time() - t_write_start
-        print(f"写入耗时：{t_write_total:.1f}s (共 {total_result_rows} 行，批次大小 {write_batch_size})")
-
-        # Copy column dimensions
-        for col in source.column_dimensions:
-            result.column_dimensions[col].width = source.column_dimensions[col].width
+        print(f"处理耗时分析：拆分 {pipeline.t_split:.1f}s, 总计 {total_elapsed:.1f}s")
+        if pipeline.computed_rows:
+            print(f"计算列耗时：{pipeline.t_compute:.1f}s (共 {pipeline.computed_rows} 行)")
 
-        # Copy row dimensions
-        for row in source.row_dimensions:
-            result.row_dimensions[row].height = source.row_dimensions[row].height
+        if not write_only:
+            # Copy column and row dimensions
+            copy_sheet_dimensions(source, result)
+        print(f"写入耗时：{t_write_total:.1f}s (共 {total_result_rows} 行，批次大小 {write_batch_size})")
 
         # Save the output file
         print("处理完成，正在保存输出文件...")
-        output_wb.save(output_path)
+        if passthrough_save:
+            save_passthrough(input_path, output_path, result)
+        elif selective is not None:
+            selective.save(output_wb, output_path)
+        else:
+            output_wb.save(output_path)
         print("输出文件保存成功")
 
         # Report computed column verification errors (if any)
@@ -1290,7 +3923,12 @@ def process_excel(config):
 
         # Verify output after save
         print("正在验证输出结果...")
-        output_errors = verify_output(config, source_headers)
+        if deep_verify:
+            output_errors = verify_output(config, source_headers, source_table)
+        else:
+            # The row count is only meaningful without empty rows (unstyled ones are not saved)
+            output_errors = (check_output_archive(config, None if verifier.empty_errors else total_result_rows)
+                             or verifier.errors())
         if output_errors:
             error_msg = "Output verification errors:\n" + "\n".join(f"  - {e}" for e in output_errors)
             fatal(error_msg)
@@ -1303,6 +3941,9 @@ def process_excel(config):
         fatal(f"Error processing Excel file: {e}")
 
 def fatal(message):
+    if _shard_splitter is not None:
+        # In a split worker process: the parent reports the error
+        raise _WorkerFatal(message)
     print(message)
     try:
         input("执行失败，按回车键退出")
@@ -1326,4 +3967,5 @@ def main():
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # worker processes of a PyInstaller build
     main() 
\ No newline at end of file
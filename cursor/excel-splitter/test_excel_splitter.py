@@ -369,6 +369,33 @@ class TestExcelSplitter(unittest.TestCase):
         self.assertEqual(row3_data[6], '研发部')
         self.assertEqual(row3_data[10], 'Account_RD')
 
+    def test_employee_rows_share_split_plan(self):
+        """Several source rows of one employee are split by the same plan."""
+        source_headers = ['姓名', '工号', '部门', '基本工资', '岗位工资', '费用类别', '费用所属中心', '实际出勤', '分管领导', '工资所属单位']
+        self.source_sheet.append(source_headers)
+        self.source_sheet.append(['张三', 'AA', '中国', 1000.00, 3000.00, '研发', '研发部', 21, 'BB', '公司A'])
+        self.source_sheet.append(['张三', 'AA', '中国', 100.01, None, '研发', '研发部', 21, 'BB', '公司B'])
+
+        reference_headers = ['姓名', '工号', '费用类别', '费用所属中心', '实际出勤']
+        self.reference_sheet.append(reference_headers)
+        self.reference_sheet.append(['张三', 'AA', '研发', '1', 1])
+        self.reference_sheet.append(['张三', 'AA', '研发', '2', 2])
+
+        payment_headers = ['费用所属中心', '公司', '费用类别', '支付账号']
+        self.payment_sheet.append(payment_headers)
+        for company in ('公司A', '公司B'):
+            self.payment_sheet.append(['1', company, '研发', f'{company}_1'])
+            self.payment_sheet.append(['2', company, '研发', f'{company}_2'])
+        self.wb.save('test_input.xlsx')
+        process_excel(self.config)
+
+        rows = self._read_result_values()[1:]
+        self.assertEqual([(row[6], row[7], row[10]) for row in rows],
+                         [('1', 1, '公司A_1'), ('2', 2, '公司A_2'),
+                          ('1', 1, '公司B_1'), ('2', 2, '公司B_2')])
+        self.assertEqual([(row[3], row[4]) for row in rows],
+                         [(333.33, 1000.0), (666.67, 2000.0), (33.33, None), (66.68, None)])
+
     # --- Config validation tests ---
 
     def _make_minimal_config(self):
@@ -1146,6 +1173,66 @@ class TestExcelSplitter(unittest.TestCase):
         with self.assertRaises(SystemExit):
             process_excel(config)
 
+    def _setup_split_data(self):
+        source_headers = ['姓名', '工号', '部门', '基本工资', '岗位工资', '费用类别', '费用所属中心', '实际出勤', '分管领导', '工资所属单位']
+        self.source_sheet.append(source_headers)
+        self.source_sheet.append(['张三', 'AA', '中国', 1000.00, 3000.00, '研发', '研发部', 21, 'BB', '公司A'])
+        self.source_sheet.append(['李四', 'CC', '中国', 2000.00, 1000.00, '研发', '研发部', 20, 'BB', '公司A'])
+        self.reference_sheet.append(['姓名', '工号', '费用类别', '费用所属中心', '实际出勤'])
+        self.reference_sheet.append(['张三', 'AA', '研发', '1', 1])
+        self.reference_sheet.append(['张三', 'AA', '研发', '2', 2])
+        self.payment_sheet.append(['费用所属中心', '公司', '费用类别', '支付账号'])
+        self.payment_sheet.append(['1', '公司A', '研发', 'Account_1'])
+        self.payment_sheet.append(['2', '公司A', '研发', 'Account_2'])
+        self.payment_sheet.append(['研发部', '公司A', '研发', 'Account_RD'])
+        self.wb.save('test_input.xlsx')
+        return source_headers
+
+    def test_in_pass_verification_matches_verify_output(self):
+        """OutputVerifier reports what verify_output finds on reload."""
+        from main import OutputVerifier, SheetTable, verify_output, check_output_archive
+        source_headers = self._setup_split_data()
+        for deep_verify in (False, True):
+            self.config['deep_verify'] = deep_verify
+            process_excel(self.config)
+            self.assertEqual([], check_output_archive(self.config, 3))
+
+        source_table = SheetTable.from_worksheet(load_workbook('test_input.xlsx')['工资'])
+        output_wb = load_workbook('test_output.xlsx')
+        result_sheet = output_wb['工资拆分']
+        rows = [[cell.value for cell in row] for row in result_sheet.iter_rows()]
+        verifier = OutputVerifier(self.config, rows[0], source_table)
+        for row in rows[1:]:
+            verifier.add(row)
+        self.assertEqual([], verifier.errors())
+
+        # An empty row and a non-numeric split value, as written and as reloaded
+        bad_rows = [[''] * len(rows[0]), ['王五', 'DD', '中国', 'abc', 5.0] + [None] * (len(rows[0]) - 5)]
+        for row in bad_rows:
+            verifier.add(row)
+            result_sheet.append(row)
+        output_wb.save('test_output.xlsx')
+        errors = verifier.errors()
+        self.assertEqual(verify_output(self.config, source_headers, source_table), errors)
+        self.assertTrue(any(e.startswith('Empty row 5') for e in errors))
+        self.assertTrue(any('Total mismatch' in e for e in errors))
+
+    def test_check_output_archive_errors(self):
+        """Row count mismatch, missing sheet and corrupt file are reported."""
+        from main import check_output_archive
+        self._setup_split_data()
+        process_excel(self.config)
+        self.assertEqual(1, len(check_output_archive(self.config, 4)))
+
+        wb = load_workbook('test_output.xlsx')
+        wb.remove(wb['工资'])
+        wb.save('test_output.xlsx')
+        self.assertEqual(1, len(check_output_archive(self.config)))
+
+        with open('test_output.xlsx', 'wb') as f:
+            f.write(b'not a zip file')
+        self.assertEqual(1, len(check_output_archive(self.config)))
+
     # --- Formula parser tests ---
 
     def test_formula_parser_basic(self):
@@ -1219,6 +1306,81 @@ class TestExcelSplitter(unittest.TestCase):
         result = evaluate_formula(ast, {'基本工资': 100.0, '岗位工资': None})
         self.assertEqual(result, 100.0)
 
+    def test_formula_functions_and_comparisons(self):
+        """ROUND, MIN, MAX, ABS and IF (lazy), with comparisons giving 1.0 or 0.0."""
+        from main import tokenize_formula, parse_formula, evaluate_formula, FormulaError
+        known = ['基本工资', '扣款']
+        values = {'基本工资': 2.675, '扣款': 0.0}
+        cases = [('ROUND(基本工资, 2)', 2.67), ('round(基本工资 * 10, -1)', 30.0), ('MIN(基本工资, 扣款, 5)', 0.0),
+                 ('MAX(基本工资, 扣款)', 2.675), ('ABS(扣款 - 基本工资)', 2.675), ('(基本工资 >= 2) + (扣款 <> 0)', 1.0),
+                 ('IF(扣款 = 0, 0, 基本工资 / 扣款)', 0.0), ('If (基本工资 < 1, 1, 2) * 3', 6.0)]
+        for formula, expected in cases:
+            self.assertEqual(evaluate_formula(parse_formula(tokenize_formula(formula, known)), values), expected,
+                             formula)
+        self.assertEqual(tokenize_formula('max (扣款,1)<=2', known), ['MAX(', '扣款', ',', '1', ')', '<=', '2'])
+        for formula in ('ABS(扣款, 1)', 'IF(扣款, 1)', 'ROUND(基本工资, 扣款)', 'MAX(扣款', '扣款 < '):
+            with self.assertRaises(FormulaError):
+                parse_formula(tokenize_formula(formula, known))
+
+    def test_formula_column_names_shaped_like_functions(self):
+        """Known column names starting with a function call stay column names; shorter names do not hide functions."""
+        from main import tokenize_formula
+        known = ['MAX(月)', 'if (补)', 'M', 'ABS', '扣款']
+        self.assertEqual(tokenize_formula('MAX(月) + if (补)', known), ['MAX(月)', '+', 'if (补)'])
+        self.assertEqual(tokenize_formula('MAX(M, 扣款) * ABS', known), ['MAX(', 'M', ',', '扣款', ')', '*', 'ABS'])
+        self.assertEqual(tokenize_formula('ABS(MAX(月))', known), ['ABS(', 'MAX(月)', ')'])
+
+    def test_formula_program_folds_constants_and_shares_subexpressions(self):
+        """Constant subtrees are folded and repeated subtrees, across formulas, computed once."""
+        from main import tokenize_formula, parse_formula, collect_refs, FormulaProgram
+        headers = ['基本工资', '岗位工资', '扣款', '合计', '应发', '实发']
+        col_map = {name: idx + 1 for idx, name in enumerate(headers)}
+        formulas = [('合计', '基本工资 + 岗位工资 + 扣款 * (12 / 4)'),
+                    ('应发', 'ROUND(基本工资 + 岗位工资, 1) + MAX(合计, 0)'),
+                    ('实发', 'IF(合计 > 100 * 2, 基本工资 + 岗位工资, 扣款 / 0) + IF(0, 扣款 / 0, 1)')]
+        computed_asts = [(name, parse_formula(tokenize_formula(formula, set(headers))), col_map[name])
+                         for name, formula in formulas]
+        ref_names = sorted({ref for _name, ast, _idx in computed_asts for ref in collect_refs(ast)})
+        program = FormulaProgram(computed_asts, ref_names, col_map)
+        operands = dict(zip(ref_names, (operand for operand, _pos in program.loads)))
+        base, job, deduct = (('var', operands[name]) for name in ('基本工资', '岗位工资', '扣款'))
+
+        self.assertEqual(program.steps, [
+            ('t0', ('+', base, job), None),
+            ('c0', ('+', ('var', 't0'), ('*', deduct, ('num', 3.0))), 3),
+            ('c1', ('+', ('call', 'ROUND', (('var', 't0'), ('num', 1.0))),
+                    ('call', 'MAX', (('var', 'c0'), ('num', 0.0)))), 4),
+            ('c2', ('+', ('call', 'IF', (('>', ('var', 'c0'), ('num', 200.0)), ('var', 't0'), ('/', deduct, ('num', 0.0)))),
+                    ('num', 1.0)), 5),
+        ])
+
+    def test_compiled_computed_columns_match_evaluator(self):
+        """Compiled computed columns give the evaluator's results, chained formulas included."""
+        from main import (tokenize_formula, parse_formula, collect_refs, evaluate_computed_row,
+                          compile_computed_columns, FormulaError)
+        headers = ['基本工资', '岗位工资', '扣款', '税前应发工资总额(不含差补)', '实发工资']
+        col_map = {name: idx + 1 for idx, name in enumerate(headers)}
+        formulas = [('税前应发工资总额(不含差补)', '基本工资 + 岗位工资 - 扣款'),
+                    ('实发工资', '-(税前应发工资总额(不含差补) - 0.005) / 3 + 扣款 * 1.5')]
+        computed_asts = [(name, parse_formula(tokenize_formula(formula, set(headers))), col_map[name])
+                         for name, formula in formulas]
+        ref_names = set()
+        for _name, ast, _idx in computed_asts:
+            ref_names.update(collect_refs(ast))
+        computed_columns = compile_computed_columns(computed_asts, ref_names, col_map)
+
+        for values in ([100.0, 200.0, 33.3, None, None], [None, None, None, 1.0, 2.0], [-0.01, 0, '7', None, None]):
+            expected, row = list(values), list(values)
+            evaluate_computed_row(expected, computed_asts, ref_names, col_map, len(headers))
+            computed_columns(row)
+            self.assertEqual(repr(row), repr(expected))
+
+        divide = [('实发工资', parse_formula(tokenize_formula('基本工资 / 扣款', set(headers))), 5)]
+        with self.assertRaises(FormulaError):
+            compile_computed_columns(divide, {'基本工资', '扣款'}, col_map)([1.0, None, None, None, None])
+        with self.assertRaises(SystemExit):
+            computed_columns([100.0, 'abc', None, None, None])
+
     # --- Config validation tests for null_check_columns ---
 
     def test_null_check_columns_not_list(self):
@@ -1464,6 +1626,981 @@ class TestExcelSplitter(unittest.TestCase):
         process_excel(self.config)
         self.assertTrue(os.path.exists('test_output.xlsx'))
 
+    def test_null_check_columns_share_one_pass(self):
+        """Null checks and custom rules of a sheet run in one fused row pass."""
+        from main import (ValidationContext, ValidationRule, VALIDATION_RULES,
+                          load_sheet_tables, run_validation_rules)
+        self._setup_mixed_split_data()
+        self.config['input']['sheet']['source']['null_check_columns'] = ['基本工资', '岗位工资']
+        visits = []
+
+        class RecordingRule(ValidationRule):
+            sheet = 'source'
+
+            def row(self, i):
+                visits.append(('rule', i))
+
+            def finish(self):
+                self.errors.append('custom')
+
+        tables = load_sheet_tables(self.config, load_workbook('test_input.xlsx', data_only=True))
+        ctx = ValidationContext(self.config, tables)
+        errors = run_validation_rules(ctx, VALIDATION_RULES + [RecordingRule])
+        self.assertEqual(errors, ['custom'])
+        self.assertEqual(visits, [('rule', 0), ('rule', 1), ('rule', 2)])
+        self.assertEqual(len(ctx.payment_mapping), 4)
+
+    def test_parallel_validation_matches_sequential(self):
+        """Sheet passes in a process pool give the same errors and indices as one process."""
+        from main import ValidationContext, VALIDATION_RULES, load_sheet_tables, run_validation_rules
+        self._setup_mixed_split_data()
+        self.reference_sheet.append(['张三', 'AA', '研发', '1', 'x'])  # duplicate + non-numeric hours
+        self.reference_sheet.append(['赵六', 'FF', '研发', '9', -1])  # negative hours, unknown project
+        self.source_sheet.append(['钱七', None, '中国', None, 1.0, '研发', '8', 21, 'BB', '公司A'])
+        self.wb.save('test_input.xlsx')
+        self.config['input']['sheet']['source']['null_check_columns'] = ['基本工资']
+
+        results = []
+        for workers in (1, 2):
+            tables = load_sheet_tables(self.config, load_workbook('test_input.xlsx', data_only=True))
+            ctx = ValidationContext(self.config, tables)
+            errors = run_validation_rules(ctx, VALIDATION_RULES, workers)
+            results.append((errors, ctx.payment_mapping, ctx.ref_hours_by_employee))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0][0]), 7)
+
+    def test_reference_row_errors_reported_in_row_order(self):
+        """Empty id, duplicate and hours errors of the reference sheet interleave by row, as in one loop."""
+        from main import ValidationContext, VALIDATION_RULES, load_sheet_tables, run_validation_rules
+        self._setup_mixed_split_data()
+        self.reference_sheet.append(['张三', 'AA', '研发', '1', 'x'])  # row 6: duplicate + non-numeric hours
+        self.reference_sheet.append(['赵六', None, '研发', '1', 1])    # row 7: empty employee_id
+        self.reference_sheet.append(['赵六', 'FF', '研发', '1', -1])   # row 8: negative hours
+        self.wb.save('test_input.xlsx')
+
+        tables = load_sheet_tables(self.config, load_workbook('test_input.xlsx', data_only=True))
+        errors = run_validation_rules(ValidationContext(self.config, tables), VALIDATION_RULES)
+        self.assertEqual([error.split(' ')[0] for error in errors],
+                         ['Duplicate', 'Non-numeric', 'Empty', 'Negative'])
+
+    def _run_validation_output(self):
+        """Helper: process_excel's printed output when validation fails."""
+        from contextlib import redirect_stdout
+        buf = StringIO()
+        with redirect_stdout(buf), self.assertRaises(SystemExit):
+            process_excel(self.config)
+        return buf.getvalue()
+
+    def test_error_budget_keeps_counts_per_check(self):
+        """error_budget caps the messages; every error is still counted per check."""
+        self._setup_mixed_split_data()
+        for i in range(5):
+            self.reference_sheet.append(['张三', 'AA', '研发', '1', f'x{i}'])
+        self.wb.save('test_input.xlsx')
+        self.config['error_budget'] = 2
+
+        output = self._run_validation_output()
+        self.assertEqual(output.count("Non-numeric project_hours"), 1)
+        self.assertIn('Showing 2 of 6 errors', output)
+        self.assertIn('  - Duplicate reference rows: 1', output)
+        self.assertIn('  - Invalid project_hours: 5', output)
+
+    def test_fail_fast_stops_at_first_error(self):
+        """fail_fast without a budget stops validation at the first error."""
+        self._setup_mixed_split_data()
+        for i in range(5):
+            self.reference_sheet.append(['张三', 'AA', '研发', '1', f'x{i}'])
+        self.wb.save('test_input.xlsx')
+        self.config['fail_fast'] = True
+
+        output = self._run_validation_output()
+        self.assertIn("Duplicate (employee_id='AA'", output)
+        self.assertNotIn('Non-numeric project_hours', output)
+        self.assertIn('Validation stopped after 1 errors (fail_fast)', output)
+
+    def test_fail_fast_parallel_matches_sequential(self):
+        """With fail_fast, parallel sheet passes stop where a single process stops."""
+        self._setup_mixed_split_data()
+        self.payment_sheet.append(['1', '公司A', '研发', 'Account_dup'])  # payment pass: 1 error
+        self.reference_sheet.append(['赵六', 'FF', '研发', '2', 'x'])     # reference pass: 1 error
+        self.source_sheet.append(['钱七', None, '中国', 1.0, 1.0, '研发', '研发部', 21, 'BB', '公司A'])
+        self.wb.save('test_input.xlsx')
+
+        for budget in (None, 2):
+            self.config.update(fail_fast=True, error_budget=budget)
+            outputs = []
+            for workers in (1, 3):
+                self.config['validation_workers'] = workers
+                output = self._run_validation_output()
+                outputs.append(output[output.index('Validation errors found'):])
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertNotIn("source sheet", outputs[1])
+            self.assertIn(f'Validation stopped after {budget or 1} errors (fail_fast)', outputs[1])
+
+    # --- Single-load mode tests ---
+
+    def _setup_mixed_split_data(self):
+        """Helper: one split row, one zero-hour row and one unmatched row."""
+        source_headers = ['姓名', '工号', '部门', '基本工资', '岗位工资', '费用类别', '费用所属中心', '实际出勤', '分管领导', '工资所属单位']
+        self.source_sheet.append(source_headers)
+        self.source_sheet.append(['张三', 'AA', '中国', 1000.00, 3000.00, '研发', '研发部', 21, 'BB', '公司A'])
+        self.source_sheet.append(['王五', 'EE', '中国', 800.00, 1200.00, '研发', '研发部', 21, 'BB', '公司A'])
+        self.source_sheet.append(['李四', 'CC', '中国', 2000.00, 5000.00, '研发', '研发部', 21, 'DD', '公司A'])
+
+        reference_headers = ['姓名', '工号', '费用类别', '费用所属中心', '实际出勤']
+        self.reference_sheet.append(reference_headers)
+        self.reference_sheet.append(['张三', 'AA', '研发', '1', 1])
+        self.reference_sheet.append(['张三', 'AA', '研发', '2', 4])
+        self.reference_sheet.append(['张三', 'AA', '销售', '3', 4])
+        self.reference_sheet.append(['王五', 'EE', '研发', '2', 0])
+
+        payment_headers = ['费用所属中心', '公司', '费用类别', '支付账号']
+        self.payment_sheet.append(payment_headers)
+        self.payment_sheet.append(['1', '公司A', '研发', 'Account1'])
+        self.payment_sheet.append(['2', '公司A', '研发', 'Account2'])
+        self.payment_sheet.append(['3', '公司A', '销售', 'Account3'])
+        self.payment_sheet.append(['研发部', '公司A', '研发', 'Account_RD'])
+        self.wb.save('test_input.xlsx')
+
+    def _read_result_values(self, sheet_name='工资拆分'):
+        """Helper: all row values of a sheet in the output file."""
+        wb = load_workbook('test_output.xlsx')
+        rows = [list(row) for row in wb[sheet_name].iter_rows(values_only=True)]
+        wb.close()
+        return rows
+
+    def test_single_load_matches_default(self):
+        """single_load produces the same result sheet as the default two-load path."""
+        self._setup_mixed_split_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        self.config['single_load'] = True
+        process_excel(self.config)
+        self.assertEqual(expected, self._read_result_values())
+
+    def test_single_load_keeps_source_sheet(self):
+        """single_load must not modify the source sheet carried into the output."""
+        self._setup_mixed_split_data()
+        self.config['single_load'] = True
+        process_excel(self.config)
+
+        source_rows = self._read_result_values('工资')
+        self.assertEqual(source_rows[1][6], '研发部')  # split row keeps its project_id
+        self.assertEqual(source_rows[2][6], '研发部')  # zero-hour row keeps its project_id
+        self.assertEqual(len(source_rows[1]), 10)      # no payment column appended
+
+    def test_single_load_keeps_formulas_of_other_sheets(self):
+        """single_load writes untouched sheets with their formulas, even without cached values."""
+        self._setup_mixed_split_data()
+        extra = self.wb.create_sheet('附件')
+        extra.append(['A', 'B', '合计'])
+        extra.append([1, 2, '=A2+B2'])
+        self.wb.save('test_input.xlsx')  # openpyxl stores no cached value for the formula
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        self.config['single_load'] = True
+        process_excel(self.config)
+        self.assertEqual(expected, self._read_result_values())
+        self.assertEqual('=A2+B2', self._read_result_values('附件')[1][2])
+
+    # --- Streaming validation engine tests ---
+
+    def test_streaming_validation_matches_default(self):
+        """validation_engine=streaming produces the same result sheet, loading only the styled workbook."""
+        import main
+        self._setup_mixed_split_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        loads = []
+        original = main.load_input_workbook
+        main.load_input_workbook = lambda path, selective=None, data_only=False: \
+            loads.append(data_only) or original(path, selective, data_only)
+        self.config['validation_engine'] = 'streaming'
+        try:
+            process_excel(self.config)
+        finally:
+            main.load_input_workbook = original
+        self.assertEqual(loads, [False])
+        self.assertEqual(expected, self._read_result_values())
+
+    def test_streaming_validation_same_errors(self):
+        """validation_engine=streaming reports the same error messages."""
+        from contextlib import redirect_stdout
+        self._setup_null_check_data()
+        self.source_sheet.append(['张三', 'AA', '中国', None, 3000.00, '研发', '研发部', 21, 'BB', '公司A'])
+        self.reference_sheet.append(['张三', 'AA', '研发', '99', -1])
+        self.payment_sheet.append(['1', '公司A', '研发', 'Account_X'])
+        self.payment_sheet.append(['1', '公司A', '研发', 'Account_Y'])
+        self.wb.save('test_input.xlsx')
+        self.config['input']['sheet']['source']['null_check_columns'] = ['基本工资']
+
+        outputs = []
+        for engine in ('workbook', 'streaming', 'xml'):
+            self.config['validation_engine'] = engine
+            buf = StringIO()
+            with redirect_stdout(buf):
+                with self.assertRaises(SystemExit):
+                    process_excel(self.config)
+            outputs.append(buf.getvalue()[buf.getvalue().index('Validation errors found'):])
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+        self.assertIn('Negative project_hours', outputs[1])
+        self.assertIn('空值检测', outputs[1])
+
+    # --- XML reader engine tests ---
+
+    def test_xml_validation_matches_default(self):
+        """validation_engine=xml produces the same result sheet as the default path."""
+        self._setup_mixed_split_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        self.config['validation_engine'] = 'xml'
+        process_excel(self.config)
+        self.assertEqual(expected, self._read_result_values())
+
+    def test_xml_validation_loads_only_styled_workbook(self):
+        """validation_engine=xml parses the workbook once, never as a data_only workbook."""
+        import main
+        self._setup_mixed_split_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        loads = []
+        original = main.load_input_workbook
+        main.load_input_workbook = lambda path, selective=None, data_only=False: \
+            loads.append(data_only) or original(path, selective, data_only)
+        self.config['validation_engine'] = 'xml'
+        try:
+            process_excel(self.config)
+        finally:
+            main.load_input_workbook = original
+        self.assertEqual(loads, [False])
+        self.assertEqual(expected, self._read_result_values())
+
+    def test_xml_reader_matches_openpyxl(self):
+        """XlsxValueReader decodes the same values as a data_only openpyxl workbook."""
+        import datetime
+        from main import XlsxValueReader, SheetTable
+        self.source_sheet.append(['文本', '整数', '小数', '日期', '时间', '布尔', '公式'])
+        self.source_sheet.append(['  a ', 1, 2.5, datetime.datetime(2024, 1, 31), datetime.time(8, 30), True, '=B2*2'])
+        self.source_sheet.append([None, -3, 1e-7, datetime.date(2023, 12, 1), None, False, None])
+        self.source_sheet['I5'] = 'x'
+        self.source_sheet['C4'].number_format = '[h]:mm'
+        self.source_sheet['C4'] = 1.5
+        self.source_sheet.merge_cells('A6:B7')
+        self.source_sheet['A6'] = '合并'
+        self.wb.save('test_input.xlsx')
+
+        wb = load_workbook('test_input.xlsx', data_only=True)
+        reader = XlsxValueReader('test_input.xlsx')
+        try:
+            self.assertEqual(wb.sheetnames, reader.sheetnames)
+            for name in wb.sheetnames:
+                expected = SheetTable.from_worksheet(wb[name])
+                actual = reader.read_table(name)
+                self.assertEqual(expected.headers, actual.headers)
+                self.assertEqual(expected.columns, actual.columns)
+        finally:
+            reader.close()
+
+    # --- Column projection tests ---
+
+    def test_column_projection_prunes_unused_columns(self):
+        """Only configured columns are decoded; both engines agree on the kept ones."""
+        from main import load_sheet_tables, XlsxValueReader
+        self._setup_mixed_split_data()
+        wb = load_workbook('test_input.xlsx', data_only=True)
+        reader = XlsxValueReader('test_input.xlsx')
+        try:
+            for tables in (load_sheet_tables(self.config, wb), load_sheet_tables(self.config, reader)):
+                reference = tables['reference']
+                self.assertIsNone(reference.columns[0])  # 姓名 is not configured
+                self.assertEqual(reference.values(2), ['AA', 'AA', 'AA', 'EE'])
+                with self.assertRaises(KeyError):
+                    reference.values(1)
+                self.assertEqual(tables['payment'].values(4),
+                                 ['Account1', 'Account2', 'Account3', 'Account_RD'])
+                self.assertEqual(tables['source'].row(0)[0], None)
+                self.assertEqual(tables['source'].row(0)[1], 'AA')
+        finally:
+            reader.close()
+
+    def test_column_projection_keeps_blank_row_detection(self):
+        """A row whose only value sits in a pruned column is not treated as blank."""
+        from main import load_sheet_tables, check_null_columns, XlsxValueReader
+        self._setup_mixed_split_data()
+        self.reference_sheet.append(['赵六', None, None, None, None])
+        self.reference_sheet.append([None, None, None, None, None])
+        self.wb.save('test_input.xlsx')
+        self.config['input']['sheet']['reference']['null_check_columns'] = ['实际出勤']
+
+        wb = load_workbook('test_input.xlsx', data_only=True)
+        reader = XlsxValueReader('test_input.xlsx')
+        try:
+            for tables in (load_sheet_tables(self.config, wb), load_sheet_tables(self.config, reader)):
+                errors = []
+                check_null_columns(tables, self.config, errors)
+                self.assertEqual(errors, ["空值检测：表 '工时' 第 6 行，列 '实际出勤' 为空值"])
+        finally:
+            reader.close()
+
+    def test_used_range_skips_formatted_trailing_rows(self):
+        """Formatting-only rows below the data are ignored by every phase."""
+        from openpyxl.styles import Font
+        from main import load_sheet_tables, XlsxValueReader
+        self._setup_mixed_split_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        for ws in (self.source_sheet, self.reference_sheet, self.payment_sheet):
+            for row in range(ws.max_row + 1, ws.max_row + 51):
+                ws.cell(row=row, column=1).font = Font(bold=True)
+        self.wb.save('test_input.xlsx')
+
+        reader = XlsxValueReader('test_input.xlsx')
+        try:
+            for wb in (load_workbook('test_input.xlsx'), load_workbook('test_input.xlsx', read_only=True), reader):
+                tables = load_sheet_tables(self.config, wb)
+                self.assertEqual([tables[key].nrows for key in ('source', 'reference', 'payment')], [3, 4, 4])
+        finally:
+            reader.close()
+
+        for engine in ('workbook', 'streaming', 'xml'):
+            self.config['validation_engine'] = engine
+            process_excel(self.config)
+            self.assertEqual(expected, self._read_result_values())
+
+    # --- Selective loading tests ---
+
+    def _add_attachment_sheet(self):
+        """Helper: an unconfigured sheet with styles, a merged range and a chart."""
+        from openpyxl.chart import BarChart, Reference
+        from openpyxl.styles import Font
+        ws = self.wb.create_sheet('附件', 0)
+        for i in range(1, 6):
+            ws.append([f'项目{i}', i * 10])
+        ws['A1'].font = Font(bold=True)
+        ws.merge_cells('C1:D2')
+        chart = BarChart()
+        chart.add_data(Reference(ws, min_col=2, min_row=1, max_row=5))
+        ws.add_chart(chart, 'F2')
+        self.wb.save('test_input.xlsx')
+
+    def test_selective_load_matches_default(self):
+        """selective_load writes the same result and carries unconfigured sheets unchanged."""
+        self._setup_mixed_split_data()
+        self._add_attachment_sheet()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        self.config['selective_load'] = True
+        process_excel(self.config)
+        self.assertEqual(expected, self._read_result_values())
+
+        wb = load_workbook('test_output.xlsx')
+        self.assertEqual(wb.sheetnames, ['附件', '工资', '工时', '支付规则', '工资拆分'])
+        attachment = wb['附件']
+        self.assertEqual(attachment['A3'].value, '项目3')
+        self.assertEqual(attachment['B5'].value, 50)
+        self.assertTrue(attachment['A1'].font.b)
+        self.assertEqual([str(r) for r in attachment.merged_cells.ranges], ['C1:D2'])
+        self.assertEqual(len(attachment._charts), 1)
+
+    def test_selective_load_parses_only_configured_sheets(self):
+        """Unconfigured sheets are loaded as empty placeholders."""
+        from main import SelectiveWorkbook
+        self._setup_mixed_split_data()
+        self._add_attachment_sheet()
+        selective = SelectiveWorkbook('test_input.xlsx', ['工资', '工时', '支付规则'])
+        self.assertEqual(list(selective.raw_sheets), ['附件'])
+
+        wb = selective.load()
+        self.assertEqual(wb.sheetnames, ['附件', '工资', '工时', '支付规则'])
+        self.assertIsNone(wb['附件']['A1'].value)
+        self.assertEqual(wb['工资']['B2'].value, 'AA')
+
+    def test_passthrough_save_matches_default(self):
+        """passthrough_save writes the same result and copies the other parts byte for byte."""
+        import zipfile
+        self._setup_mixed_split_data()
+        self._add_attachment_sheet()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        for extra in ({}, {'write_only': True}):
+            self.config.update(extra, passthrough_save=True)
+            process_excel(self.config)
+            self.assertEqual(expected, self._read_result_values())
+
+            wb = load_workbook('test_output.xlsx')
+            self.assertEqual(wb.sheetnames, ['附件', '工资', '工时', '支付规则', '工资拆分'])
+            self.assertTrue(wb['附件']['A1'].font.b)
+            self.assertEqual(len(wb['附件']._charts), 1)
+            with zipfile.ZipFile('test_input.xlsx') as src, zipfile.ZipFile('test_output.xlsx') as dst:
+                for name in ('xl/worksheets/sheet1.xml', 'xl/charts/chart1.xml', 'xl/styles.xml'):
+                    self.assertEqual(src.read(name), dst.read(name))
+
+    def test_passthrough_save_replaces_existing_result_sheet(self):
+        """An existing result sheet is overwritten in place rather than duplicated."""
+        self._setup_mixed_split_data()
+        self.wb.create_sheet('工资拆分')['A1'] = '旧结果'
+        self.wb.save('test_input.xlsx')
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        self.config['passthrough_save'] = True
+        process_excel(self.config)
+        self.assertEqual(expected, self._read_result_values())
+        self.assertEqual(load_workbook('test_output.xlsx').sheetnames, ['工资', '工时', '支付规则', '工资拆分'])
+
+    # --- Write-only output tests ---
+
+    def test_write_only_matches_default(self):
+        """write_only produces the same result values and styles as the default path."""
+        from openpyxl.styles import Font
+        self._setup_mixed_split_data()
+        wb = load_workbook('test_input.xlsx')
+        wb['工资']['D2'].number_format = '#,##0.00'
+        wb['工资']['A2'].font = Font(bold=True)
+        wb['工资'].column_dimensions['A'].width = 30
+        wb.save('test_input.xlsx')
+
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        self.config['write_only'] = True
+        process_excel(self.config)
+        self.assertEqual(expected, self._read_result_values())
+
+        output_wb = load_workbook('test_output.xlsx')
+        result_sheet = output_wb['工资拆分']
+        for row in (2, 3, 4):  # all three split rows keep the source styles
+            self.assertEqual(result_sheet.cell(row=row, column=4).number_format, '#,##0.00')
+            self.assertTrue(result_sheet.cell(row=row, column=1).font.b)
+        self.assertEqual(result_sheet.column_dimensions['A'].width, 30)
+
+    def test_split_rows_take_source_row_styles(self):
+        """Split rows are styled from their own source row, appended columns like its first cell."""
+        from openpyxl.styles import Font
+        self._setup_mixed_split_data()
+        wb = load_workbook('test_input.xlsx')
+        wb['工资']['D2'].number_format = '#,##0.00'
+        wb['工资']['A2'].font = Font(bold=True)
+        wb['工资']['D3'].number_format = '0.0%'
+        wb.save('test_input.xlsx')
+
+        for write_only in (False, True):
+            self.config['write_only'] = write_only
+            process_excel(self.config)
+            result_sheet = load_workbook('test_output.xlsx')['工资拆分']
+            for row in (2, 3, 4):  # split rows of source row 2
+                self.assertEqual(result_sheet.cell(row=row, column=4).number_format, '#,##0.00')
+                self.assertTrue(result_sheet.cell(row=row, column=11).font.b)  # appended 支付账号
+            self.assertEqual(result_sheet.cell(row=5, column=4).number_format, '0.0%')
+            self.assertFalse(result_sheet.cell(row=5, column=11).font.b)
+
+    def _setup_split_engine_data(self):
+        """Helper: mixed split data plus rows with negative, empty and odd-cent amounts."""
+        self._setup_mixed_split_data()
+        wb = load_workbook('test_input.xlsx')
+        wb['工资'].append(['张三', 'AA', '中国', -1000.01, None, '研发', '研发部', 21, 'BB', '公司A'])
+        wb['工资'].append(['张三', 'AA', '中国', 0.05, 12345678.99, '研发', '研发部', 21, 'BB', '公司A'])
+        wb.save('test_input.xlsx')
+
+    @unittest.skipUnless(__import__('main').numpy is not None, 'numpy not installed')
+    def test_numpy_split_engine_matches_python(self):
+        """split_engine: numpy allocates exactly the same cents as the Python loop."""
+        self._setup_split_engine_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        for write_only in (False, True):
+            self.config.update(split_engine='numpy', write_only=write_only)
+            process_excel(self.config)
+            self.assertEqual(expected, self._read_result_values())
+
+    @unittest.skipUnless(__import__('main').numpy is not None, 'numpy not installed')
+    def test_numpy_computed_engine_matches_python(self):
+        """Whole-column computed columns and grouped verification match the row by row results."""
+        from main import (tokenize_formula, parse_formula, collect_refs, compile_computed_columns,
+                          evaluate_computed_rows_numpy, verify_computed_group, verify_computed_groups_numpy,
+                          FormulaError)
+        headers = ['工号', '基本工资', '岗位工资', '扣款', '合计', '实发工资']
+        col_map = {name: idx + 1 for idx, name in enumerate(headers)}
+        formulas = [('合计', '基本工资 + 岗位工资 * 1.005'), ('实发工资', '-(合计 - 扣款) / 3')]
+        computed_asts = [(name, parse_formula(tokenize_formula(formula, set(headers))), col_map[name])
+                         for name, formula in formulas]
+        ref_names = set()
+        for _name, ast, _idx in computed_asts:
+            ref_names.update(collect_refs(ast))
+        computed_columns = compile_computed_columns(computed_asts, ref_names, col_map)
+
+        rows = [['A', 100.0, 200.0, 33.3, None, None], ['A', None, 0.05, None, None, None],
+                ['B', 2.675, -1.0, '7', None, None], ['C', 0.0, -0.0, None, None, None]]
+        expected = [list(row) for row in rows]
+        for row in expected:
+            computed_columns(row)
+        self.assertTrue(evaluate_computed_rows_numpy(rows, computed_asts, ref_names, col_map))
+        self.assertEqual(repr(rows), repr(expected))
+
+        # source rows of A and B, the sums of B are off
+        groups = [(['A', 100.0, 200.05, 33.3, 301.05, -89.25], rows[:2]),
+                  (['B', 1.0, -1.0, 7, 99.0, 5.0], rows[2:3]),
+                  (['C', 0.0, 0.0, None, None, 'x'], rows[3:])]
+        errors = verify_computed_groups_numpy(groups, computed_asts, 1)
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(errors,
+                         [error for src_row, result_rows in groups
+                          for error in verify_computed_group(src_row, result_rows, computed_asts, src_row[0])])
+
+        guarded = [('实发工资', parse_formula(tokenize_formula('IF(扣款 = 0, -基本工资, MIN(基本工资 / 扣款, 1))',
+                                                              set(headers))), 6)]
+        rows = [['A', 1.0, 0, 2.0, None, None], ['B', -0.0, 0, 0.0, None, None], ['C', 3.0, 0, None, None, None]]
+        expected = [list(row) for row in rows]
+        for row in expected:
+            compile_computed_columns(guarded, {'基本工资', '扣款'}, col_map)(row)
+        self.assertTrue(evaluate_computed_rows_numpy(rows, guarded, {'基本工资', '扣款'}, col_map))
+        self.assertEqual(repr(rows), repr(expected))
+
+        self.assertFalse(evaluate_computed_rows_numpy([['D', 'abc', 1.0, 0, None, None]],
+                                                      computed_asts, ref_names, col_map))
+        divide = [('实发工资', parse_formula(tokenize_formula('基本工资 / 扣款', set(headers))), 6)]
+        with self.assertRaises(FormulaError) as raised:
+            evaluate_computed_rows_numpy([['A', 1.0, 0, 2.0, None, None], ['B', 1.0, 0, 0.0, None, None]],
+                                         divide, {'基本工资', '扣款'}, col_map)
+        self.assertEqual(raised.exception.args[1], [1])
+
+    def test_numpy_split_engine_falls_back_without_numpy(self):
+        """Without numpy, split_engine: numpy falls back to the Python loop."""
+        import main
+        from contextlib import redirect_stdout
+        self._setup_split_engine_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        self.config['split_engine'] = 'numpy'
+        original = main.numpy
+        main.numpy = None
+        buf = StringIO()
+        try:
+            with redirect_stdout(buf):
+                process_excel(self.config)
+        finally:
+            main.numpy = original
+        self.assertIn('split_engine 回退为 python', buf.getvalue())
+        self.assertEqual(expected, self._read_result_values())
+
+    def test_cents_arithmetic_remainder_policies(self):
+        """split_arithmetic: cents puts the leftover cents on the last row or on the largest remainders."""
+        self._setup_mixed_split_data()  # 1000.00 / 3000.00 split by hours 1:4:4
+        self.config['split_arithmetic'] = 'cents'
+        process_excel(self.config)
+        rows = self._read_result_values()[1:4]
+        self.assertEqual([(row[3], row[4]) for row in rows],
+                         [(111.11, 333.33), (444.44, 1333.33), (444.45, 1333.34)])
+
+        self.config['remainder_policy'] = 'largest'
+        process_excel(self.config)
+        rows = self._read_result_values()[1:4]
+        self.assertEqual([(row[3], row[4]) for row in rows],
+                         [(111.11, 333.34), (444.45, 1333.33), (444.44, 1333.33)])
+
+    def test_cents_arithmetic_uses_decimal_values(self):
+        """Hours and amounts are taken as the decimals they are shown as, not their binary floats."""
+        from main import allocate_split_cents, integer_weights, to_cents
+        weights = integer_weights([0.1, 1, 3])
+        self.assertEqual(weights, [1, 10, 30])
+        self.assertEqual(to_cents(-489.95), -48995)
+        self.assertEqual(to_cents(2.675), 268)
+        self.assertEqual(allocate_split_cents([to_cents(-489.95)], weights), [[-1195], [-11950], [-35850]])
+
+    def test_split_workers_match_single_process(self):
+        """Sharded splitting in worker processes writes the same rows in the same order."""
+        self._setup_split_engine_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        for write_only in (False, True):
+            self.config.update(split_workers=2, write_only=write_only)
+            process_excel(self.config)
+            self.assertEqual(expected, self._read_result_values())
+
+    def test_split_workers_report_worker_errors_in_parent(self):
+        """A fatal error while splitting in a worker is printed and raised by the parent process."""
+        from contextlib import redirect_stdout
+        self._setup_mixed_split_data()
+        wb = load_workbook('test_input.xlsx')
+        wb['工资'].append(['张三', 'AA', '中国', 'abc', 1.0, '研发', '研发部', 21, 'BB', '公司A'])
+        wb.save('test_input.xlsx')
+        self.config['split_workers'] = 2
+
+        buf = StringIO()
+        with redirect_stdout(buf), self.assertRaises(SystemExit):
+            process_excel(self.config)
+        self.assertIn("Error: 无法拆分'基本工资:abc'", buf.getvalue())
+
+    def test_shard_source_rows_balances_fan_out(self):
+        """A high fan-out employee is spread over several shards; every row lands in exactly one."""
+        from main import SplitPlan, shard_source_rows
+
+        class Planner:
+            def plan(self, employee_id):
+                return SplitPlan('split', ratios=[0.1] * 10) if employee_id == 'big' else SplitPlan('copy')
+
+        employee_ids = ['big'] * 6 + [f'E{i}' for i in range(20)]
+        shards = shard_source_rows(employee_ids, Planner(), 3)
+        self.assertEqual(sorted(row for shard in shards for row in shard), list(range(26)))
+        for shard in shards:
+            self.assertEqual(shard, sorted(shard))
+        loads = [sum(10 if employee_ids[row] == 'big' else 1 for row in shard) for shard in shards]
+        self.assertEqual(sorted(loads), [26, 27, 27])
+
+    def test_split_patches_rebuild_result_rows(self):
+        """SplitPatches keep only the patched values and rebuild the same rows from the source values."""
+        import pickle
+        from main import SplitPatches
+
+        # columns: id, project, amount, empty amount, note, payment account (appended)
+        source_rows = [['E1', 'P0', 100.0, None, 'x'], ['E2', 'P0', 50.0, None, 'y'], ['E3', 'P0', 9.0, None, 'z']]
+        result_rows = [
+            ('split', [['E1', 'P1', 33.33, None, 'x', 'A1'], ['E1', 'P2', 66.67, None, 'x', 'A2']]),
+            ('copy', [['E2', 'P0', 50.0, None, 'y', 'A0']]),
+            ('zero', [['E3', 'P3', 9.0, None, 'z', 'A3']]),
+        ]
+        patches = SplitPatches({5}, {1, 5}, [2, 3])
+        for kind, rows in result_rows:
+            patches.append(kind, rows)
+        patches = pickle.loads(pickle.dumps(patches))
+
+        self.assertEqual(len(patches), 3)
+        self.assertEqual(len(patches.amounts), 4)  # two amount columns of the two split rows only
+        for i, (source_values, (_kind, rows)) in enumerate(zip(source_rows, result_rows)):
+            self.assertEqual(patches.result_rows(i, source_values, 6), rows)
+
+    @unittest.skipUnless(__import__('main').numpy is not None, 'numpy not installed')
+    def test_numpy_split_allocations_match_allocate_split(self):
+        """SplitAllocations hand out each row's allocation in the allocate_split() layout."""
+        from main import SplitPlan, SplitAllocations, allocate_split, allocate_splits_numpy
+
+        class Source:
+            def floats(self, col):
+                return [[100.0, 0.05, None, -7.77][row] * col if row != 2 else None for row in range(4)]
+
+        class Planner:
+            def plan(self, employee_id):
+                return SplitPlan('split', ratios=employee_id) if employee_id else SplitPlan('copy')
+
+        employee_ids = [[1 / 3, 2 / 3], [0.25, 0.25, 0.5], [0.5, 0.5], None]
+        allocations = allocate_splits_numpy(Source(), Planner(), employee_ids, [0, 1])
+        self.assertIsInstance(allocations, SplitAllocations)
+        self.assertEqual(len(allocations), 3)
+        for row_idx in range(3):
+            amounts = [value if value is not None else 0.0 for value in (Source().floats(1)[row_idx],
+                                                                          Source().floats(2)[row_idx])]
+            self.assertEqual(allocations.pop(row_idx), allocate_split(amounts, employee_ids[row_idx]))
+        self.assertIsNone(allocations.pop(3))
+        self.assertEqual(len(allocations), 0)
+
+    def test_pipeline_writes_each_group_before_splitting_the_next(self):
+        """Result rows stream out per source row instead of being collected for the whole sheet."""
+        import main
+        self._setup_split_engine_data()
+        self.config['write_only'] = True
+        calls = []
+        original_split, original_write = main.split_row, main.to_write_only_values
+        main.split_row = lambda *args: calls.append('split') or original_split(*args)
+        main.to_write_only_values = lambda *args: calls.append('write') or original_write(*args)
+        try:
+            process_excel(self.config)
+        finally:
+            main.split_row, main.to_write_only_values = original_split, original_write
+        # 5 source rows: 3 + 1 + 1 + 3 + 3 result rows, each group written before the next split
+        self.assertEqual(calls[calls.index('split'):], ['split'] + ['write'] * 3 + ['split', 'write'] * 2
+                         + (['split'] + ['write'] * 3) * 2)
+
+    def test_split_windows_match_single_window(self):
+        """Precomputed allocations and worker patches give the same rows window by window."""
+        import main
+        self._setup_split_engine_data()
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        original = main.SPLIT_WINDOW_ROWS
+        main.SPLIT_WINDOW_ROWS = 2
+        try:
+            for options in ({'split_workers': 2}, {'split_engine': 'numpy'}):
+                self.config.update(options)
+                process_excel(self.config)
+                self.assertEqual(expected, self._read_result_values())
+        finally:
+            main.SPLIT_WINDOW_ROWS = original
+
+    def test_write_only_carries_other_sheets(self):
+        """write_only keeps every input sheet unchanged, styles included, whatever keep_style says."""
+        from openpyxl.comments import Comment
+        from openpyxl.styles import Font, PatternFill
+        self._setup_mixed_split_data()
+        wb = load_workbook('test_input.xlsx')
+        extra = wb.create_sheet('附件')
+        extra['A1'] = '备注'
+        extra['B3'] = 42
+        extra['B3'].comment = Comment('说明', 'HR')
+        extra.merge_cells('A1:B2')
+        wb['工资']['D2'].number_format = '#,##0.00'
+        wb['工资']['D2'].font = Font(bold=True)
+        wb['工资']['D2'].fill = PatternFill('solid', fgColor='FFFF00')
+        wb.save('test_input.xlsx')
+
+        self.config.update(write_only=True, keep_style=False)
+        process_excel(self.config)
+
+        output_wb = load_workbook('test_output.xlsx')
+        self.assertEqual(output_wb.sheetnames, ['工资', '工时', '支付规则', '附件', '工资拆分'])
+        self.assertEqual(output_wb['附件']['A1'].value, '备注')
+        self.assertEqual(output_wb['附件']['B3'].value, 42)
+        self.assertIn('A1:B2', [str(r) for r in output_wb['附件'].merged_cells.ranges])
+        self.assertEqual(output_wb['工资']['G2'].value, '研发部')
+        self.assertEqual(output_wb['附件']['B3'].comment.text, '说明')
+        source_cell = output_wb['工资']['D2']
+        self.assertEqual(source_cell.number_format, '#,##0.00')
+        self.assertTrue(source_cell.font.b)
+        self.assertEqual(source_cell.fill.fgColor.rgb, '00FFFF00')
+
+    def test_write_only_computed_mismatch_fatal(self):
+        """Per-source-row computed mismatch is still fatal in write_only mode."""
+        source_headers = ['姓名', '工号', '部门', '基本工资', '岗位工资', '福利前工资合计',
+                          '费用类别', '费用所属中心', '实际出勤', '分管领导', '工资所属单位']
+        self.source_sheet.append(source_headers)
+        self.source_sheet.append(['张三', 'AA', '中国', 1000.00, 3000.00, 5000.00,
+                                   '研发', '研发部', 21, 'BB', '公司A'])
+        self.reference_sheet.append(['姓名', '工号', '费用类别', '费用所属中心', '实际出勤'])
+        self.reference_sheet.append(['张三', 'AA', '研发', '1', 1])
+        self.reference_sheet.append(['张三', 'AA', '研发', '2', 4])
+        self.payment_sheet.append(['费用所属中心', '公司', '费用类别', '支付账号'])
+        self.payment_sheet.append(['1', '公司A', '研发', 'Account_1'])
+        self.payment_sheet.append(['2', '公司A', '研发', 'Account_2'])
+        self.wb.save('test_input.xlsx')
+
+        config = self._make_computed_config()
+        config['write_only'] = True
+        with self.assertRaises(SystemExit):
+            process_excel(config)
+
+    # --- Columnar sheet table tests ---
+
+    def test_sheet_table_decoding(self):
+        """SheetTable decodes columns once into values, null masks, keys and floats."""
+        from main import SheetTable
+        rows = [
+            ('AA', ' 1 ', 5),
+            ('  ', None, 'N/A'),
+            (None, None, None),
+            ('BB', 2, 0),
+        ]
+        table = SheetTable('工时', ['工号', '费用所属中心', '实际出勤'], iter(rows))
+        self.assertEqual(table.nrows, 4)
+        self.assertEqual(table.values(1), ['AA', '  ', None, 'BB'])
+        self.assertEqual(list(table.nulls(1)), [0, 1, 1, 0])
+        self.assertEqual(table.keys(2), ['1', '', '', '2'])
+        self.assertEqual(table.floats(3), [5.0, None, None, 0.0])
+        self.assertEqual(list(table.blank_rows()), [0, 0, 1, 0])
+        self.assertEqual(table.row(3), ('BB', 2, 0))
+        self.assertIs(table.keys(2), table.keys(2))  # decoded once, then cached
+
+    def test_sheet_table_header_only(self):
+        """A header-only sheet decodes to empty columns."""
+        from main import SheetTable
+        table = SheetTable('工时', ['工号', '实际出勤'], iter([]))
+        self.assertEqual(table.nrows, 0)
+        self.assertEqual(table.values(2), [])
+        self.assertEqual(list(table.blank_rows()), [])
+
+    # --- Sheet cache tests ---
+
+    def _make_cache_dir(self):
+        """Helper: temporary cache directory removed after the test."""
+        import shutil
+        import tempfile
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        return cache_dir
+
+    def test_sheet_cache_hit_matches_default(self):
+        """A rerun served from the sheet cache writes the same result sheet."""
+        import main
+        self._setup_mixed_split_data()
+        self.source_sheet['I3'] = '=A3'  # formula cell: the cached value, not the formula, is copied
+        self.wb.save('test_input.xlsx')
+        process_excel(self.config)
+        expected = self._read_result_values()
+
+        self.config['cache_dir'] = self._make_cache_dir()
+        process_excel(self.config)  # miss: populates the cache
+        entries = [name for name in os.listdir(self.config['cache_dir']) if not name.startswith('validation-')]
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(expected, self._read_result_values())
+
+        original = main.load_sheet_tables
+        main.load_sheet_tables = lambda config, wb: self.fail('sheets parsed on a cache hit')
+        try:
+            process_excel(self.config)
+        finally:
+            main.load_sheet_tables = original
+        self.assertEqual(expected, self._read_result_values())
+
+    def test_sheet_cache_keyed_by_content(self):
+        """Changing the input file or a sheet name misses the cache."""
+        from main import load_cached_tables, save_cached_tables, load_sheet_tables
+        self._setup_mixed_split_data()
+        self.config['cache_dir'] = self._make_cache_dir()
+        wb = load_workbook('test_input.xlsx', data_only=True)
+        save_cached_tables(self.config, 'test_input.xlsx', load_sheet_tables(self.config, wb, prune=False))
+
+        cached = load_cached_tables(self.config, 'test_input.xlsx')
+        self.assertEqual(cached['source'].values(2), ['AA', 'EE', 'CC'])
+
+        renamed = yaml.safe_load(yaml.safe_dump(self.config))
+        renamed['input']['sheet']['reference']['name'] = '工时2'
+        self.assertIsNone(load_cached_tables(renamed, 'test_input.xlsx'))
+
+        self.source_sheet['D2'] = 1500.00
+        self.wb.save('test_input.xlsx')
+        self.assertIsNone(load_cached_tables(self.config, 'test_input.xlsx'))
+
+    def test_sheet_cache_eviction(self):
+        """Entries past cache_max_age_days and the oldest over cache_max_size_mb are evicted."""
+        import time
+        from main import evict_sheet_cache
+        cache_dir = self._make_cache_dir()
+        now = time.time()
+        for name, age_days in (('old', 10), ('older', 5), ('newer', 1), ('newest', 0)):
+            path = os.path.join(cache_dir, name + '.pickle')
+            with open(path, 'wb') as f:
+                f.write(b'x' * 400 * 1024)
+            os.utime(path, (now - age_days * 86400, now - age_days * 86400))
+
+        evict_sheet_cache({'cache_dir': cache_dir, 'cache_max_age_days': 7, 'cache_max_size_mb': 1})
+        self.assertEqual(sorted(os.listdir(cache_dir)), ['newer.pickle', 'newest.pickle'])
+
+    def test_validation_cache_skips_unchanged_sheets(self):
+        """Validation results are cached per sheet; only changed sheets are scanned again."""
+        import main
+        self._setup_mixed_split_data()
+        self.config['cache_dir'] = self._make_cache_dir()
+        process_excel(self.config)
+        self.assertEqual(len([name for name in os.listdir(self.config['cache_dir'])
+                              if name.startswith('validation-')]), 3)
+
+        self.reference_sheet.append(['赵六', 'FF', '研发', '1', 2])  # only the reference sheet changes
+        self.wb.save('test_input.xlsx')
+        scanned = []
+        original = main._sheet_pass_worker
+        main._sheet_pass_worker = lambda config, sheet_key, *args: scanned.append(sheet_key) or \
+            original(config, sheet_key, *args)
+        try:
+            process_excel(self.config)
+        finally:
+            main._sheet_pass_worker = original
+        self.assertEqual(scanned, ['reference'])
+
+        # Same results as a run without cache
+        expected = self._read_result_values()
+        cache_dir = self.config.pop('cache_dir')
+        process_excel(self.config)
+        self.assertEqual(expected, self._read_result_values())
+
+        # Renamed payment sheet: cached passes of the other sheets must not bring back the old name
+        self.config['cache_dir'] = cache_dir
+        self.source_sheet.append(['孙八', 'GG', '中国', 1.0, 1.0, '研发', '无此中心', 21, 'BB', '公司A'])
+        self.wb.save('test_input.xlsx')
+        self.assertIn("has no matching record in sheet '支付规则'", self._run_validation_output())
+        self.payment_sheet.title = '支付规则B'
+        self.wb.save('test_input.xlsx')
+        self.config['input']['sheet']['payment']['name'] = '支付规则B'
+        scanned.clear()
+        main._sheet_pass_worker = lambda config, sheet_key, *args: scanned.append(sheet_key) or \
+            original(config, sheet_key, *args)
+        try:
+            output = self._run_validation_output()
+        finally:
+            main._sheet_pass_worker = original
+        self.assertEqual(scanned, ['payment'])
+        self.assertIn("has no matching record in sheet '支付规则B'", output)
+        self.assertNotIn("sheet '支付规则'", output)
+
+    def test_config_invalid_cache_options(self):
+        """Non-positive cache limits -> SystemExit."""
+        from main import validate_config
+        config = self._make_minimal_config()
+        config['cache_dir'] = '.cache'
+        config['cache_max_size_mb'] = 0
+        with self.assertRaises(SystemExit):
+            validate_config(config)
+
+    def test_config_invalid_validation_workers(self):
+        """validation_workers below 1 -> SystemExit."""
+        from main import validate_config
+        config = self._make_minimal_config()
+        config['validation_workers'] = 0
+        with self.assertRaises(SystemExit):
+            validate_config(config)
+
+    def test_config_invalid_split_workers(self):
+        """split_workers below 1 -> SystemExit."""
+        from main import validate_config
+        config = self._make_minimal_config()
+        config['split_workers'] = 0
+        with self.assertRaises(SystemExit):
+            validate_config(config)
+
+    def test_config_invalid_error_budget(self):
+        """error_budget below 1 -> SystemExit."""
+        from main import validate_config
+        config = self._make_minimal_config()
+        config['error_budget'] = 0
+        with self.assertRaises(SystemExit):
+            validate_config(config)
+
+    def test_config_invalid_split_engine(self):
+        """Unknown split_engine value -> SystemExit."""
+        from main import validate_config
+        config = self._make_minimal_config()
+        config['split_engine'] = 'gpu'
+        with self.assertRaises(SystemExit):
+            validate_config(config)
+
+    def test_config_invalid_computed_engine(self):
+        """Unknown computed_engine value -> SystemExit."""
+        from main import validate_config
+        config = self._make_minimal_config()
+        config['computed_engine'] = 'gpu'
+        with self.assertRaises(SystemExit):
+            validate_config(config)
+
+    def test_config_invalid_split_arithmetic(self):
+        """Unknown split_arithmetic, or remainder_policy without cents -> SystemExit."""
+        from main import validate_config
+        for options in ({'split_arithmetic': 'decimal'},
+                        {'remainder_policy': 'largest'},
+                        {'split_arithmetic': 'cents', 'remainder_policy': 'first'},
+                        {'split_arithmetic': 'cents', 'split_engine': 'numpy'}):
+            config = self._make_minimal_config()
+            config.update(options)
+            with self.assertRaises(SystemExit):
+                validate_config(config)
+
+    def test_config_invalid_validation_engine(self):
+        """Unknown validation_engine value -> SystemExit."""
+        from main import validate_config
+        config = self._make_minimal_config()
+        config['validation_engine'] = 'fast'
+        with self.assertRaises(SystemExit):
+            validate_config(config)
+
 
 if __name__ == '__main__':
     unittest.main()